@@ -0,0 +1,96 @@
+"""
+Follow a whole CloudWatch log group instead of one stream at a time.
+
+One filter_log_events query (paged) per poll covers every child's stream
+under `stream_prefix`, from the run's start time on. Each poll re-reads a short
+overlap window, because events can be ingested a little after their timestamp,
+and skips event IDs it has already printed. Throttling is retried with a
+growing interval, so lines are delayed rather than dropped. The interval
+shrinks back after a clean poll.
+
+Lines are printed with a per-shard prefix in the style of `kubectl logs
+--prefix` ("[job/<name>:<index>/<container>] ..."). The stream -> index
+mapping comes from the caller (the array tracker); lines of streams that can't
+be labelled yet are held back for up to `hold_seconds`.
+"""
+import time
+
+from botocore.exceptions import ClientError
+
+OVERLAP_MS = 60_000     # re-read window for late-ingested events
+THROTTLED = ("ThrottlingException", "TooManyRequestsException", "LimitExceededException")
+
+
+class LogFollower:
+    def __init__(self, logs, group, stream_prefix, start_ms, label=lambda stream: None,
+                 min_interval=2.0, max_interval=30.0, hold_seconds=10.0, clock=time.monotonic, sleep=time.sleep):
+        self.logs = logs
+        self.group = group
+        self.stream_prefix = stream_prefix
+        self.start_ms = int(start_ms)
+        self.label = label      # stream name -> prefix like "job/qelabs:3/default", or None if unknown yet
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval    # what the caller should wait before the next poll
+        self.hold_seconds = hold_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.newest_ms = self.start_ms
+        self.seen = {}          # eventId -> timestamp, pruned to the overlap window
+        self.held = []          # (first seen, event) whose stream has no label yet
+        self.printed = 0
+        self.throttled = 0
+
+    def _page(self, kwargs):
+        """One filter_log_events page; on throttling wait (longer each time) and retry it."""
+        while True:
+            try:
+                return self.logs.filter_log_events(**kwargs)
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code == "ResourceNotFoundException":
+                    return {"events": []}   # log group appears with the first stream
+                if code not in THROTTLED:
+                    raise
+                self.throttled += 1
+                self.interval = min(self.max_interval, self.interval * 2)
+                self.sleep(self.interval)
+
+    def _emit(self, event, prefix):
+        for line in event["message"].rstrip("\n").split("\n"):
+            print(f"[{prefix}] {line}")
+        self.printed += 1
+
+    def poll(self, final=False):
+        """Print every new event since the last poll. With final, also flush held lines unlabelled."""
+        since = max(self.start_ms, self.newest_ms - OVERLAP_MS)
+        kwargs = {"logGroupName": self.group, "logStreamNamePrefix": self.stream_prefix, "startTime": since}
+        fresh = []
+        throttled = self.throttled
+        while True:
+            resp = self._page(kwargs)
+            for event in resp.get("events", []):
+                if event["eventId"] in self.seen:
+                    continue
+                self.seen[event["eventId"]] = event["timestamp"]
+                self.newest_ms = max(self.newest_ms, event["timestamp"])
+                fresh.append(event)
+            if not resp.get("nextToken"):
+                break
+            kwargs["nextToken"] = resp["nextToken"]
+
+        cutoff = self.newest_ms - OVERLAP_MS
+        self.seen = {eid: ts for eid, ts in self.seen.items() if ts >= cutoff}
+        if self.throttled == throttled:
+            self.interval = max(self.min_interval, self.interval * 0.75)
+
+        now = self.clock()
+        pending = self.held + [(now, e) for e in sorted(fresh, key=lambda e: e["timestamp"])]
+        self.held = []
+        for first_seen, event in pending:
+            prefix = self.label(event["logStreamName"])
+            if prefix is None and not final and now - first_seen < self.hold_seconds:
+                self.held.append((first_seen, event))
+                continue
+            self._emit(event, prefix or event["logStreamName"])
+        return len(fresh)
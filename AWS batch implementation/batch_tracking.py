@@ -0,0 +1,92 @@
+"""
+Status tracking for a Batch array job at a flat API-call rate.
+
+The parent's arrayProperties.statusSummary already counts children per status,
+so each tick costs one describe_jobs on the parent. Children (IDs are
+"<parent>:<index>") are described only while the summary shows changes we
+haven't seen yet, at most `budget` per tick in batches of 100. A child that has
+reached SUCCEEDED/FAILED is cached and never described again.
+"""
+
+TERMINAL = {"SUCCEEDED", "FAILED"}
+STARTED = {"STARTING", "RUNNING", "SUCCEEDED", "FAILED"}
+DESCRIBE_BATCH = 100   # describe_jobs maximum
+
+
+class ArrayJobTracker:
+    def __init__(self, batch, parent_id, size=None, budget=200):
+        self.batch = batch
+        self.parent_id = parent_id
+        self.size = size
+        self.budget = budget            # child describes per tick
+        self.status = None
+        self.summary = {}
+        self.children = {}              # index -> {"status", "logStreamName"}
+        self.streams = {}               # log stream name (any attempt) -> index
+        self.calls = 0                  # describe_jobs calls so far
+        self._run_cursor = 0            # round-robin positions in the running / not-started lists
+        self._cursor = 0
+
+    def _describe(self, job_ids):
+        self.calls += 1
+        return self.batch.describe_jobs(jobs=job_ids)["jobs"]
+
+    def _known(self, statuses):
+        return sum(1 for c in self.children.values() if c["status"] in statuses)
+
+    def tick(self):
+        """Refresh the parent and, if needed, a bounded number of children."""
+        parent = self._describe([self.parent_id])[0]
+        self.status = parent["status"]
+        arr = parent.get("arrayProperties") or {}
+        self.size = self.size or arr.get("size")
+        self.summary = arr.get("statusSummary") or {}
+
+        if self.behind() and self.size:
+            self._refresh_children()
+
+    def behind(self):
+        """True while the summary reports more started/finished children than we have described."""
+        return (sum(int(self.summary.get(s, 0)) for s in STARTED) > self._known(STARTED) or
+                sum(int(self.summary.get(s, 0)) for s in TERMINAL) > self._known(TERMINAL))
+
+    @staticmethod
+    def _rotate(items, cursor):
+        if not items:
+            return items
+        start = cursor % len(items)
+        return items[start:] + items[:start]
+
+    def _refresh_children(self):
+        status = {i: self.children.get(i, {}).get("status") for i in range(self.size)}
+        # children we've seen running change next, the rest after them. Both lists are
+        # visited round-robin and, while both are non-empty, the rest keep at least half
+        # the budget, so with more than `budget` running no child is starved
+        running = self._rotate([i for i, s in status.items() if s in STARTED - TERMINAL], self._run_cursor)
+        rest = self._rotate([i for i, s in status.items() if s not in STARTED], self._cursor)
+        running = running[:self.budget - min(len(rest), self.budget // 2)]
+        rest = rest[:self.budget - len(running)]
+        self._run_cursor += len(running)
+        self._cursor += len(rest)
+        pick = running + rest
+        for i in range(0, len(pick), DESCRIBE_BATCH):
+            ids = [f"{self.parent_id}:{idx}" for idx in pick[i:i + DESCRIBE_BATCH]]
+            for job in self._describe(ids):
+                idx = int(job["jobId"].rsplit(":", 1)[1])
+                self.children[idx] = {"status": job["status"],
+                                      "logStreamName": (job.get("container") or {}).get("logStreamName")}
+                for c in [job.get("container") or {}] + [a.get("container") or {} for a in job.get("attempts", [])]:
+                    if c.get("logStreamName"):
+                        self.streams[c["logStreamName"]] = idx
+
+    def done(self):
+        finished = int(self.summary.get("SUCCEEDED", 0)) + int(self.summary.get("FAILED", 0))
+        return self.status in TERMINAL or bool(self.size and finished >= self.size)
+
+    def line(self):
+        order = ["SUBMITTED", "PENDING", "RUNNABLE", "STARTING", "RUNNING", "SUCCEEDED", "FAILED"]
+        counts = " ".join(f"{s}={self.summary[s]}" for s in order if self.summary.get(s))
+        return f"[array {self.status}] {counts} (describe calls: {self.calls})"
+
+    def failed_indexes(self):
+        return sorted(i for i, c in self.children.items() if c["status"] == "FAILED")
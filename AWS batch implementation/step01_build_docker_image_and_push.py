@@ -1,11 +1,13 @@
 # Skip this if already done.  Rerun if you have a new image to build and push.
 
-import os, subprocess
+import os, subprocess, base64
 from pathlib import Path
 import tomllib
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utilities import *
+import aws_clients
+from bootstrap import bootstrap
 
 directory = os.path.dirname(os.path.abspath(__file__))
 config_path = Path(os.path.join(directory,"config.toml"))
@@ -23,28 +25,28 @@ AWS = config["paths"]["AWS"]
 # Docker Desktop for building and pushing containerized applications up to the cloud
 DOCKER  = config["paths"]["DOCKER"]
 
-# SSO login
-ensure_sso_logged_in(AWS, PROFILE)
-
-REGION = subprocess.check_output(
-    [AWS, "configure", "get", "region", "--profile", PROFILE],
-    text=True
-).strip()
+# SSO login, region and account (cached per SSO session, see bootstrap.py)
+ctx = bootstrap(AWS, PROFILE)
+REGION = ctx.region
 
 os.environ["AWS_PROFILE"] = PROFILE
 os.environ["AWS_PAGER"] = ""  # disable the built-in pager
 
 # Amazon Elastic Container Registry
 # Discover account ID and ECR registry
-ACCOUNT_ID = subprocess.check_output([AWS,"sts","get-caller-identity","--query","Account","--output","text"], text=True).strip()
-ECR_URI = f"{ACCOUNT_ID}.dkr.ecr.{REGION}.amazonaws.com/{ECR_REPO}:{IMAGE_TAG}"
+ACCOUNT_ID = ctx.account_id
+ECR_URI = ctx.ecr_uri(ECR_REPO, IMAGE_TAG)
+
+ecr = aws_clients.client("ecr", PROFILE, REGION)
 
 # create container repo if not already exist
-if subprocess.call([AWS,"ecr","describe-repositories","--repository-names",ECR_REPO,"--region",REGION]) != 0:
-    sh([AWS,"ecr","create-repository","--repository-name",ECR_REPO,"--image-scanning-configuration","scanOnPush=true","--region",REGION])
+if aws_clients.call_json("ecr", "describe_repositories", PROFILE, REGION, repositoryNames=[ECR_REPO]) is None:
+    ecr.create_repository(repositoryName=ECR_REPO, imageScanningConfiguration={"scanOnPush": True})
+    print(f"✔ Created ECR repository {ECR_REPO}")
 
-# Login docker to ECR
-pwd = subprocess.check_output([AWS, "ecr", "get-login-password", "--region", REGION], text=True)
+# Login docker to ECR (same token `aws ecr get-login-password` prints)
+token = ecr.get_authorization_token()["authorizationData"][0]["authorizationToken"]
+pwd = base64.b64decode(token).decode().split(":", 1)[1]
 subprocess.run(
     [DOCKER, "login", "--username", "AWS", "--password-stdin", f"{ACCOUNT_ID}.dkr.ecr.{REGION}.amazonaws.com"],
     input=pwd, text=True, check=True
@@ -1,13 +1,17 @@
 # Skip this if already done once
 
-import os, json, time, subprocess
+import os, json, subprocess
 from pathlib import Path
 import tomllib
 import boto3
 from botocore.exceptions import ClientError
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utilities import ensure_sso_logged_in, create_bucket, sh  # from your utilities.py
+from utilities import create_bucket, sh  # from your utilities.py
+import aws_clients
+from bootstrap import bootstrap
+from waiters import wait_for, wait_all
+from provision_dag import Dag
 
 directory = os.path.dirname(os.path.abspath(__file__))
 config_path = Path(os.path.join(directory,"config.toml"))
@@ -22,30 +26,30 @@ BATCH_ENV     = config["AWS_profile"]["BATCH_ENV"]
 BATCH_QUEUE   = config["AWS_profile"]["BATCH_QUEUE"]
 BATCH_JOB_DEF = config["AWS_profile"]["BATCH_JOB_DEF"]
 LOG_GROUP = config["AWS_profile"]["LOG_GROUP"]
+WORKER_VCPUS = config["AWS_profile"].get("worker_vcpus", 1)
+WORKER_MEMORY_MIB = config["AWS_profile"].get("worker_memory_mib", 2048)
 
 AWS = config["paths"]["AWS"]
 
-# SSO login + region
-ensure_sso_logged_in(AWS, PROFILE)
-os.environ["AWS_PROFILE"] = PROFILE
-os.environ["AWS_PAGER"] = ""
-REGION = subprocess.check_output(
-    [AWS, "configure", "get", "region", "--profile", PROFILE], text=True
-).strip()
+# SSO login, region and account (cached per SSO session, see bootstrap.py)
+ctx = bootstrap(AWS, PROFILE)
+REGION = ctx.region
 
-session = boto3.Session(profile_name=PROFILE, region_name=REGION)
+session = ctx.session
 iam   = session.client("iam")
 ec2   = session.client("ec2")
 batch = session.client("batch")
 sts   = session.client("sts")
 logs  = session.client("logs")
 
-ACCOUNT_ID = sts.get_caller_identity()["Account"]
-bucket_name = f"{BUCKET_PREFIX}{REGION}-{ACCOUNT_ID}"
-ecr_uri = f"{ACCOUNT_ID}.dkr.ecr.{REGION}.amazonaws.com/{ECR_REPO}:{IMAGE_TAG}"
+ACCOUNT_ID = ctx.account_id
+bucket_name = ctx.bucket_name(BUCKET_PREFIX)
+ecr_uri = ctx.ecr_uri(ECR_REPO, IMAGE_TAG)
 
-# 1) S3 bucket (idempotent)
-create_bucket(bucket_name, REGION, profile=PROFILE)
+# Each ensure_* below is one node of the provisioning graph at the end of
+# this script; independent nodes run in parallel.
+
+# 1) S3 bucket (idempotent): create_bucket from utilities.py
 
 # 2) VPC & networking defaults (if not provided)
 def default_vpc_sg_subnets():
@@ -63,10 +67,6 @@ def default_vpc_sg_subnets():
         raise RuntimeError("Could not find default security group.")
     return subnet_ids, sg_id
 
-auto_subnets, auto_sg = default_vpc_sg_subnets()
-SUBNET_IDS = auto_subnets
-SECURITY_GROUP = auto_sg
-
 # 3) IAM roles
 #    - AWSBatchServiceRole (managed service-linked; auto when creating compute env)
 #    - Execution role: ecsTaskExecutionRole (pull from ECR + logs)
@@ -104,36 +104,39 @@ def ensure_role(name, assume_service, managed_policies=None, inline_policy=None)
         iam.put_role_policy(RoleName=name, PolicyName=f"{name}-inline", PolicyDocument=json.dumps(inline_policy))
     return arn
 
-exec_role_arn = ensure_role(
-    "ecsTaskExecutionRole",
-    f"ecs-tasks.amazonaws.com",
-    managed_policies=[
-        "arn:aws:iam::aws:policy/service-role/AmazonECSTaskExecutionRolePolicy", # ECR pull + logs
-    ],
-)
+def ensure_exec_role():
+    return ensure_role(
+        "ecsTaskExecutionRole",
+        f"ecs-tasks.amazonaws.com",
+        managed_policies=[
+            "arn:aws:iam::aws:policy/service-role/AmazonECSTaskExecutionRolePolicy", # ECR pull + logs
+        ],
+    )
 
 job_role_policy = {
     "Version":"2012-10-17",
     "Statement":[
         {"Effect":"Allow","Action":["s3:ListBucket"],"Resource":[f"arn:aws:s3:::{bucket_name}"]},
-        {"Effect":"Allow","Action":["s3:GetObject","s3:PutObject","s3:DeleteObject"],"Resource":[f"arn:aws:s3:::{bucket_name}/*"]},
+        {"Effect":"Allow","Action":["s3:GetObject","s3:PutObject","s3:DeleteObject","s3:AbortMultipartUpload"],"Resource":[f"arn:aws:s3:::{bucket_name}/*"]},
         {"Effect":"Allow","Action":["ecr:GetAuthorizationToken","ecr:BatchCheckLayerAvailability","ecr:GetDownloadUrlForLayer","ecr:BatchGetImage"],"Resource":"*"}
 ]}
-job_role_arn = ensure_role(
-    "qelabs-batch-job-role",
-    f"ecs-tasks.amazonaws.com",
-    managed_policies=[],
-    inline_policy=job_role_policy
-)
+def ensure_job_role():
+    return ensure_role(
+        "qelabs-batch-job-role",
+        f"ecs-tasks.amazonaws.com",
+        managed_policies=[],
+        inline_policy=job_role_policy
+    )
 
 # 4) CloudWatch Logs group
-try:
-    logs.create_log_group(logGroupName=LOG_GROUP)
-    print(f"✔ Created log group {LOG_GROUP}")
-except ClientError as e:
-    if e.response["Error"]["Code"] != "ResourceAlreadyExistsException":
-        raise
-    print(f"✔ Log group exists: {LOG_GROUP}")
+def ensure_log_group():
+    try:
+        logs.create_log_group(logGroupName=LOG_GROUP)
+        print(f"✔ Created log group {LOG_GROUP}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ResourceAlreadyExistsException":
+            raise
+        print(f"✔ Log group exists: {LOG_GROUP}")
 
 import botocore
 
@@ -163,27 +166,22 @@ def ensure_batch_service_linked_role(iam_client):
             raise
 
 
-def wait_for_ce_valid(batch_client, ce_name):
-    import time
-    while True:
-        ce = batch_client.describe_compute_environments(
-            computeEnvironments=[ce_name]
-        )["computeEnvironments"][0]
-        status = ce["status"]
-        reason = ce.get("statusReason", "")
-        state  = ce["state"]
-        print(f"[wait] CE state={state} status={status} reason={reason}")
-        if status == "VALID":
-            print("✔ Compute environment VALID")
-            return
-        if status == "INVALID":
-            raise RuntimeError(f"Compute environment INVALID: {reason}")
-        time.sleep(5)
+def ce_status(batch_client, ce_name):
+    ces = batch_client.describe_compute_environments(computeEnvironments=[ce_name])["computeEnvironments"]
+    return ces[0]["status"] if ces else None
+
+def jq_status(batch_client, jq_name):
+    jqs = batch_client.describe_job_queues(jobQueues=[jq_name])["jobQueues"]
+    return jqs[0]["status"] if jqs else None
 
-# Ensure the Batch service-linked role exists (preferred modern setup)
-ensure_batch_service_linked_role(iam)
+def wait_for_ce_valid(batch_client, ce_name):
+    def reason():
+        ce = batch_client.describe_compute_environments(computeEnvironments=[ce_name])["computeEnvironments"][0]
+        return ce.get("statusReason", "")
+    wait_for(f"compute environment {ce_name}", lambda: ce_status(batch_client, ce_name),
+             done=lambda s: s == "VALID", failed=lambda s: s == "INVALID" and (reason() or True), initial=2)
 
-def recreate_ce_to_use_slr():
+def recreate_ce_to_use_slr(subnet_ids, security_group):
     # Disable → wait → delete → recreate (no serviceRole)
     try:
         batch.update_compute_environment(computeEnvironment=BATCH_ENV, state="DISABLED")
@@ -191,11 +189,9 @@ def recreate_ce_to_use_slr():
         pass
 
     # wait until not UPDATING
-    while True:
-        ce = batch.describe_compute_environments(computeEnvironments=[BATCH_ENV])["computeEnvironments"][0]
-        if ce["status"] != "UPDATING":
-            break
-        time.sleep(3)
+    wait_for(f"compute environment {BATCH_ENV} disabled", lambda: ce_status(batch, BATCH_ENV),
+             done=lambda s: s != "UPDATING", initial=1)
+    ce = batch.describe_compute_environments(computeEnvironments=[BATCH_ENV])["computeEnvironments"][0]
 
     # If a job queue still references it, delete or detach it first
     jqs = batch.describe_job_queues().get("jobQueues", [])
@@ -204,15 +200,18 @@ def recreate_ce_to_use_slr():
                        for o in jq.get("computeEnvironmentOrder", []))]
     for q in blockers:
         batch.update_job_queue(jobQueue=q, state="DISABLED")
-        # wait
-        while True:
-            s = batch.describe_job_queues(jobQueues=[q])["jobQueues"][0]["status"]
-            if s != "UPDATING": break
-            time.sleep(2)
+    wait_all(lambda q=q: wait_for(f"job queue {q} disabled", lambda: jq_status(batch, q),
+                                  done=lambda s: s != "UPDATING", initial=1) for q in blockers)
+    for q in blockers:
         batch.delete_job_queue(jobQueue=q)
+    # the CE can only be deleted once no queue references it
+    wait_all(lambda q=q: wait_for(f"job queue {q} deletion", lambda: jq_status(batch, q),
+                                  done=lambda s: s in (None, "DELETED"), initial=1) for q in blockers)
 
     # delete CE
     batch.delete_compute_environment(computeEnvironment=BATCH_ENV)
+    wait_for(f"compute environment {BATCH_ENV} deletion", lambda: ce_status(batch, BATCH_ENV),
+             done=lambda s: s in (None, "DELETED"), initial=2)
 
     # recreate CE (no serviceRole -> uses AWSServiceRoleForBatch)
     batch.create_compute_environment(
@@ -222,13 +221,14 @@ def recreate_ce_to_use_slr():
         computeResources={
             "type": "FARGATE",
             "maxvCpus": 30,              # match your quota
-            "subnets": SUBNET_IDS,
-            "securityGroupIds": [SECURITY_GROUP],
+            "subnets": subnet_ids,
+            "securityGroupIds": [security_group],
         },
     )
     wait_for_ce_valid(batch, BATCH_ENV)
 
-def ensure_compute_env():
+def ensure_compute_env(network):
+    subnet_ids, security_group = network
     resp = batch.describe_compute_environments(computeEnvironments=[BATCH_ENV])
     if resp.get("computeEnvironments"):
         ce = resp["computeEnvironments"][0]
@@ -238,7 +238,7 @@ def ensure_compute_env():
         # If it's INVALID due to AWSBatchServiceRole, recreate to use service-linked role
         if status == "INVALID" and "AWSBatchServiceRole" in reason:
             print("↻ Recreating compute environment to use service-linked role …")
-            recreate_ce_to_use_slr()
+            recreate_ce_to_use_slr(subnet_ids, security_group)
             return
         # Otherwise, just wait until VALID (handles UPDATING/ENABLED/DISABLED)
         wait_for_ce_valid(batch, BATCH_ENV)
@@ -253,8 +253,8 @@ def ensure_compute_env():
         computeResources={
             "type": "FARGATE",
             "maxvCpus": 30,
-            "subnets": SUBNET_IDS,
-            "securityGroupIds": [SECURITY_GROUP],
+            "subnets": subnet_ids,
+            "securityGroupIds": [security_group],
         },
     )
     wait_for_ce_valid(batch, BATCH_ENV)
@@ -275,40 +275,62 @@ def ensure_job_queue():
         priority=1,
         computeEnvironmentOrder=[{"order":1,"computeEnvironment":BATCH_ENV}],
     )
-    while True:
-        jq = batch.describe_job_queues(jobQueues=[BATCH_QUEUE])["jobQueues"][0]
-        if jq["status"] == "VALID": break
-        time.sleep(5)
+    wait_for(f"job queue {BATCH_QUEUE}", lambda: jq_status(batch, BATCH_QUEUE),
+             done=lambda s: s == "VALID", failed=lambda s: s == "INVALID", initial=1)
     print("✔ Job queue CREATED and VALID")
 
-def ensure_job_def() -> str:
-    # find latest ACTIVE
+def ensure_job_def(exec_role_arn, job_role_arn) -> str:
+    resource_requirements = [         # <-- Fargate requires this form
+        {"type": "VCPU", "value": str(WORKER_VCPUS)},
+        {"type": "MEMORY", "value": str(WORKER_MEMORY_MIB)}
+    ]
+    # a failed child is retried once; the worker resumes from its last checkpoint
+    retry_strategy = {"attempts": 2}
+    environment = [
+        {"name": "BUCKET",      "value": bucket_name},
+        {"name": "INPUT_BASE",  "value": "input/"},
+        {"name": "OUTPUT_BASE", "value": "output/"},
+        {"name": "PROCESS_CAP", "value": "1000"},
+        {"name": "FETCH_WORKERS", "value": "16"},
+        {"name": "PREFETCH_DEPTH", "value": "64"},
+        {"name": "AWS_DEFAULT_REGION", "value": REGION},
+    ]
+    # find latest ACTIVE; reuse it unless the image, environment, task size or retry policy changed
     resp = batch.describe_job_definitions(jobDefinitionName=BATCH_JOB_DEF, status="ACTIVE")
     if resp.get("jobDefinitions"):
         jd = sorted(resp["jobDefinitions"], key=lambda d: d["revision"])[-1]
         name_rev = f'{jd["jobDefinitionName"]}:{jd["revision"]}'
-        print(f"✔ Job definition exists: {name_rev}")
-        return name_rev
+        props = jd.get("containerProperties", {})
+        have = {r["type"]: r["value"] for r in props.get("resourceRequirements", [])}
+        have_attempts = jd.get("retryStrategy", {}).get("attempts", 1)
+        have_env = {e["name"]: e["value"] for e in props.get("environment", [])}
+        want_env = {e["name"]: e["value"] for e in environment}
+        changed = []
+        if have != {r["type"]: r["value"] for r in resource_requirements}:
+            changed.append(f"resources {have}")
+        if have_attempts != retry_strategy["attempts"]:
+            changed.append(f"attempts={have_attempts}")
+        if props.get("image") != ecr_uri:
+            changed.append(f"image {props.get('image')}")
+        if have_env != want_env:
+            diff = sorted(k for k in have_env.keys() | want_env.keys() if have_env.get(k) != want_env.get(k))
+            changed.append(f"environment differs in {', '.join(diff)}")
+        if not changed:
+            print(f"✔ Job definition exists: {name_rev}")
+            return name_rev
+        print(f"↻ Job definition {name_rev} has {'; '.join(changed)}; registering a new revision")
 
     jd_resp = batch.register_job_definition(
         jobDefinitionName=BATCH_JOB_DEF,
         type="container",
         platformCapabilities=["FARGATE"],   # <-- top-level, not in containerProperties
+        retryStrategy=retry_strategy,
         containerProperties={
             "image": ecr_uri,
             "executionRoleArn": exec_role_arn,
             "jobRoleArn": job_role_arn,
-            "resourceRequirements": [         # <-- Fargate requires this form
-                {"type": "VCPU", "value": "1"},
-                {"type": "MEMORY", "value": "2048"}
-            ],
-            "environment": [
-                {"name": "BUCKET",      "value": bucket_name},
-                {"name": "INPUT_BASE",  "value": "input/"},
-                {"name": "OUTPUT_BASE", "value": "output/"},
-                {"name": "PROCESS_CAP", "value": "1000"},
-                {"name": "AWS_DEFAULT_REGION", "value": REGION},
-            ],
+            "resourceRequirements": resource_requirements,
+            "environment": environment,
             "logConfiguration": {
                 "logDriver": "awslogs",
                 "options": {
@@ -332,9 +354,22 @@ def ensure_job_def() -> str:
     return name_rev
 
 
-ensure_compute_env()
-ensure_job_queue()
-ensure_job_def()
+# Provisioning graph: the bucket, network lookup, roles and log group are
+# independent; the CE needs the network (and the service-linked role), the
+# queue needs the CE, the job definition needs both roles.
+dag = Dag()
+dag.add("bucket", lambda: create_bucket(bucket_name, REGION, profile=PROFILE))
+dag.add("network", default_vpc_sg_subnets)
+dag.add("exec_role", ensure_exec_role)
+dag.add("job_role", ensure_job_role)
+dag.add("log_group", ensure_log_group)
+dag.add("batch_slr", lambda: ensure_batch_service_linked_role(iam))
+dag.add("compute_env", lambda network, _: ensure_compute_env(network), deps=("network", "batch_slr"))
+dag.add("job_queue", lambda _: ensure_job_queue(), deps=("compute_env",))
+dag.add("job_def", lambda exec_arn, job_arn, _: ensure_job_def(exec_arn, job_arn),
+        deps=("exec_role", "job_role", "log_group"))
+results = dag.run()
+SUBNET_IDS, SECURITY_GROUP = results["network"]
 
 print(f"""
 ===========================================
@@ -5,7 +5,9 @@ import boto3
 from botocore.exceptions import ClientError
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utilities import ensure_sso_logged_in
+import aws_clients
+from bootstrap import bootstrap
+from vpc_endpoints import reconcile_endpoints
 
 directory = os.path.dirname(os.path.abspath(__file__))
 config_path = Path(os.path.join(directory,"config.toml"))
@@ -17,12 +19,10 @@ SUBNET_IDS     = config["AWS_profile"].get("SUBNET_IDS", [])
 SECURITY_GROUP = config["AWS_profile"].get("SECURITY_GROUP", "")
 AWS            = config["paths"]["AWS"]
 
-ensure_sso_logged_in(AWS, PROFILE)
-os.environ["AWS_PROFILE"] = PROFILE
-os.environ["AWS_PAGER"] = ""
-REGION = subprocess.check_output([AWS, "configure", "get", "region", "--profile", PROFILE], text=True).strip()
+ctx = bootstrap(AWS, PROFILE)
+REGION = ctx.region
 
-session = boto3.Session(profile_name=PROFILE, region_name=REGION)
+session = ctx.session
 ec2 = session.client("ec2")
 
 # ---- helpers ----
@@ -70,88 +70,6 @@ def get_route_tables_for_subnets(vpc_id, subnet_ids):
     rtb_ids = set(by_subnet.get(sid, main_rtb) for sid in subnet_ids)
     return [r for r in rtb_ids if r]
 
-def ensure_interface_endpoint(vpc_id, service, subnets, sg_id):
-    svc_name = f"com.amazonaws.{REGION}.{service}"
-    res = ec2.describe_vpc_endpoints(Filters=[
-        {"Name": "vpc-id", "Values": [vpc_id]},
-        {"Name": "service-name", "Values": [svc_name]},
-        {"Name": "vpc-endpoint-type", "Values": ["Interface"]},
-    ])["VpcEndpoints"]
-
-    if res:
-        vpe = res[0]
-        want_subs = set(subnets)
-        have_subs = set(vpe.get("SubnetIds", []))
-        have_sg_ids = {g["GroupId"] for g in vpe.get("Groups", [])}
-        want_sg_ids = {sg_id} if sg_id else set()
-
-        add_subs = list(want_subs - have_subs)
-        add_sgs  = list(want_sg_ids - have_sg_ids)
-
-        if add_subs or add_sgs:
-            kwargs = {"VpcEndpointId": vpe["VpcEndpointId"]}
-            if add_subs:
-                kwargs["AddSubnetIds"] = add_subs
-            if add_sgs:
-                kwargs["AddSecurityGroupIds"] = add_sgs
-            ec2.modify_vpc_endpoint(**kwargs)
-            print(f"✔ Updated interface endpoint {service} (added: "
-                  f"{'subs ' + ','.join(add_subs) if add_subs else ''} "
-                  f"{'sgs ' + ','.join(add_sgs) if add_sgs else ''})")
-        else:
-            print(f"✔ Interface endpoint exists: {service}")
-        return vpe["VpcEndpointId"]
-
-    resp = ec2.create_vpc_endpoint(
-        VpcEndpointType="Interface",
-        VpcId=vpc_id,
-        ServiceName=svc_name,
-        SubnetIds=subnets,
-        SecurityGroupIds=[sg_id] if sg_id else [],
-        PrivateDnsEnabled=True,
-    )
-    vpe_id = resp["VpcEndpoint"]["VpcEndpointId"]
-    print(f"✔ Created interface endpoint {service}: {vpe_id}")
-    return vpe_id
-
-
-
-
-def ensure_gateway_endpoint(vpc_id, service, route_table_ids):
-    svc_name = f"com.amazonaws.{REGION}.{service}"
-    res = ec2.describe_vpc_endpoints(Filters=[
-        {"Name":"vpc-id","Values":[vpc_id]},
-        {"Name":"service-name","Values":[svc_name]},
-        {"Name":"vpc-endpoint-type","Values":["Gateway"]}
-    ])["VpcEndpoints"]
-
-    if res:
-        vpe = res[0]
-        # For Gateway endpoints, RouteTableIds is already list[str]
-        have_rts = set(vpe.get("RouteTableIds", []))
-        want_rts = set(route_table_ids)
-        missing = list(want_rts - have_rts)
-        if missing:
-            ec2.modify_vpc_endpoint(
-                VpcEndpointId=vpe["VpcEndpointId"],
-                AddRouteTableIds=missing
-            )
-            print(f"✔ Updated gateway endpoint {service} with RTs: {missing}")
-        else:
-            print(f"✔ Gateway endpoint exists: {service}")
-        return vpe["VpcEndpointId"]
-
-    resp = ec2.create_vpc_endpoint(
-        VpcEndpointType="Gateway",
-        VpcId=vpc_id,
-        ServiceName=svc_name,
-        RouteTableIds=route_table_ids
-    )
-    vpe_id = resp["VpcEndpoint"]["VpcEndpointId"]
-    print(f"✔ Created gateway endpoint {service}: {vpe_id}")
-    return vpe_id
-
-
 # ---- run ----
 vpc_id, subnet_ids = resolve_vpc_and_subnets()
 print(f"VPC: {vpc_id}")
@@ -171,10 +89,7 @@ if not SECURITY_GROUP:
 # - STS (Interface) for auth
 # - Logs (Interface) for CloudWatch Logs
 rtb_ids = get_route_tables_for_subnets(vpc_id, subnet_ids)
-ensure_gateway_endpoint(vpc_id, "s3", rtb_ids)
-ensure_interface_endpoint(vpc_id, "ecr.api", subnet_ids, SECURITY_GROUP)
-ensure_interface_endpoint(vpc_id, "ecr.dkr", subnet_ids, SECURITY_GROUP)
-ensure_interface_endpoint(vpc_id, "sts", subnet_ids, SECURITY_GROUP)
-ensure_interface_endpoint(vpc_id, "logs", subnet_ids, SECURITY_GROUP)
+reconcile_endpoints(ec2, vpc_id, REGION, subnet_ids, [SECURITY_GROUP], rtb_ids,
+                    interface=("ecr.api", "ecr.dkr", "sts", "logs"), gateway=("s3",))
 
 print("✅ Private endpoints ready for Batch on Fargate.")
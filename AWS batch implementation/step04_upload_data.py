@@ -7,7 +7,15 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utilities import *
+import aws_clients
+from bootstrap import bootstrap
+from data_formats import (MANIFEST_NAME, get_manifest, put_manifest, stage_binary_shard, stage_packed_files,
+                          stage_packed_shard)
+from s3_upload import UploadCache, sync_files, upload_client, walk_sources
+from shard_planner import corpus_folders, plan_shards, skew_report
+from s3_purge import purge_prefix
 from tqdm import tqdm
+import boto3
 
 
 directory = os.path.dirname(os.path.abspath(__file__))
@@ -18,30 +26,122 @@ with open(config_path, "rb") as f:
 PROFILE = config["AWS_profile"]["aws_profile"]
 BUCKET_PREFIX = config["AWS_profile"]["BUCKET_PREFIX"]
 shards = config["AWS_profile"]["shards"]
+input_format = config["AWS_profile"].get("input_format", "json")
+pack_shards = config["AWS_profile"].get("pack_shards", False)
+upload_workers = config["AWS_profile"].get("upload_workers", 32)
+purge_before_upload = config["AWS_profile"].get("purge_before_upload", False)
+reconcile_upload_cache = config["AWS_profile"].get("reconcile_upload_cache", False)
+balance_shards = config["AWS_profile"].get("balance_shards", False)
+upload_encoding = config["AWS_profile"].get("upload_encoding", "identity")
 data_path = config["paths"]["data_path"]
 
 # AWS Command Line Interface (CLI)
 AWS = config["paths"]["AWS"]
 
-# SSO login
-ensure_sso_logged_in(AWS, PROFILE)
+# SSO login, region and account (cached per SSO session, see bootstrap.py)
+ctx = bootstrap(AWS, PROFILE)
+REGION = ctx.region
 
-os.environ["AWS_PROFILE"] = PROFILE
-os.environ["AWS_PAGER"] = ""  # disable the built-in pager
+ACCOUNT_ID = ctx.account_id
+bucket_name = ctx.bucket_name(BUCKET_PREFIX)
+session = ctx.session
+s3 = upload_client(session, upload_workers)
 
-REGION = subprocess.check_output(
-    [AWS, "configure", "get", "region", "--profile", PROFILE],
-    text=True
-).strip()
+# Local record of what is already uploaded (path, size, mtime, MD5, ETag), so unchanged files are skipped
+cache = UploadCache(os.path.join(data_path, ".upload_cache", f"{bucket_name}.json"))
 
-ACCOUNT_ID = subprocess.check_output([AWS,"sts","get-caller-identity","--query","Account","--output","text"], text=True).strip()
-bucket_name = f"{BUCKET_PREFIX}{REGION}-{ACCOUNT_ID}"
+if purge_before_upload:
+    # delete content of bucket first (warning - you might inadvertently delete stuff you need)
+    if purge_prefix(s3, bucket_name, "", workers=upload_workers)["failed"]:
+        raise RuntimeError(f"Could not empty s3://{bucket_name}; fix the errors above and rerun step04")
+    cache.clear()
+    previous = {}
+else:
+    # the manifests of the last upload (one GET per shard) record the ETags the bucket
+    # held: forget cached entries they contradict, e.g. written from another machine
+    previous = {i: get_manifest(s3, bucket_name, f"input/{i}/") for i in range(1, shards+1)}
+    if reconcile_upload_cache:
+        # opt-in repair: one listing of input/ also catches objects deleted or rewritten by hand
+        stale = cache.reconcile(s3, bucket_name, ["input/"])
+    else:
+        stale = cache.reconcile_etags({o["key"]: o["etag"] for m in previous.values() if m for o in m["objects"]})
+    if stale:
+        print(f"ℹ {stale} cached uploads no longer match the bucket")
 
-# uncomment to delete content of bucket first (warning - you might inadvertently delete stuff you need)
-sh([AWS, "s3", "rm", f"s3://{bucket_name}/", "--recursive"])
-# Upload files
-for i in tqdm(range(1, shards+1)):
-    src = fr"{data_path}\{i}"
-    dst = f"s3://{bucket_name}/input/{i}/"
-    # Note: include/exclude order matters; exclude * then include pattern
-    sh([AWS, "s3", "sync", src, dst])
\ No newline at end of file
+# With balance_shards every numbered data folder is uploaded and the files are
+# re-assigned to `shards` shards by size; otherwise folder i is shard i
+folders = corpus_folders(data_path) if balance_shards else [str(i) for i in range(1, shards+1)]
+
+if balance_shards and pack_shards:
+    # Pack after planning: the planner balances the files themselves, then each planned
+    # shard becomes one archive input/<shard>/shard.pack whose members are named
+    # "<folder>/<file>" (names repeat across folders)
+    loose = walk_sources([(os.path.join(data_path, i), f"{i}/") for i in folders])
+    planned = plan_shards(loose, shards)
+    skew_report(planned, f"Planned shards (size-balanced over {shards}, packed):")
+    staged = os.path.join(data_path, ".staged", f"packed-{input_format}-{upload_encoding}", f"balanced-{shards}")
+    sources = [(stage_packed_files([(path, name) for path, name, _ in group], os.path.join(staged, str(i)),
+                                   input_format, upload_encoding), f"input/{i}/")
+               for i, group in enumerate(tqdm(planned), start=1)]
+    files = walk_sources(sources)
+    groups = [[f for f in files if f[1].startswith(prefix)] for _, prefix in sources]
+else:
+    # Stage each folder in the configured format
+    sources = []
+    for i in tqdm(folders):
+        src = os.path.join(data_path, i)
+        if pack_shards:
+            # one archive object per shard; the worker reads its members with byte-range GETs
+            # (members are compressed one by one, so the archive itself is uploaded as is)
+            src = stage_packed_shard(src, os.path.join(data_path, ".staged", f"packed-{input_format}-{upload_encoding}", str(i)),
+                                     input_format, upload_encoding)
+        elif input_format == "binary":
+            # upload a little-endian float64 copy instead of the JSON (the worker detects either)
+            src = stage_binary_shard(src, os.path.join(data_path, ".staged", "binary", str(i)))
+        sources.append((src, f"input/{i}/"))
+
+    files = walk_sources(sources)
+    groups = [[f for f in files if f[1].startswith(prefix)] for _, prefix in sources]
+    skew_report(groups, "Shards as uploaded (one per folder):")
+    if balance_shards:
+        groups = plan_shards(files, shards)
+        skew_report(groups, f"Planned shards (size-balanced over {shards}):")
+
+# Upload new/changed files of every shard through one shared thread pool
+objects = {o["key"]: o for o in sync_files(s3, bucket_name, files, cache, workers=upload_workers,
+                                           encoding="identity" if pack_shards else upload_encoding)}
+
+changed = []
+for i, group in enumerate(groups, start=1):
+    # keys, sizes and ETags of the shard, so the worker can start without listing
+    manifest = put_manifest(s3, bucket_name, f"input/{i}/", [objects[key] for _, key, _ in group])
+    if previous.get(i) is None or previous[i]["objects"] != manifest["objects"]:
+        changed.append(i)
+
+# Manifests beyond the last shard are left over from a run with more shards: drop them so
+# the worker and step05 never see them, and note that the shard count changed
+shrunk, extra = False, shards + 1
+while not purge_before_upload and get_manifest(s3, bucket_name, f"input/{extra}/") is not None:
+    s3.delete_object(Bucket=bucket_name, Key=f"input/{extra}/{MANIFEST_NAME}")
+    shrunk, extra = True, extra + 1
+
+# Results and checkpoints under output/ belong to the inputs they were computed from, so a
+# retried worker must not resume (or step05 download) them against new inputs. Only the
+# changed shards' results go, unless the shard count or the file-to-shard assignment moved
+if (changed or shrunk) and not purge_before_upload:
+    before = {o["key"]: i for i, m in previous.items() if m for o in m["objects"]}
+    moved = any(before.get(key, i) != i for i, group in enumerate(groups, start=1) for _, key, _ in group)
+    grown = any(m is None for m in previous.values()) and any(m is not None for m in previous.values())
+    if shrunk or grown or moved:
+        print("ℹ Shard count or file-to-shard assignment changed; removing old results under output/")
+        prefixes = ["output/"]
+    elif len(changed) == len(groups):
+        print(f"ℹ Inputs of all {len(changed)} shards changed; removing old results under output/")
+        prefixes = ["output/"]
+    else:
+        print(f"ℹ Inputs of shard(s) {', '.join(map(str, changed))} changed; removing their old results")
+        # queue-mode tasks may span any shard, so their results go as well
+        prefixes = [f"output/{i}/" for i in changed] + ["output/tasks/"]
+    for prefix in prefixes:
+        if purge_prefix(s3, bucket_name, prefix, workers=upload_workers)["failed"]:
+            raise RuntimeError(f"Could not clear s3://{bucket_name}/{prefix}; rerun step04 before step05")
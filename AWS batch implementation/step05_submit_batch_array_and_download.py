@@ -4,7 +4,14 @@ import tomllib
 import boto3
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utilities import ensure_sso_logged_in, sh  # your helper
+from utilities import sh  # your helper
+import aws_clients
+from bootstrap import bootstrap
+from work_queue import write_task_queue
+from result_download import ResultDownloader
+from s3_upload import upload_client
+from batch_tracking import ArrayJobTracker
+from batch_logs import LogFollower
 from botocore.exceptions import ClientError
 
 directory = os.path.dirname(os.path.abspath(__file__))
@@ -21,22 +28,38 @@ data_path     = config["paths"]["data_path"]
 AWS           = config["paths"]["AWS"]
 LOG_GROUP = config["AWS_profile"]["LOG_GROUP"]
 JOB_NAME = config["AWS_profile"]["JOB_NAME"]
+WORK_MODE = config["AWS_profile"].get("work_mode", "static")
+QUEUE_BATCH_FILES = config["AWS_profile"].get("queue_batch_files", 100)
+OUTPUT_ENCODING = config["AWS_profile"].get("output_encoding", "identity")
 
-ensure_sso_logged_in(AWS, PROFILE)
-os.environ["AWS_PROFILE"] = PROFILE
-os.environ["AWS_PAGER"] = ""
-
-REGION = subprocess.check_output([AWS, "configure", "get", "region", "--profile", PROFILE], text=True).strip()
-session = boto3.Session(profile_name=PROFILE, region_name=REGION)
+ctx = bootstrap(AWS, PROFILE)
+REGION = ctx.region
+session = ctx.session
 batch   = session.client("batch")
 logs    = session.client("logs")
 sts     = session.client("sts")
 
-ACCOUNT_ID = sts.get_caller_identity()["Account"]
-bucket_name = f"{BUCKET_PREFIX}{REGION}-{ACCOUNT_ID}"
+ACCOUNT_ID = ctx.account_id
+bucket_name = ctx.bucket_name(BUCKET_PREFIX)
 
 # Submit as an Array Job (size = shards). The container uses AWS_BATCH_JOB_ARRAY_INDEX (0..N-1).
 job_name = JOB_NAME
+RUN_ID = str(int(time.time()))
+
+s3 = upload_client(session, 16)
+environment = [{"name": "RUN_ID", "value": RUN_ID},
+               {"name": "WORK_MODE", "value": WORK_MODE},
+               {"name": "OUTPUT_ENCODING", "value": OUTPUT_ENCODING}]
+if WORK_MODE == "queue":
+    # children claim small batches of keys until the list is drained, instead of one folder each
+    QUEUE_PREFIX = f"queue/{RUN_ID}/"
+    tasks = write_task_queue(s3, bucket_name, QUEUE_PREFIX,
+                             [f"input/{i}/" for i in range(1, shards + 1)], QUEUE_BATCH_FILES)
+    environment.append({"name": "QUEUE_PREFIX", "value": QUEUE_PREFIX})
+    print(f"✔ Queued {len(tasks)} tasks under s3://{bucket_name}/{QUEUE_PREFIX}")
+    output_prefixes = [f"output/tasks/{t['id']}/" for t in tasks]
+else:
+    output_prefixes = [f"output/{i}/" for i in range(1, shards + 1)]
 
 submit = batch.submit_job(
     jobName=job_name,
@@ -46,142 +69,64 @@ submit = batch.submit_job(
     containerOverrides={
         # If your entrypoint needs to translate array index (0-based) to your 1-based shard folders, do it inside the container
         # (e.g., shard = int(os.environ["AWS_BATCH_JOB_ARRAY_INDEX"]) + 1).
-        "environment":[]
+        "environment": environment
     },
-    tags={"run": str(int(time.time()))}
+    tags={"run": RUN_ID}
 )
 
 job_id = submit["jobId"]
 print(f"✔ Submitted Array Job {job_name} id={job_id} size={shards}")
 
-# statuses Batch recognizes for list_jobs
-_ALL_STATUSES = ["SUBMITTED","PENDING","RUNNABLE","STARTING","RUNNING","SUCCEEDED","FAILED"]
-
-def list_children_all_statuses(array_parent_id: str) -> list[str]:
-    """Return all child job IDs for an array parent across *all* statuses."""
-    ids = set()
-    for st in _ALL_STATUSES:
-        token = None
-        while True:
-            kwargs = {"arrayJobId": array_parent_id, "jobStatus": st}
-            if token:
-                kwargs["nextToken"] = token
-            resp = batch.list_jobs(**kwargs)
-            for j in resp.get("jobSummaryList", []):
-                ids.add(j["jobId"])
-            token = resp.get("nextToken")
-            if not token:
-                break
-    return list(ids)
-
-def describe_job(job_id: str) -> dict:
-    return batch.describe_jobs(jobs=[job_id])["jobs"][0]
-
-def tail_logs_until_done(parent_id: str):
+# Download each shard's results as soon as its _SUCCESS marker appears, while the rest still run
+DEST = Path(rf"{data_path}/out"); DEST.mkdir(parents=True, exist_ok=True)
+downloader = ResultDownloader(s3, bucket_name, output_prefixes, DEST, run_id=RUN_ID).start()
+
+# step02's job definition logs with awslogs-stream-prefix "batch"; the container is "default"
+LOG_STREAM_PREFIX = "batch/default/"
+
+def tail_logs_until_done(parent_id: str, size: int) -> ArrayJobTracker:
     """
-    Tail new lines for each child stream and exit when the array is complete.
-    Exits when the *parent* job becomes SUCCEEDED/FAILED, or when statusSummary
-    shows SUCCEEDED+FAILED == array size.
+    Print the array's logs and exit when the array is complete.
+    Status comes from the parent's statusSummary (see batch_tracking.py); logs
+    from one filter_log_events query over the whole group (see batch_logs.py).
     """
-    import time
-    from botocore.exceptions import ClientError
+    tracker = ArrayJobTracker(batch, parent_id, size)
 
-    terminal = {"SUCCEEDED", "FAILED"}
-    stream_tokens = {}          # (group, stream) -> nextForwardToken
-    finished_streams = set()    # (group, stream)
-    array_size = None
+    def label(stream):
+        index = tracker.streams.get(stream)
+        # same shape as `kubectl logs --prefix`: [pod/<name>/<container>]
+        return None if index is None else f"job/{job_name}:{index}/{stream.split('/')[1]}"
+
+    follower = LogFollower(logs, LOG_GROUP, LOG_STREAM_PREFIX, int(RUN_ID) * 1000, label=label)
+    last_line = None
 
     while True:
-        parent = describe_job(parent_id)
-        p_status = parent["status"]
-        arr = parent.get("arrayProperties", {}) or {}
-        array_size = array_size or arr.get("size")
-
-        # Fast exit on parent terminal
-        if p_status in terminal:
-            # drain any last lines one last time
-            kids = list_children_all_statuses(parent_id)
-            for kid in kids:
-                j = describe_job(kid)
-                ls = j.get("container", {}).get("logStreamName")
-                if not ls:
-                    continue
-                key = (LOG_GROUP, ls)
-                _tail_once(LOG_GROUP, ls, stream_tokens.get(key), stream_tokens, finished_streams)
-            break
-
-        # Or exit when SUCCEEDED+FAILED == size
-        ss = arr.get("statusSummary", {}) or {}
-        done_count = int(ss.get("SUCCEEDED", 0)) + int(ss.get("FAILED", 0))
-        if array_size and done_count >= array_size:
-            # optional final drain
-            kids = list_children_all_statuses(parent_id)
-            for kid in kids:
-                j = describe_job(kid)
-                ls = j.get("container", {}).get("logStreamName")
-                if not ls:
-                    continue
-                key = (LOG_GROUP, ls)
-                _tail_once(LOG_GROUP, ls, stream_tokens.get(key), stream_tokens, finished_streams)
-            break
-
-        # Otherwise continue normal tailing
-        kids = list_children_all_statuses(parent_id)
-        statuses = {}
-        for kid in kids:
-            j = describe_job(kid)
-            st = j["status"]
-            statuses[st] = statuses.get(st, 0) + 1
-
-            ls = j.get("container", {}).get("logStreamName")
-            if not ls:
-                continue
-            key = (LOG_GROUP, ls)
-            _tail_once(LOG_GROUP, ls, stream_tokens.get(key), stream_tokens, finished_streams)
+        tracker.tick()
+        done = tracker.done()   # from the summary; the children may still be catching up
+        if done and not tracker.behind():
+            time.sleep(5)   # let the last lines get ingested
+            follower.poll(final=True)
+            return tracker
+        follower.poll()
 
         # heartbeat
-        summary = " ".join(f"{k}={v}" for k, v in sorted(statuses.items()))
-        if summary:
-            print(f"[array] {summary}")
-        time.sleep(2)
-
-def _tail_once(log_group, log_stream, prev_token, token_map, finished_set):
-    """Fetch and print only new events for one stream once; update tokens."""
-    from botocore.exceptions import ClientError
-    key = (log_group, log_stream)
-    kwargs = {"logGroupName": log_group, "logStreamName": log_stream}
-    if prev_token:
-        kwargs["nextToken"] = prev_token
-    else:
-        kwargs["startFromHead"] = True
-
-    try:
-        out = logs.get_log_events(**kwargs)
-    except ClientError as e:
-        if e.response["Error"]["Code"] in ("ResourceNotFoundException", "ThrottlingException"):
-            return
-        raise
-
-    for evt in out.get("events", []):
-        print(evt["message"].rstrip("\n"))
-
-    fwd = out.get("nextForwardToken")
-    if fwd:
-        # if unchanged, consider stream drained for this pass
-        if fwd == token_map.get(key):
-            finished_set.add(key)
-        token_map[key] = fwd
-
-
-tail_logs_until_done(job_id)
+        line = tracker.line()
+        if line != last_line:
+            print(line)
+            last_line = line
+        # once the array is done only the children's details are left to catch up on
+        time.sleep(1 if done else follower.interval)
+
+
+tracker = tail_logs_until_done(job_id, shards)
 
 # Final status
-desc = batch.describe_jobs(jobs=[job_id])["jobs"][0]
-failed = desc.get("arrayProperties", {}).get("statusSummary", {}).get("FAILED", 0)
-succeeded = desc.get("arrayProperties", {}).get("statusSummary", {}).get("SUCCEEDED", 0)
+failed = tracker.summary.get("FAILED", 0)
+succeeded = tracker.summary.get("SUCCEEDED", 0)
 print(f"Array summary -> succeeded={succeeded} failed={failed}")
+if tracker.failed_indexes():
+    print(f"⚠ Failed array indexes: {', '.join(map(str, tracker.failed_indexes()))}")
 
-# Download results S3 -> local (same as your existing script)
-DEST = Path(rf"{data_path}/out"); DEST.mkdir(parents=True, exist_ok=True)
-sh([AWS,"s3","sync",f"s3://{bucket_name}/output/",str(DEST)])
+# Results were downloading while the job ran; collect the last shards
+downloader.finish()
 print(f"✔ Downloaded outputs to {DEST}")
@@ -1,10 +1,14 @@
-import os, subprocess, time
+import os, subprocess
 from pathlib import Path
 import tomllib
 import boto3
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utilities import ensure_sso_logged_in, sh
+from utilities import sh
+import aws_clients
+from bootstrap import bootstrap
+from s3_purge import purge_prefix
+from waiters import wait_for, wait_all
 
 directory = os.path.dirname(os.path.abspath(__file__))
 config_path = Path(os.path.join(directory,"config.toml"))
@@ -19,33 +23,55 @@ BATCH_QUEUE   = config["AWS_profile"]["BATCH_QUEUE"]
 BATCH_JOB_DEF = config["AWS_profile"]["BATCH_JOB_DEF"]
 AWS           = config["paths"]["AWS"]
 
-ensure_sso_logged_in(AWS, PROFILE)
-os.environ["AWS_PROFILE"] = PROFILE
-os.environ["AWS_PAGER"] = ""
-REGION = subprocess.check_output([AWS, "configure", "get", "region", "--profile", PROFILE], text=True).strip()
+ctx = bootstrap(AWS, PROFILE)
+REGION = ctx.region
 
-session = boto3.Session(profile_name=PROFILE, region_name=REGION)
+session = ctx.session
 batch   = session.client("batch")
 sts     = session.client("sts")
 iam     = session.client("iam")
+s3      = session.client("s3")
 
-ACCOUNT_ID = sts.get_caller_identity()["Account"]
-bucket_name = f"{BUCKET_PREFIX}{REGION}-{ACCOUNT_ID}"
+ACCOUNT_ID = ctx.account_id
+bucket_name = ctx.bucket_name(BUCKET_PREFIX)
 
-# 1) disable and delete job queue
+def jq_status():
+    jqs = batch.describe_job_queues(jobQueues=[BATCH_QUEUE])["jobQueues"]
+    return jqs[0]["status"] if jqs else None
+
+def ce_status():
+    ces = batch.describe_compute_environments(computeEnvironments=[BATCH_ENV])["computeEnvironments"]
+    return ces[0]["status"] if ces else None
+
+gone = lambda s: s in (None, "DELETED")
+
+# 1) disable job queue and compute environment together, then wait for both
+for what, disable in (("job queue", lambda: batch.update_job_queue(jobQueue=BATCH_QUEUE, state="DISABLED")),
+                      ("compute env", lambda: batch.update_compute_environment(computeEnvironment=BATCH_ENV,
+                                                                                state="DISABLED"))):
+    try:
+        disable()
+    except Exception as e:
+        print(f"(i) {what}: {e}")
+try:
+    wait_all([lambda: wait_for(f"job queue {BATCH_QUEUE} disabled", jq_status, done=lambda s: s != "UPDATING", initial=1),
+              lambda: wait_for(f"compute env {BATCH_ENV} disabled", ce_status, done=lambda s: s != "UPDATING", initial=1)])
+except Exception as e:
+    print(f"(i) disable: {e}")
+
+# 2) delete the job queue, then the compute environment (it can't go while a queue references it)
 try:
-    batch.update_job_queue(jobQueue=BATCH_QUEUE, state="DISABLED")
-    time.sleep(2)
-    batch.delete_job_queue(jobQueue=BATCH_QUEUE)
+    if not gone(jq_status()):
+        batch.delete_job_queue(jobQueue=BATCH_QUEUE)
+        wait_for(f"job queue {BATCH_QUEUE} deletion", jq_status, done=gone, initial=1)
     print(f"✔ Deleted Job Queue {BATCH_QUEUE}")
 except Exception as e:
     print(f"(i) job queue: {e}")
 
-# 2) delete compute environment
 try:
-    batch.update_compute_environment(computeEnvironment=BATCH_ENV, state="DISABLED")
-    time.sleep(2)
-    batch.delete_compute_environment(computeEnvironment=BATCH_ENV)
+    if not gone(ce_status()):
+        batch.delete_compute_environment(computeEnvironment=BATCH_ENV)
+        wait_for(f"compute env {BATCH_ENV} deletion", ce_status, done=gone, initial=2)
     print(f"✔ Deleted Compute Environment {BATCH_ENV}")
 except Exception as e:
     print(f"(i) compute env: {e}")
@@ -62,7 +88,20 @@ except Exception as e:
 # 4) optional: delete ECR repo & S3 bucket like your original cleanup
 ans = input(f"Type 'Y' to also delete S3 bucket {bucket_name} and ECR repo {ECR_REPO}: ").strip()
 if ans == "Y":
-    sh([AWS,"s3","rm",f"s3://{bucket_name}/","--recursive"], check=False)
-    sh([AWS,"s3api","delete-bucket","--bucket",bucket_name,"--region",REGION], check=False)
-    sh([AWS,"ecr","delete-repository","--repository-name",ECR_REPO,"--region",REGION,"--force"], check=False)
-    print("✔ Deleted S3 bucket & ECR repo (if existed)")
+    deletions = [("ECR repo", lambda: aws_clients.client("ecr", PROFILE, REGION)
+                                      .delete_repository(repositoryName=ECR_REPO, force=True))]
+    try:
+        failed = purge_prefix(s3, bucket_name, "")["failed"]
+    except Exception as e:
+        print(f"(i) bucket purge: {e}")
+        failed = 0      # typically NoSuchBucket; delete_bucket reports anything else
+    if failed:
+        print(f"⚠ Keeping bucket {bucket_name}: {failed} objects could not be deleted (see above); rerun step06")
+    else:
+        deletions.insert(0, ("bucket", lambda: s3.delete_bucket(Bucket=bucket_name)))
+    for what, call in deletions:
+        try:
+            call()
+        except Exception as e:
+            print(f"(i) {what}: {e}")
+    print(f"✔ Deleted {' & '.join(what for what, _ in deletions)} (if existed)")
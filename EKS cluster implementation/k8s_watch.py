@@ -0,0 +1,197 @@
+"""
+Watch-driven monitoring of the Indexed Job's pods.
+
+Instead of spawning `kubectl get pods -o json` every few seconds and parsing the
+whole pod list, one long-lived `kubectl get --raw <path>?watch=1` stream delivers
+only the changes (ADDED / MODIFIED / DELETED), which are applied to an
+in-memory table. When the stream ends (timeoutSeconds) it is reopened from the
+last resourceVersion; if that version is too old (410 Gone) the table is
+rebuilt from one fresh list. A failed request (kubectl error, empty or
+truncated JSON) is retried with exponential backoff; WatchError is raised once
+max_failures requests in a row have failed.
+
+PodTable and JobState are plain state machines, and watch() only needs an
+open_path(url) -> lines callable: feed them recorded or fake events to test
+them without a cluster (see test_k8s_watch.py).
+"""
+import json
+import subprocess
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+INDEX_ANNOTATION = "batch.kubernetes.io/job-completion-index"
+
+
+class PodTable:
+    """Latest known state of every pod, keyed by uid."""
+
+    def __init__(self):
+        self.pods = {}
+        self.resource_version = None
+
+    def reset(self, items, resource_version):
+        self.pods = {}
+        for pod in items:
+            self._put(pod)
+        self.resource_version = resource_version
+
+    def _put(self, pod):
+        meta, status = pod.get("metadata", {}), pod.get("status", {})
+        index = (meta.get("annotations") or {}).get(INDEX_ANNOTATION)
+        self.pods[meta["uid"]] = {"name": meta.get("name"), "phase": status.get("phase") or "Pending",
+                                  "index": int(index) if index is not None else None}
+
+    def apply(self, event):
+        """Apply one watch event. Returns False if the watch must be restarted from a fresh list."""
+        kind, obj = event.get("type"), event.get("object", {})
+        if kind == "ERROR":
+            return False    # e.g. 410 Gone: our resourceVersion is too old
+        rv = obj.get("metadata", {}).get("resourceVersion")
+        if rv:
+            self.resource_version = rv
+        if kind in ("ADDED", "MODIFIED"):
+            self._put(obj)
+        elif kind == "DELETED":
+            self.pods.pop(obj["metadata"]["uid"], None)
+        return True     # BOOKMARK: only the resourceVersion moves
+
+    def counts(self):
+        c = {"Pending": 0, "Running": 0, "Succeeded": 0, "Failed": 0}
+        for p in self.pods.values():
+            c[p["phase"]] = c.get(p["phase"], 0) + 1
+        return c
+
+    def succeeded_indexes(self):
+        return {p["index"] for p in self.pods.values() if p["phase"] == "Succeeded" and p["index"] is not None}
+
+    def pod_for_index(self, index):
+        """Name of the pod that ran `index`, preferring one that succeeded."""
+        pods = [p for p in self.pods.values() if p["index"] == index]
+        pods.sort(key=lambda p: p["phase"] != "Succeeded")
+        return pods[0]["name"] if pods else None
+
+
+class JobState:
+    """Status of one Job, from watch events on that Job."""
+
+    def __init__(self):
+        self.succeeded = self.active = self.failed = 0
+        self.condition = None       # "Complete" / "Failed" once the Job is finished
+        self.resource_version = None
+
+    def reset(self, items, resource_version):
+        for job in items:
+            self.apply({"type": "MODIFIED", "object": job})
+        self.resource_version = resource_version
+
+    def apply(self, event):
+        kind, job = event.get("type"), event.get("object", {})
+        if kind == "ERROR":
+            return False
+        rv = job.get("metadata", {}).get("resourceVersion")
+        if rv:
+            self.resource_version = rv
+        if kind in ("ADDED", "MODIFIED"):
+            status = job.get("status", {})
+            self.succeeded = status.get("succeeded", 0)
+            self.active = status.get("active", 0)
+            self.failed = status.get("failed", 0)
+            for cond in status.get("conditions") or []:
+                if cond.get("type") in ("Complete", "Failed") and cond.get("status") == "True":
+                    self.condition = cond["type"]
+        return True
+
+
+class WatchError(RuntimeError):
+    """A list or watch request failed (kubectl exited non-zero), or kept failing."""
+
+
+class KubectlStream:
+    """
+    open_path(path) -> lines of `kubectl get --raw <path>`, raising WatchError if
+    kubectl fails. cancel() ends the requests in flight (and any later ones), so
+    a watch blocked on its stream notices stop() right away.
+    """
+
+    def __init__(self, kubectl):
+        self.kubectl = kubectl
+        self.cancelled = False
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, path):
+        with tempfile.TemporaryFile() as err:
+            proc = subprocess.Popen([self.kubectl, "get", "--raw", path], stdout=subprocess.PIPE, stderr=err, text=True)
+            with self._lock:
+                self._procs.add(proc)
+                if self.cancelled:
+                    proc.terminate()
+            try:
+                yield from proc.stdout
+            finally:
+                if proc.poll() is None:
+                    proc.terminate()
+                rc = proc.wait()
+                with self._lock:
+                    self._procs.discard(proc)
+            if rc != 0 and not self.cancelled:
+                err.seek(0)
+                msg = err.read().decode("utf-8", "replace").strip()
+                raise WatchError(f"kubectl get --raw {path.split('?')[0]} exited {rc}: {msg[-300:]}")
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            for proc in self._procs:
+                if proc.poll() is None:
+                    proc.terminate()
+
+
+def watch(open_path, path, state, params, timeout_seconds=30, on_event=None, stop=lambda: False,
+          max_failures=8, sleep=time.sleep):
+    """
+    Keep `state` (PodTable / JobState) current from the watch API at `path`
+    (e.g. /api/v1/namespaces/batch/pods) until stop() is true. open_path(url)
+    returns the response lines; each watch request ends after timeout_seconds,
+    which is when stop() is checked (unless the stream is cancelled earlier).
+    Failed requests are retried after 1, 2, 4 ... 30 s; after max_failures in a
+    row WatchError is raised.
+    """
+    failures = 0
+
+    def relist():
+        body = json.loads("".join(open_path(f"{path}?{urlencode(params)}")))
+        state.reset(body.get("items", []), body.get("metadata", {}).get("resourceVersion"))
+
+    listed = False
+    while not stop():
+        try:
+            if not listed:
+                relist()
+                listed, failures = True, 0
+                continue
+            query = dict(params, watch=1, allowWatchBookmarks="true", timeoutSeconds=timeout_seconds,
+                         resourceVersion=state.resource_version)
+            for line in open_path(f"{path}?{urlencode(query)}"):
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                failures = 0
+                if not state.apply(event):
+                    listed = False
+                    break
+                if on_event is not None:
+                    on_event(event)
+                if stop():
+                    return
+        except (WatchError, ValueError) as e:     # ValueError: empty or truncated JSON
+            if stop():
+                return      # e.g. the stream was cancelled mid-line
+            failures += 1
+            if failures >= max_failures:
+                raise WatchError(f"{path}: giving up after {failures} failed requests: {e}") from e
+            delay = min(30, 2 ** (failures - 1))
+            print(f"\n⚠ watch {path}: {e}; retrying in {delay}s")
+            sleep(delay)
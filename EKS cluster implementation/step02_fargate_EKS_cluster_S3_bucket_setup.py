@@ -6,9 +6,14 @@ import tomllib
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utilities import *
+import aws_clients
+from bootstrap import bootstrap
+from waiters import wait_for
+from provision_dag import Dag
 import json
-import time
+import urllib.parse
 import boto3
+from botocore.exceptions import BotoCoreError, ClientError
 
 directory = os.path.dirname(os.path.abspath(__file__))
 config_path = Path(os.path.join(directory,"config.toml"))
@@ -35,20 +40,10 @@ KUBECTL = config["paths"]["KUBECTL"]
 
 ALLOW_CFN_CLEANUP = False   # set True only when you *want* the script to clean failed stacks
 
-# SSO login
-ensure_sso_logged_in(AWS, PROFILE)
-
-REGION = subprocess.check_output(
-    [AWS, "configure", "get", "region", "--profile", PROFILE],
-    text=True
-).strip()
-session = boto3.Session(profile_name=PROFILE, region_name=REGION)
-REGION = session.region_name or REGION
-if not REGION:
-    raise RuntimeError(
-        f"No region resolved for profile '{PROFILE}'. "
-        f"Set region in ~/.aws/config or include AWS_profile.REGION in config.toml."
-    )
+# SSO login, region and account (cached per SSO session, see bootstrap.py)
+ctx = bootstrap(AWS, PROFILE)
+REGION = ctx.region
+session = ctx.session
 
 # Ensure eksctl can actually use the SSO token (some environments need a refresh)
 def ensure_eksctl_auth_ok():
@@ -74,60 +69,38 @@ def ensure_eksctl_auth_ok():
 ensure_eksctl_auth_ok()
 
 def cluster_exists(name, region):
-    info = aws_json(AWS, ["eks", "describe-cluster", "--name", name, "--region", region, "--profile", PROFILE])
+    info = aws_clients.call_json("eks", "describe_cluster", PROFILE, region, name=name)
     status = (info or {}).get("cluster", {}).get("status")
     return status in {"ACTIVE", "CREATING", "UPDATING"}
 
 def wait_for_cluster_active(name, region, timeout=1800):
-    start = time.time()
-    while time.time() - start < timeout:
-        info = aws_json(AWS, ["eks", "describe-cluster", "--name", name, "--region", region, "--profile", PROFILE])
-        status = (info or {}).get("cluster", {}).get("status")
-        print(f"[wait] cluster status: {status}")
-        if status == "ACTIVE":
-            return
-        time.sleep(15)
-    raise TimeoutError("EKS cluster did not reach ACTIVE in time")
+    def status():
+        info = aws_clients.call_json("eks", "describe_cluster", PROFILE, region, name=name)
+        return (info or {}).get("cluster", {}).get("status")
+    wait_for(f"cluster {name}", status, done=lambda s: s == "ACTIVE",
+             failed=lambda s: s in ("FAILED", "DELETING"), timeout=timeout, initial=15, max_interval=60)
 
 def cf_stack_status(stack_name, region):
-    r = sh([AWS, "cloudformation", "describe-stacks", "--region", region,
-            "--stack-name", stack_name, "--output", "json", "--profile", PROFILE],
-           check=False, capture_output=True)
-    # If the stack truly doesn't exist, AWS returns a ValidationError.
-    if r.returncode != 0:
-        # Treat "does not exist" (or ValidationError) as no stack present
-        return None
+    """StackStatus; None only if the stack does not exist, "UNKNOWN" if describe-stacks failed otherwise."""
     try:
-        return json.loads(r.stdout)["Stacks"][0]["StackStatus"]
-    except Exception:
-        return None
-
-def cf_wait(stack_name, region, waiter):
-    # waiter: "stack-create-complete" | "stack-delete-complete"
-    sh([AWS, "cloudformation", "wait", waiter, "--region", region, "--stack-name", stack_name, "--profile", PROFILE])
+        resp = aws_clients.client("cloudformation", PROFILE, region).describe_stacks(StackName=stack_name)
+    except ClientError as e:
+        err = e.response.get("Error", {})
+        # If the stack truly doesn't exist, AWS returns a ValidationError: treat as no stack present
+        if err.get("Code") == "ValidationError" and "does not exist" in err.get("Message", ""):
+            return None
+        print(f"(i) describe-stacks {stack_name}: {err.get('Code')} {err.get('Message')}")
+        return "UNKNOWN"    # throttled, expired credentials, ...: not proof that the stack is gone
+    except BotoCoreError as e:
+        print(f"(i) describe-stacks {stack_name}: {e}")
+        return "UNKNOWN"
+    stacks = resp.get("Stacks") or []
+    return stacks[0]["StackStatus"] if stacks else None
 
 def cf_wait_delete(stack_name, region):
-    """
-    Wait until CloudFormation stack deletion completes.
-    Uses the AWS waiter first; if that fails, falls back to polling until 404.
-    """
-    # Primary: waiter
-    try:
-        sh([AWS, "cloudformation", "wait", "stack-delete-complete",
-            "--region", region, "--stack-name", stack_name, "--profile", PROFILE])
-        return
-    except subprocess.CalledProcessError:
-        pass  # fall through to manual poll
-
-    # Fallback: poll until describe-stacks says "does not exist"
-    while True:
-        r = sh([AWS, "cloudformation", "describe-stacks",
-                "--region", region, "--stack-name", stack_name, "--output", "json", "--profile", PROFILE],
-               check=False, capture_output=True)
-        if r.returncode != 0 and "does not exist" in (r.stderr or ""):
-            print(f"[cf] Stack {stack_name} gone.")
-            return
-        time.sleep(10)
+    """Wait until CloudFormation stack deletion completes (describe-stacks says it no longer exists)."""
+    wait_for(f"stack {stack_name} deletion", lambda: cf_stack_status(stack_name, region), done=lambda s: s is None,
+             failed=lambda s: s == "DELETE_FAILED", timeout=1800, initial=5, max_interval=30)
 
 FAILED_STATUSES = {"ROLLBACK_COMPLETE", "CREATE_FAILED", "DELETE_FAILED", "ROLLBACK_FAILED"}
 
@@ -146,7 +119,7 @@ def ensure_cluster_with_fargate(name, region):
         if not ALLOW_CFN_CLEANUP:
             raise RuntimeError(msg + " Refusing to auto-delete. Set ALLOW_CFN_CLEANUP=True to clean and retry.")
         print(msg, "Deleting...")
-        sh([AWS, "cloudformation", "delete-stack", "--region", region, "--stack-name", stack, "--profile", PROFILE])
+        aws_clients.client("cloudformation", PROFILE, region).delete_stack(StackName=stack)
         cf_wait_delete(stack, region)
 
     # Create cluster
@@ -197,31 +170,18 @@ os.environ["AWS_PAGER"] = ""  # disable the built-in pager
 os.environ.setdefault("AWS_SDK_LOAD_CONFIG", "1")
 
 
-# EKS cluster (with Fargate) & kubectl creds
-# Ensure namespace exists and is scheduled on Fargate
-sh([EKSCTL, "get", "cluster", "--name", CLUSTER, "--region", REGION, "--profile", PROFILE], check=False)
-ensure_cluster_with_fargate(CLUSTER, REGION)
-ensure_fargate_profile("batch-profile", REGION, CLUSTER, FARGATE_NS)
-ensure_kubeconfig(CLUSTER, REGION)
-ensure_namespace(FARGATE_NS)
-print("✔ EKS (Fargate) ready and kubectl configured.")
+os.environ.setdefault("AWS_DEFAULT_REGION", REGION)
 
-# Create bucket if not exist
-ACCOUNT_ID = subprocess.check_output([AWS,"sts","get-caller-identity","--query","Account","--output","text"], text=True).strip()
-bucket_name = f"{BUCKET_PREFIX}{REGION}-{ACCOUNT_ID}"
+iam = session.client("iam")
+sts = session.client("sts")
+ACCOUNT_ID = ctx.account_id
+bucket_name = ctx.bucket_name(BUCKET_PREFIX)
 print(bucket_name)
-create_bucket(bucket_name, REGION, profile=PROFILE)
 
 # ───────────────────────────────
 # Create or reuse S3 RW policy
 # ───────────────────────────────
 
-os.environ.setdefault("AWS_DEFAULT_REGION", REGION)
-
-iam = session.client("iam")
-sts = session.client("sts")
-account_id = sts.get_caller_identity()["Account"]
-
 POLICY_NAME = "QELabsBatchS3RW"
 policy_arn = f"arn:aws:iam::{ACCOUNT_ID}:policy/{POLICY_NAME}"
 
@@ -232,15 +192,35 @@ policy_doc = {
          "Action": ["s3:ListBucket"],
          "Resource": [f"arn:aws:s3:::{bucket_name}"]},
         {"Effect": "Allow",
-         "Action": ["s3:GetObject", "s3:PutObject", "s3:DeleteObject"],
+         "Action": ["s3:GetObject", "s3:PutObject", "s3:DeleteObject", "s3:AbortMultipartUpload"],
          "Resource": [f"arn:aws:s3:::{bucket_name}/*"]}
     ]
 }
 
+def _policy_document(version):
+    doc = version["Document"]
+    # boto3 hands back the decoded dict; decode ourselves if it ever arrives URL-encoded
+    return json.loads(urllib.parse.unquote(doc)) if isinstance(doc, str) else doc
+
+def update_policy_document(arn, default_version_id):
+    """Make policy_doc the default version of `arn` if it isn't already (IAM keeps at most 5 versions)."""
+    current = iam.get_policy_version(PolicyArn=arn, VersionId=default_version_id)["PolicyVersion"]
+    if _policy_document(current) == policy_doc:
+        return False
+    versions = iam.list_policy_versions(PolicyArn=arn)["Versions"]
+    old = sorted((v for v in versions if not v["IsDefaultVersion"]), key=lambda v: v["CreateDate"])
+    for v in old[:max(0, len(versions) - 4)]:
+        iam.delete_policy_version(PolicyArn=arn, VersionId=v["VersionId"])
+    iam.create_policy_version(PolicyArn=arn, PolicyDocument=json.dumps(policy_doc), SetAsDefault=True)
+    print(f"↻ Updated policy document of {arn}")
+    return True
+
 def ensure_policy():
     try:
-        iam.get_policy(PolicyArn=policy_arn)
+        policy = iam.get_policy(PolicyArn=policy_arn)["Policy"]
         print(f"✔ Policy exists: {policy_arn}")
+        # e.g. s3:AbortMultipartUpload added for the streaming output sink
+        update_policy_document(policy_arn, policy["DefaultVersionId"])
         return policy_arn
     except ClientError as e:
         if e.response["Error"]["Code"] != "NoSuchEntity":
@@ -260,40 +240,57 @@ def ensure_policy():
             for p in resp.get("Policies", []):
                 if p["PolicyName"] == POLICY_NAME:
                     print(f"✔ Found existing policy: {p['Arn']}")
+                    update_policy_document(p["Arn"], p["DefaultVersionId"])
                     return p["Arn"]
         raise
 
-policy_arn = ensure_policy()
-
 # ───────────────────────────────
 # Associate OIDC provider (idempotent)
 # ───────────────────────────────
-sh([EKSCTL, "utils", "associate-iam-oidc-provider",
-    "--cluster", CLUSTER, "--region", REGION, "--approve"])
+def ensure_oidc_provider():
+    sh([EKSCTL, "utils", "associate-iam-oidc-provider",
+        "--cluster", CLUSTER, "--region", REGION, "--approve"])
 
 # ───────────────────────────────
 # Create IRSA-linked ServiceAccount with policies
 # ───────────────────────────────
 ECR_READONLY = "arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly"
 
-sh([
-    EKSCTL, "create", "iamserviceaccount",
-    "--cluster", CLUSTER,
-    "--namespace", FARGATE_NS,
-    "--name", KSA,
-    "--role-name", GSA_ROLE,
-    "--attach-policy-arn", ECR_READONLY,
-    "--attach-policy-arn", policy_arn,
-    "--approve",
-    "--region", REGION
-])
+def ensure_service_account(policy_arn):
+    sh([
+        EKSCTL, "create", "iamserviceaccount",
+        "--cluster", CLUSTER,
+        "--namespace", FARGATE_NS,
+        "--name", KSA,
+        "--role-name", GSA_ROLE,
+        "--attach-policy-arn", ECR_READONLY,
+        "--attach-policy-arn", policy_arn,
+        "--approve",
+        "--region", REGION
+    ])
+    # Verify
+    sh([KUBECTL, "-n", FARGATE_NS, "get", "sa", KSA, "-o", "yaml"], check=False)
+    print(f"✔ IRSA role '{GSA_ROLE}' bound to ServiceAccount '{KSA}' in ns '{FARGATE_NS}'")
 
 # ───────────────────────────────
-# Verify
+# Provisioning graph
 # ───────────────────────────────
-sh([KUBECTL, "-n", FARGATE_NS, "get", "sa", KSA, "-o", "yaml"], check=False)
-
-print(f"✔ IRSA role '{GSA_ROLE}' bound to ServiceAccount '{KSA}' in ns '{FARGATE_NS}'")
+# The bucket and the IAM policy don't need the cluster, so they are created
+# while eksctl builds it; everything Kubernetes-side waits for the cluster, and
+# the ServiceAccount needs the OIDC provider, the policy and the namespace.
+dag = Dag()
+dag.add("cluster", lambda: ensure_cluster_with_fargate(CLUSTER, REGION))
+dag.add("bucket", lambda: create_bucket(bucket_name, REGION, profile=PROFILE))
+dag.add("s3_policy", ensure_policy)
+dag.add("fargate_profile", lambda _: ensure_fargate_profile("batch-profile", REGION, CLUSTER, FARGATE_NS),
+        deps=("cluster",))
+dag.add("kubeconfig", lambda _: ensure_kubeconfig(CLUSTER, REGION), deps=("cluster",))
+dag.add("namespace", lambda _: ensure_namespace(FARGATE_NS), deps=("kubeconfig",))
+dag.add("oidc_provider", lambda _: ensure_oidc_provider(), deps=("cluster",))
+dag.add("service_account", lambda policy_arn, *_: ensure_service_account(policy_arn),
+        deps=("s3_policy", "oidc_provider", "namespace"))
+dag.run()
+print("✔ EKS (Fargate) ready and kubectl configured.")
 
 print(f"""
 ===========================================
@@ -7,6 +7,14 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utilities import *
+import aws_clients
+from bootstrap import bootstrap
+from k8s_watch import JobState, KubectlStream, PodTable, watch
+from work_queue import write_task_queue
+from result_download import ResultDownloader
+from s3_upload import upload_client
+import boto3
+import threading
 import time
 
 directory = os.path.dirname(os.path.abspath(__file__))
@@ -21,6 +29,11 @@ KSA = config["AWS_profile"]["KSA"]
 ECR_REPO   = config["AWS_profile"]["ECR_REPO"]
 IMAGE_TAG = config["AWS_profile"]["IMAGE_TAG"]
 shards = config["AWS_profile"]["shards"]
+WORKER_VCPUS = config["AWS_profile"].get("worker_vcpus", 1)
+WORKER_MEMORY_MIB = config["AWS_profile"].get("worker_memory_mib", 2048)
+WORK_MODE = config["AWS_profile"].get("work_mode", "static")
+QUEUE_BATCH_FILES = config["AWS_profile"].get("queue_batch_files", 100)
+OUTPUT_ENCODING = config["AWS_profile"].get("output_encoding", "identity")
 data_path = config["paths"]["data_path"]
 
 # AWS Command Line Interface (CLI)
@@ -28,27 +41,41 @@ AWS = config["paths"]["AWS"]
 # kubectl command-line tool for interacting with Kubernetes clusters (Works inside the cluster (Pods, Jobs, Deployments, Services, etc.))
 KUBECTL = config["paths"]["KUBECTL"]
 
-# SSO login
-ensure_sso_logged_in(AWS, PROFILE)
+# SSO login, region and account (cached per SSO session, see bootstrap.py)
+ctx = bootstrap(AWS, PROFILE)
+REGION = ctx.region
 
-os.environ["AWS_PROFILE"] = PROFILE
-os.environ["AWS_PAGER"] = ""  # disable the built-in pager
-
-REGION = subprocess.check_output(
-    [AWS, "configure", "get", "region", "--profile", PROFILE],
-    text=True
-).strip()
-
-def stream_job_logs_and_progress(ns, job, total, run_id, poll_s=5):
+def stream_job_logs_and_progress(ns, job, total, run_id):
+    """
+    Follow the run's logs and show progress until every index has succeeded (or the
+    Job failed). Pod and Job state come from watch streams, not repeated `kubectl get`s.
+    Returns the PodTable (pod name per completion index).
+    """
     sel = f"job-name={job},run-id={run_id}"
-
-    # Wait until we see pods for this run (avoid picking up old logs)
-    for _ in range(120):
-        r = sh([KUBECTL, "-n", ns, "get", "pods", "-l", sel, "-o", "json"],
-               check=False, capture_output=True, echo=False)
-        if r.returncode == 0 and r.stdout and json.loads(r.stdout).get("items"):
-            break
-        time.sleep(1)
+    pod_stream, job_stream = KubectlStream(KUBECTL), KubectlStream(KUBECTL)
+    pods, job_state = PodTable(), JobState()
+    finished = threading.Event()
+    job_errors = []
+
+    def done():
+        return (finished.is_set() or bool(job_errors) or len(pods.succeeded_indexes()) >= total
+                or job_state.condition == "Failed")
+
+    def on_job_event(_event):
+        if job_state.condition == "Failed":
+            pod_stream.cancel()     # wake the pod watch now, not at its next event or timeout
+
+    def follow_job():
+        try:
+            watch(job_stream, f"/apis/batch/v1/namespaces/{ns}/jobs", job_state,
+                  {"fieldSelector": f"metadata.name={job}"}, on_event=on_job_event,
+                  stop=lambda: finished.is_set() or job_state.condition is not None)
+        except Exception as e:
+            job_errors.append(e)
+            pod_stream.cancel()
+
+    # Job status (to notice a Failed job) on its own watch
+    threading.Thread(target=follow_job, name="job-watch", daemon=True).start()
 
     logs_cmd = [
         KUBECTL, "-n", ns, "logs",
@@ -57,63 +84,41 @@ def stream_job_logs_and_progress(ns, job, total, run_id, poll_s=5):
         "--follow", "--prefix=true",
         "--max-log-requests", str(max(5, min(100, total))),
     ]
-    print("> " + " ".join(logs_cmd))
-    log_proc = subprocess.Popen(logs_cmd, text=True)
-
+    log_proc = None
     last_len = 0
+
+    def on_event(_event):
+        nonlocal log_proc, last_len
+        c = pods.counts()
+        # start following once this run's pods exist (avoids picking up old logs);
+        # if the log stream dies (pod churn), restart it
+        if (c["Running"] or c["Succeeded"]) and (log_proc is None or log_proc.poll() is not None):
+            print("\n> " + " ".join(logs_cmd))
+            log_proc = subprocess.Popen(logs_cmd, text=True)
+        line = (f"[job {job_state.succeeded}/{total}] | active={job_state.active} | failed={job_state.failed}  "
+                f"|| [pods {len(pods.succeeded_indexes())}/{total}] | running={c['Running']} | "
+                f"pending={c['Pending']} | failed={c['Failed']}")
+        pad = " " * max(0, last_len - len(line))
+        print("\r" + line + pad, end="", flush=True)
+        last_len = len(line)
+
     try:
-        while True:
-            # Pods truth
-            pr = sh([KUBECTL, "-n", ns, "get", "pods", "-l", sel, "-o", "json"],
-                    check=False, capture_output=True, echo=False)
-
-            pods_succeeded = pods_started = pods_active = pods_failed = 0
-            if pr.returncode == 0 and pr.stdout:
-                pj = json.loads(pr.stdout)
-                for it in pj.get("items", []):
-                    phase = (it.get("status", {}).get("phase") or "")
-                    if phase in ("Running", "Succeeded"):
-                        pods_started += 1
-                    if phase == "Running":
-                        pods_active += 1
-                    elif phase == "Succeeded":
-                        pods_succeeded += 1
-                    elif phase == "Failed":
-                        pods_failed += 1
-
-            # Job status (informational only; it can be stale)
-            jr = sh([KUBECTL, "-n", ns, "get", "job", job, "-o",
-                     r'jsonpath={.status.succeeded}{","}{.status.active}{","}{.status.failed}'],
-                    check=False, capture_output=True, echo=False)
-            raw = (jr.stdout or "").strip()
-            parts = (raw.split(",") + ["", "", ""])[:3]
-            def toint(x): 
-                try: return int(x)
-                except: return 0
-            succ, act, fail = map(toint, parts)
-
-            line = (f"[job {succ}/{total}] | active={act} | failed={fail}  "
-                    f"|| [pods {pods_succeeded}/{total}] | running={pods_active} | failed={pods_failed}")
-            pad = " " * max(0, last_len - len(line))
-            print("\r" + line + pad, end="", flush=True)
-            last_len = len(line)
-
-            # ✅ Only pods decide completion
-            if (pods_succeeded >= total) and (pods_started > 0):
-                print("\n✔ Job complete (by pods)")
-                break
-
-            # If the log stream dies (pod churn), restart it
-            if log_proc.poll() is not None:
-                log_proc = subprocess.Popen(logs_cmd, text=True)
-
-            time.sleep(poll_s)
+        watch(pod_stream, f"/api/v1/namespaces/{ns}/pods", pods, {"labelSelector": sel},
+              on_event=on_event, stop=done)
     finally:
+        finished.set()
+        job_stream.cancel()
         if log_proc and log_proc.poll() is None:
-            try:
-                os.kill(log_proc.pid, signal.SIGTERM) if os.name != "nt" else log_proc.terminate()
-            except Exception:
-                pass
+            log_proc.terminate()
+
+    if job_errors:
+        raise RuntimeError(f"Lost the watch on job {job}: {job_errors[0]}")
+    if job_state.condition == "Failed":
+        print("\n✖ Job failed")
+    else:
+        # ✅ Only pods decide completion
+        print("\n✔ Job complete (by pods)")
+    return pods
 
 
 
@@ -139,16 +144,30 @@ if not sa_exists(FARGATE_NS, KSA):
     sh([KUBECTL, "-n", FARGATE_NS, "create", "sa", KSA])
 
 # Make sure your image exists (avoid ErrImagePull later)
-sh([AWS, "ecr", "describe-images",
-    "--repository-name", ECR_REPO,
-    "--image-ids", f"imageTag={IMAGE_TAG}",
-    "--region", REGION], check=False)
-
-ACCOUNT_ID = subprocess.check_output([AWS,"sts","get-caller-identity","--query","Account","--output","text"], text=True).strip()
-bucket_name = f"{BUCKET_PREFIX}{REGION}-{ACCOUNT_ID}"
-ECR_URI = f"{ACCOUNT_ID}.dkr.ecr.{REGION}.amazonaws.com/{ECR_REPO}:{IMAGE_TAG}"
+images = aws_clients.call_json("ecr", "describe_images", PROFILE, REGION,
+                               repositoryName=ECR_REPO, imageIds=[{"imageTag": IMAGE_TAG}])
+if images and images.get("imageDetails"):
+    img = images["imageDetails"][0]
+    print(f"✔ Image {ECR_REPO}:{IMAGE_TAG} pushed {img.get('imagePushedAt')} "
+          f"({img.get('imageSizeInBytes', 0) / 2**20:.0f} MiB)")
+else:
+    print(f"⚠ Image {ECR_REPO}:{IMAGE_TAG} not found in ECR; pods will fail with ErrImagePull (run step01)")
+
+ACCOUNT_ID = ctx.account_id
+bucket_name = ctx.bucket_name(BUCKET_PREFIX)
+ECR_URI = ctx.ecr_uri(ECR_REPO, IMAGE_TAG)
 
 SHARDS, PARALLELISM = shards, shards
+QUEUE_PREFIX = f"queue/{RUN_ID}/"
+s3 = upload_client(ctx.session, 16)
+if WORK_MODE == "queue":
+    # pods claim small batches of keys until the list is drained, instead of one folder each
+    tasks = write_task_queue(s3, bucket_name, QUEUE_PREFIX, [f"input/{i}/" for i in range(1, shards + 1)],
+                             QUEUE_BATCH_FILES)
+    print(f"✔ Queued {len(tasks)} tasks under s3://{bucket_name}/{QUEUE_PREFIX}")
+    output_prefixes = [f"output/tasks/{t['id']}/" for t in tasks]
+else:
+    output_prefixes = [f"output/{i}/" for i in range(1, SHARDS + 1)]
 job_yaml = f"""
 apiVersion: batch/v1
 kind: Job
@@ -178,11 +197,11 @@ spec:
         imagePullPolicy: IfNotPresent
         resources:
           requests:
-            cpu: "1"
-            memory: "2Gi"
+            cpu: "{WORKER_VCPUS}"
+            memory: "{WORKER_MEMORY_MIB}Mi"
           limits:
-            cpu: "1"
-            memory: "2Gi"
+            cpu: "{WORKER_VCPUS}"
+            memory: "{WORKER_MEMORY_MIB}Mi"
         env:
         - name: PYTHONUNBUFFERED
           value: "1"
@@ -196,6 +215,18 @@ spec:
           value: "output/"
         - name: PROCESS_CAP
           value: "500"
+        - name: FETCH_WORKERS
+          value: "16"
+        - name: PREFETCH_DEPTH
+          value: "64"
+        - name: RUN_ID
+          value: "{RUN_ID}"
+        - name: WORK_MODE
+          value: "{WORK_MODE}"
+        - name: QUEUE_PREFIX
+          value: "{QUEUE_PREFIX}"
+        - name: OUTPUT_ENCODING
+          value: "{OUTPUT_ENCODING}"
         - name: JOB_COMPLETION_INDEX
           valueFrom:
             fieldRef:
@@ -215,48 +246,39 @@ sh([KUBECTL, "-n", FARGATE_NS, "delete", "job", "qelabs-sim",
 sh([KUBECTL, "-n", FARGATE_NS, "delete", "pod",
     "-l", "job-name=qelabs-sim", "--ignore-not-found=true"])
 
-# 3) Wait until no pods exist with that label
-import time, json
-for _ in range(60):
-    r = sh([KUBECTL, "-n", FARGATE_NS, "get", "pods",
-            "-l", "job-name=qelabs-sim", "-o", "json"],
-           check=False, capture_output=True, echo=False)
-    if r.returncode == 0 and r.stdout and json.loads(r.stdout).get("items") == []:
-        break
-    time.sleep(2)
+# 3) Wait until no pods exist with that label (fails harmlessly when there are none)
+sh([KUBECTL, "-n", FARGATE_NS, "wait", "--for=delete", "pod",
+    "-l", "job-name=qelabs-sim", "--timeout=120s"], check=False)
 
 sh([KUBECTL, "apply", "-f", jp])
 
+# Download each shard's results as soon as its _SUCCESS marker appears, while the rest still run
+DEST = Path(rf"{data_path}/out"); DEST.mkdir(parents=True, exist_ok=True)
+downloader = ResultDownloader(s3, bucket_name, output_prefixes, DEST, run_id=RUN_ID).start()
+
 # Optional: watch pods come up (non-fatal if you skip)
 sh([KUBECTL, "-n", FARGATE_NS, "get", "pods", "-l", "job-name=qelabs-sim"])
 
-stream_job_logs_and_progress(FARGATE_NS, "qelabs-sim", SHARDS, run_id=RUN_ID, poll_s=5)
-
-# Wait for completion
-sh([KUBECTL, "-n", FARGATE_NS, "wait", "--for=condition=complete",
-    "job/qelabs-sim", "--timeout=60m"])
-
-# Show job summary and per-shard logs
-sh([KUBECTL, "-n", FARGATE_NS, "get", "job", "qelabs-sim", "-o", "wide"])
-
-# Fetch logs for each indexed pod (pod names end with -<index>-<suffix>)
-for i in range(SHARDS):
-    # Find the pod for this index
-    r = sh([KUBECTL, "-n", FARGATE_NS, "get", "pods",
-            "-l", "job-name=qelabs-sim",
-            "-o", f"jsonpath={{.items[?(@.metadata.annotations['batch\\.kubernetes\\.io/job-completion-index']=='{i}')].metadata.name}}"],
-           check=False, capture_output=True)
-    pod = (r.stdout or "").strip()
-    if pod:
-        print(f"\n=== logs for shard {i} -> {pod} ===")
-        sh([KUBECTL, "-n", FARGATE_NS, "logs", pod], check=False)
-
-
-
-# Download results from S3 to your PC
-
-from pathlib import Path
-DEST = Path(rf"{data_path}/out"); DEST.mkdir(parents=True, exist_ok=True)
-# CLI sync (fast and simple)
-sh([AWS,"s3","sync",f"s3://{bucket_name}/output/",str(DEST)])
+pod_table = None
+try:
+    pod_table = stream_job_logs_and_progress(FARGATE_NS, "qelabs-sim", SHARDS, run_id=RUN_ID)
+
+    # Wait for the Job's own Complete condition; the watch above already saw every index
+    # succeed (or the Job fail), so this is short and must not abort the log dump and
+    # the downloads below when the Job failed
+    sh([KUBECTL, "-n", FARGATE_NS, "wait", "--for=condition=complete",
+        "job/qelabs-sim", "--timeout=5m"], check=False)
+finally:
+    # Show job summary and per-shard logs, also when the job failed or the watch was lost
+    sh([KUBECTL, "-n", FARGATE_NS, "get", "job", "qelabs-sim", "-o", "wide"], check=False)
+
+    # Fetch logs for each indexed pod (names known from the watch)
+    for i in range(SHARDS):
+        pod = pod_table.pod_for_index(i) if pod_table is not None else None
+        if pod:
+            print(f"\n=== logs for shard {i} -> {pod} ===")
+            sh([KUBECTL, "-n", FARGATE_NS, "logs", pod], check=False)
+
+    # Results were downloading while the job ran; collect the shards that finished
+    downloader.finish()
 print(f"✔ Downloaded outputs to {DEST}")
\ No newline at end of file
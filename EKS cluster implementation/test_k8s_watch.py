@@ -0,0 +1,134 @@
+"""
+watch(), PodTable and JobState fed with recorded-style events instead of a cluster.
+
+    python -m pytest "EKS cluster implementation/test_k8s_watch.py"
+"""
+import json
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from k8s_watch import INDEX_ANNOTATION, JobState, KubectlStream, PodTable, WatchError, watch
+
+
+def pod(uid, phase, index, rv):
+    return {"metadata": {"uid": uid, "name": f"sim-{index}-{uid}", "resourceVersion": rv,
+                         "annotations": {INDEX_ANNOTATION: str(index)}},
+            "status": {"phase": phase}}
+
+
+def event(kind, obj):
+    return json.dumps({"type": kind, "object": obj}) + "\n"
+
+
+def listing(items, rv):
+    return [json.dumps({"items": items, "metadata": {"resourceVersion": rv}})]
+
+
+class FakeApi:
+    """open_path() replaying one scripted response per request: a list of lines or an exception."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.urls = []
+
+    def __call__(self, url):
+        self.urls.append(url)
+        resp = self.responses.pop(0) if self.responses else []
+        if isinstance(resp, Exception):
+            raise resp
+        yield from resp
+
+
+def test_watch_applies_events_until_stop():
+    api = FakeApi(listing([pod("a", "Pending", 0, "1")], "10"),
+                  [event("MODIFIED", pod("a", "Running", 0, "11")),
+                   event("ADDED", pod("b", "Running", 1, "12")),
+                   "\n",
+                   event("BOOKMARK", {"metadata": {"resourceVersion": "13"}})],
+                  [event("MODIFIED", pod("a", "Succeeded", 0, "14")),
+                   event("DELETED", pod("a", "Succeeded", 0, "15")),
+                   event("ADDED", pod("c", "Succeeded", 0, "16")),
+                   event("MODIFIED", pod("b", "Succeeded", 1, "17"))])
+    pods, seen = PodTable(), []
+    watch(api, "/api/v1/namespaces/ns/pods", pods, {"labelSelector": "job-name=sim"},
+          on_event=seen.append, stop=lambda: len(pods.succeeded_indexes()) >= 2, sleep=pytest.fail)
+    assert pods.succeeded_indexes() == {0, 1}
+    assert pods.pod_for_index(0) == "sim-0-c"
+    assert pods.counts()["Succeeded"] == 2
+    assert len(seen) == 7
+    # the second watch resumes from the bookmark's resourceVersion
+    assert "resourceVersion=13" in api.urls[2]
+
+
+def test_watch_relists_after_410_gone():
+    api = FakeApi(listing([], "5"),
+                  [event("ERROR", {"code": 410, "reason": "Expired"})],
+                  listing([pod("a", "Succeeded", 0, "90")], "90"))
+    pods = PodTable()
+    watch(api, "/p", pods, {}, stop=lambda: bool(pods.succeeded_indexes()), sleep=pytest.fail)
+    assert pods.resource_version == "90"
+    assert "watch" not in api.urls[2]
+
+
+def test_watch_backs_off_on_transient_failures():
+    api = FakeApi(WatchError("kubectl exited 1: Unauthorized"),
+                  [],     # empty body, e.g. kubectl killed before writing
+                  listing([], "1"),
+                  WatchError("connection refused"),
+                  [event("ADDED", pod("a", "Succeeded", 0, "2"))])
+    pods, slept = PodTable(), []
+    watch(api, "/p", pods, {}, stop=lambda: bool(pods.succeeded_indexes()), sleep=slept.append)
+    assert slept == [1, 2, 1]   # backoff restarts once a request succeeds
+
+
+def test_watch_gives_up_after_max_failures():
+    api = FakeApi(*[WatchError("forbidden")] * 5)
+    slept = []
+    with pytest.raises(WatchError, match="giving up after 4"):
+        watch(api, "/p", PodTable(), {}, max_failures=4, sleep=slept.append)
+    assert slept == [1, 2, 4]
+
+
+def test_job_state_sees_failed_condition():
+    job = {"metadata": {"resourceVersion": "7"},
+           "status": {"active": 1, "failed": 3,
+                      "conditions": [{"type": "Failed", "status": "True", "reason": "BackoffLimitExceeded"}]}}
+    state = JobState()
+    watch(FakeApi(listing([], "6"), [event("MODIFIED", job)]), "/j", state, {},
+          stop=lambda: state.condition is not None, sleep=pytest.fail)
+    assert (state.condition, state.failed, state.resource_version) == ("Failed", 3, "7")
+
+
+@pytest.fixture
+def fake_kubectl(tmp_path):
+    """An executable standing in for kubectl: runs the Python snippet given by the path's last segment."""
+    script = tmp_path / "kubectl"
+    script.write_text(f"#!{sys.executable}\nimport sys, time\nexec(sys.argv[-1].rsplit('/', 1)[1])\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+def test_kubectl_stream_raises_on_failure(fake_kubectl):
+    stream = KubectlStream(fake_kubectl)
+    assert list(stream("/ok/print('line')")) == ["line\n"]
+    with pytest.raises(WatchError, match="exited 3: denied"):
+        list(stream("/bad/sys.stderr.write('denied'); sys.exit(3)"))
+
+
+def test_kubectl_stream_cancel_wakes_reader(fake_kubectl):
+    stream = KubectlStream(fake_kubectl)
+    lines = []
+    reader = threading.Thread(target=lambda: lines.extend(stream("/slow/print('x', flush=True); time.sleep(60)")))
+    reader.start()
+    time.sleep(0.5)
+    t0 = time.monotonic()
+    stream.cancel()
+    reader.join(10)
+    assert not reader.is_alive() and time.monotonic() - t0 < 5
+    assert lines == ["x\n"]     # cancelled: no WatchError for the terminated kubectl
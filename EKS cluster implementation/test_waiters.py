@@ -0,0 +1,90 @@
+"""
+wait_for() and wait_all() on a FakeClock: backoff, jitter, deadlines and failures without sleeping.
+
+    python -m pytest "EKS cluster implementation/test_waiters.py"
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from waiters import FakeClock, WaitFailed, WaitResult, WaitTimeout, wait_all, wait_for
+
+
+class FixedRng:
+    """rng.random() always returning `value` (0 = no jitter, close to 1 = maximum jitter)."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+def states(*values):
+    """probe() returning `values` one per call, then repeating the last one."""
+    values = list(values)
+    return lambda: values.pop(0) if len(values) > 1 else values[0]
+
+
+def test_backoff_grows_by_factor_up_to_max_interval():
+    clock = FakeClock()
+    result = wait_for("stack", states(*["CREATING"] * 6, "READY"), lambda s: s == "READY",
+                      initial=2, factor=2, max_interval=10, jitter=0, clock=clock, rng=FixedRng(0.5), quiet=True)
+    assert clock.slept == [2, 4, 8, 10, 10, 10]
+    assert (result.state, result.polls, result.seconds) == ("READY", 7, 44)
+
+
+def test_jitter_only_shortens_the_interval():
+    low, high = FakeClock(), FakeClock()
+    for clock, value in ((low, 0.0), (high, 0.999)):
+        wait_for("x", states("a", "a", "a", "b"), lambda s: s == "b", initial=4, factor=1, jitter=0.25,
+                 clock=clock, rng=FixedRng(value), quiet=True)
+    assert low.slept == [4, 4, 4]
+    assert all(3 <= s < 3.01 for s in high.slept)     # 4 * (1 - 0.25 * 0.999)
+
+
+def test_timeout_sleeps_no_further_than_the_deadline():
+    clock = FakeClock()
+    with pytest.raises(WaitTimeout, match="still PENDING after 10s"):
+        wait_for("nodegroup", lambda: "PENDING", lambda s: False, timeout=10, initial=4, factor=1,
+                 jitter=0, clock=clock, quiet=True)
+    assert clock.slept == [4, 4, 2]
+    assert clock.now == 10
+
+
+def test_failed_state_stops_at_once():
+    clock = FakeClock()
+    with pytest.raises(WaitFailed, match=r"cluster: FAILED \(rollback\)"):
+        wait_for("cluster", states("CREATING", "FAILED"), lambda s: s == "ACTIVE",
+                 failed=lambda s: "rollback" if s == "FAILED" else None, clock=clock, quiet=True)
+    assert len(clock.slept) == 1
+
+
+def test_wait_all_waits_for_everything_then_raises_the_first_error():
+    finished = []
+
+    def ok(name):
+        def run():
+            result = wait_for(name, states("a", "b"), lambda s: s == "b", jitter=0, clock=FakeClock(), quiet=True)
+            finished.append(name)
+            return result
+        return run
+
+    def fail(exc):
+        def run():
+            raise exc
+        return run
+
+    with pytest.raises(WaitTimeout, match="first"):
+        wait_all([ok("one"), fail(WaitTimeout("first")), ok("two"), fail(WaitFailed("second"))], quiet=True)
+    assert sorted(finished) == ["one", "two"]
+
+
+def test_wait_all_returns_results_in_order():
+    results = wait_all([lambda: wait_for("slow", states(1, 2, 3), lambda s: s == 3, clock=FakeClock(), quiet=True),
+                        lambda: "plain value"], quiet=True)
+    assert isinstance(results[0], WaitResult) and results[0].polls == 3
+    assert results[1] == "plain value"
+    assert wait_all([]) == []
@@ -0,0 +1,166 @@
+"""
+Resolve the AWS identity every step needs, once per SSO session.
+
+Each step used to start by checking the SSO login (sts get-caller-identity),
+looking up the region, calling sts get-caller-identity again for the account
+ID and deriving the bucket name / ECR URI from them. bootstrap() does this
+once and caches region, account and ARN per profile in STATE_PATH, valid until
+the profile's SSO token expires (read from the AWS CLI's ~/.aws/sso/cache).
+Later steps with a valid entry skip both the login check and STS, as long
+as the token file still holds the same token (a logout or a new login re-checks).
+
+    ctx = bootstrap(AWS, PROFILE)
+    bucket_name = ctx.bucket_name(BUCKET_PREFIX)
+
+Profiles without SSO (static or assumed-role keys) are cached for DEFAULT_TTL.
+clear() (or deleting the file) forces a fresh lookup, e.g. after switching
+accounts behind the same profile name.
+"""
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+import aws_clients
+
+STATE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "qelabs", "bootstrap.json")
+DEFAULT_TTL = 12 * 3600
+MIN_REMAINING = 300     # re-check identity when less than this is left on the SSO session
+_lock = threading.Lock()
+
+
+class AwsContext:
+    def __init__(self, profile, region, account_id, arn, expires_at, cached):
+        self.profile = profile
+        self.region = region
+        self.account_id = account_id
+        self.arn = arn
+        self.expires_at = expires_at
+        self.cached = cached        # True if this came from the state file
+
+    @property
+    def session(self):
+        return aws_clients.session(self.profile, self.region)
+
+    def client(self, service, **kwargs):
+        return aws_clients.client(service, self.profile, self.region, **kwargs)
+
+    def bucket_name(self, prefix):
+        return f"{prefix}{self.region}-{self.account_id}"
+
+    def ecr_uri(self, repo, tag):
+        return f"{self.account_id}.dkr.ecr.{self.region}.amazonaws.com/{repo}:{tag}"
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def sso_expiry(profile):
+    """
+    Epoch seconds at which the profile's cached SSO token expires: None if it
+    isn't an SSO profile, 0 if it is but no token file was found.
+    """
+    config = aws_clients.session(profile)._session.full_config
+    prof = config.get("profiles", {}).get(profile or "default", {})
+    key = prof.get("sso_session") or prof.get("sso_start_url")
+    if not key:
+        return None
+    cache = os.path.join(os.path.expanduser("~"), ".aws", "sso", "cache",
+                         hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+    try:
+        with open(cache, encoding="utf-8") as f:
+            expires = json.load(f)["expiresAt"]
+    except (OSError, ValueError, KeyError):
+        return 0    # SSO profile but no token: expired
+    return datetime.datetime.fromisoformat(expires.replace("Z", "+00:00")).timestamp()
+
+
+def _identity(AWS, profile, region):
+    """get_caller_identity, logging in through `aws sso login` once if the session is missing or expired."""
+    try:
+        return aws_clients.client("sts", profile, region).get_caller_identity()
+    except (BotoCoreError, ClientError):
+        print(f"🔄 SSO session expired or missing, logging in to {profile}...")
+        subprocess.run([AWS, "sso", "login", "--profile", profile], check=True)
+        aws_clients.reset(profile)
+        print("✅ AWS SSO login successful!")
+        return aws_clients.client("sts", profile, region).get_caller_identity()
+
+
+def bootstrap(AWS, profile, state_path=STATE_PATH) -> AwsContext:
+    """Region and account for `profile`, from the state file if its SSO session is still valid."""
+    os.environ["AWS_PROFILE"] = profile
+    os.environ["AWS_PAGER"] = ""    # disable the CLI's built-in pager for the commands still shelled out
+    now = time.time()
+    with _lock:
+        entry = _load(state_path).get(profile)
+    if entry:
+        # the token file may have been removed (sso logout) or replaced by a new login since
+        # the entry was written: only the same, still-valid token keeps the cached identity
+        token = sso_expiry(profile)
+        if token is not None and token != entry.get("expires_at"):
+            entry = None
+    if entry and entry.get("expires_at", 0) - now > MIN_REMAINING:
+        left = (entry["expires_at"] - now) / 3600
+        print(f"✅ AWS profile {profile}: account {entry['account_id']}, {entry['region']} "
+              f"(cached, valid for {left:.1f}h)")
+        return AwsContext(profile, entry["region"], entry["account_id"], entry["arn"], entry["expires_at"], True)
+
+    region = aws_clients.region_of(profile)
+    if not region:
+        raise RuntimeError(f"No region resolved for profile '{profile}'. Set region in ~/.aws/config.")
+    ident = _identity(AWS, profile, region)
+    expires_at = sso_expiry(profile)
+    if expires_at is None:
+        expires_at = now + DEFAULT_TTL      # static or assumed-role keys
+    print(f"✅ Logged in to AWS profile {profile}: account {ident['Account']}, {region}")
+    if expires_at - now <= MIN_REMAINING:
+        # SSO profile whose token file can't be found (or is about to expire): nothing to key the cache on
+        return AwsContext(profile, region, ident["Account"], ident["Arn"], expires_at, False)
+    entry = {"region": region, "account_id": ident["Account"], "arn": ident["Arn"], "expires_at": expires_at}
+    with _lock:
+        state = _load(state_path)
+        state[profile] = entry
+        _save(state_path, state)
+    return AwsContext(profile, region, ident["Account"], ident["Arn"], expires_at, False)
+
+
+def clear(profile=None, state_path=STATE_PATH):
+    """Forget the cached identity of `profile` (all profiles if None)."""
+    with _lock:
+        state = _load(state_path)
+        for key in [k for k in state if profile is None or k == profile]:
+            del state[key]
+        _save(state_path, state)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Forget cached AWS identities (see bootstrap.py).")
+    parser.add_argument("--clear", nargs="?", const="", metavar="PROFILE", help="one profile, or all if omitted")
+    args = parser.parse_args()
+    if args.clear is not None:
+        clear(args.clear or None)
+        print(f"✔ Cleared cached identity for {args.clear or 'all profiles'} in {STATE_PATH}")
+    else:
+        for name, entry in _load(STATE_PATH).items():
+            left = (entry.get("expires_at", 0) - time.time()) / 3600
+            print(f"{name}: account {entry['account_id']}, {entry['region']}, valid for {left:.1f}h")
@@ -0,0 +1,208 @@
+"""
+Encoders for the input payloads uploaded by step04.
+
+The worker (dummy docker context/app/formats.py) auto-detects these formats,
+so the constants below must stay in sync with it.
+"""
+import gzip
+import json
+import os
+import struct
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+try:
+    import zstandard  # optional: only needed for encoding = "zstd"
+except ImportError:
+    zstandard = None
+
+# Binary "numbers" payload: 16-byte header followed by raw little-endian float64.
+#   magic(4s) | version(u8) | dtype code(u8, 1 = <f8) | reserved(u16) | count(u64)
+BINARY_MAGIC = b"QENB"
+BINARY_VERSION = 1
+BINARY_DTYPE_F8 = 1
+BINARY_HEADER = struct.Struct("<4sBBHQ")
+BINARY_SUFFIX = ".bin"
+
+
+def encode_numbers_binary(numbers) -> bytes:
+    """Encode a vector of floats as header + little-endian float64."""
+    arr = np.ascontiguousarray(numbers, dtype="<f8")
+    return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_DTYPE_F8, 0, arr.size) + arr.tobytes()
+
+
+def json_to_binary(raw: bytes) -> bytes:
+    """Re-encode one JSON input file ({"numbers": [...]}) in the binary format."""
+    return encode_numbers_binary(json.loads(raw)["numbers"])
+
+
+def binary_name(name: str) -> str:
+    """'12.json' -> '12.bin'"""
+    return os.path.splitext(name)[0] + BINARY_SUFFIX
+
+
+def stage_binary_shard(src_dir, dst_dir) -> str:
+    """
+    Write a binary copy of every JSON file in src_dir into dst_dir and return dst_dir.
+    Files whose staged copy is newer than the source are left alone, so re-staging
+    an unchanged shard is cheap; staged files whose source is gone are removed.
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    names = sorted(n for n in os.listdir(src_dir) if os.path.isfile(os.path.join(src_dir, n)))
+    wanted = {binary_name(n) for n in names}
+    for name in os.listdir(dst_dir):
+        if name not in wanted:
+            os.remove(os.path.join(dst_dir, name))
+    for name in names:
+        src = os.path.join(src_dir, name)
+        dst = os.path.join(dst_dir, binary_name(name))
+        if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+            continue
+        with open(src, "rb") as f:
+            data = json_to_binary(f.read())
+        with open(dst, "wb") as f:
+            f.write(data)
+    return dst_dir
+
+
+# Compression: objects are uploaded gzip/zstd-compressed with a matching
+# Content-Encoding (archive members are compressed one by one instead, so byte
+# ranges still line up). Both sides also recognise compressed data by its magic.
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ENCODINGS = ("identity", "gzip", "zstd")
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError("encoding = \"zstd\" needs the 'zstandard' package (pip install zstandard)")
+    return zstandard
+
+
+def compress(data: bytes, encoding) -> bytes:
+    if encoding in (None, "", "identity"):
+        return data
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)   # mtime=0: same input, same bytes
+    if encoding == "zstd":
+        return _require_zstd().ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+def decompress(data: bytes) -> bytes:
+    """Undo compress(), recognising the codec by its magic; other data is returned as is."""
+    if data[:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[:4] == ZSTD_MAGIC:
+        return _require_zstd().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+# Packed shard archive: one object per shard instead of one per file.
+#   header(16 bytes) | index (JSON) | member data, concatenated
+#   header: magic(4s) | version(u8) | flags(u8) | reserved(u16) | index length(u64)
+#   index:  {"members": [[name, offset, length], ...]}, offsets relative to the data section
+# Members are stored in name order, i.e. the order S3 would list them as loose files.
+PACK_MAGIC = b"QEPK"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sBBHQ")
+PACK_SUFFIX = ".pack"
+
+
+def pack_members(members) -> bytes:
+    """Pack [(name, payload), ...] into one archive (sorted by name)."""
+    members = sorted(members, key=lambda m: m[0])
+    entries, offset = [], 0
+    for name, payload in members:
+        entries.append([name, offset, len(payload)])
+        offset += len(payload)
+    index = json.dumps({"members": entries}, separators=(",", ":")).encode("utf-8")
+    header = PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, 0, len(index))
+    return b"".join([header, index, *(payload for _, payload in members)])
+
+
+def pack_member_names(path) -> list:
+    """Member names of the archive at `path`, read from its index only."""
+    with open(path, "rb") as f:
+        magic, version, _, _, index_len = PACK_HEADER.unpack(f.read(PACK_HEADER.size))
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"{path}: not a version {PACK_VERSION} shard archive")
+        return [m[0] for m in json.loads(f.read(index_len))["members"]]
+
+
+def stage_packed_shard(src_dir, dst_dir, input_format="json", encoding="identity") -> str:
+    """
+    Pack every file of src_dir (re-encoded as binary if input_format == "binary",
+    each member compressed with `encoding`) into dst_dir/shard.pack and return
+    dst_dir. See stage_packed_files() for when the archive is rebuilt.
+    """
+    names = sorted(n for n in os.listdir(src_dir) if os.path.isfile(os.path.join(src_dir, n)))
+    return stage_packed_files([(os.path.join(src_dir, n), n) for n in names], dst_dir, input_format, encoding)
+
+
+def stage_packed_files(files, dst_dir, input_format="json", encoding="identity") -> str:
+    """
+    Pack [(path, member name), ...] into dst_dir/shard.pack (members re-encoded and
+    renamed as binary if input_format == "binary", each compressed with `encoding`)
+    and return dst_dir. The archive is rebuilt only when a source file is newer
+    than it or the set of members changed (compared with the names in its index).
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    dst = os.path.join(dst_dir, "shard" + PACK_SUFFIX)
+    if input_format == "binary":
+        files = [(path, binary_name(name)) for path, name in files]
+    if os.path.exists(dst):
+        built = os.path.getmtime(dst)
+        if (all(os.path.getmtime(path) <= built for path, _ in files)
+                and pack_member_names(dst) == sorted(name for _, name in files)):
+            return dst_dir
+    members = []
+    for path, name in files:
+        with open(path, "rb") as f:
+            raw = f.read()
+        members.append((name, compress(json_to_binary(raw) if input_format == "binary" else raw, encoding)))
+    with open(dst, "wb") as f:
+        f.write(pack_members(members))
+    return dst_dir
+
+
+# Per-shard manifest: lets the worker start without listing the bucket.
+#   {"version": 1, "prefix": "input/1/", "objects": [{"key", "size", "etag"}, ...]}
+MANIFEST_NAME = "_manifest.json"
+
+
+def build_manifest(prefix, objects) -> dict:
+    """objects: iterable of dicts with key/size/etag, kept in key order like an S3 listing."""
+    objs = sorted(({"key": o["key"], "size": int(o["size"]), "etag": o["etag"]} for o in objects),
+                  key=lambda o: o["key"])
+    return {"version": 1, "prefix": prefix, "objects": objs}
+
+
+def put_manifest(s3, bucket, prefix, objects) -> dict:
+    """Store the manifest of `objects` (dicts with key/size/etag) as `prefix` + MANIFEST_NAME."""
+    manifest = build_manifest(prefix, objects)
+    s3.put_object(Bucket=bucket, Key=prefix + MANIFEST_NAME,
+                  Body=json.dumps(manifest).encode("utf-8"), ContentType="application/json")
+    return manifest
+
+
+def get_manifest(s3, bucket, prefix):
+    """The manifest stored as `prefix` + MANIFEST_NAME, or None if there is none."""
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=prefix + MANIFEST_NAME)["Body"].read())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+
+
+def write_shard_manifest(s3, bucket, prefix) -> dict:
+    """List `prefix` once and store its keys, sizes and ETags as `prefix` + MANIFEST_NAME."""
+    objects = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith("/" + MANIFEST_NAME):
+                continue
+            objects.append({"key": obj["Key"], "size": obj["Size"], "etag": obj["ETag"]})
+    return put_manifest(s3, bucket, prefix, objects)
@@ -0,0 +1,111 @@
+"""Checkpoints of a shard's progress, so a retried pod/job resumes where the last attempt died.
+
+Each checkpoint is a small object holding only what was completed since the
+previous one:
+
+    <output_prefix>_checkpoint/000001.json  {"version": 2, "fingerprint": "...", "keys": [...], "results": [...]}
+
+Files are processed in a fixed order, so the checkpoints always cover a prefix
+of the shard and a resumed run produces the same output as an uninterrupted one.
+The fingerprint identifies the inputs (e.g. a hash of the manifest's keys and
+ETags); checkpoints written for other inputs are discarded instead of resumed.
+Checkpoints are written with `If-None-Match: *`, so when two workers end up on
+the same output (a queue task whose lease was stolen) only one of them can
+extend the sequence; the other gets CheckpointConflict.
+"""
+import json
+import time
+
+from botocore.exceptions import ClientError
+
+CHECKPOINT_DIR = "_checkpoint/"
+
+
+class CheckpointConflict(Exception):
+    """Another writer committed the same checkpoint sequence number first."""
+
+
+class Checkpointer:
+    def __init__(self, s3, bucket, output_prefix, every=500, seconds=60.0, fingerprint=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = output_prefix + CHECKPOINT_DIR
+        self.every = every          # commit after this many new results (0 = never by count)
+        self.seconds = seconds      # ... or after this many seconds (0 = never by time)
+        self.fingerprint = fingerprint
+        self.seq = 0
+        self.committed = 0          # results covered by checkpoints so far
+        self._keys, self._results = [], []   # completed since the last checkpoint
+        self._last = time.monotonic()
+
+    @property
+    def enabled(self):
+        return self.every > 0 or self.seconds > 0
+
+    def _part_keys(self):
+        keys = []
+        for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return sorted(keys)
+
+    def restore(self):
+        """
+        Return [(keys, results), ...] of the checkpoints left by earlier attempts,
+        oldest first; [] (and the checkpoints deleted) if any was written for other inputs.
+        """
+        if not self.enabled:
+            return []
+        parts = []
+        for part in self._part_keys():
+            data = json.loads(self.s3.get_object(Bucket=self.bucket, Key=part)["Body"].read())
+            if data.get("fingerprint") != self.fingerprint:
+                self.discard("they were written for different inputs")
+                return []
+            parts.append((part, data))
+        for part, data in parts:
+            self.seq = max(self.seq, int(part.rsplit("/", 1)[1].split(".")[0]))
+            self.committed += len(data["results"])
+        return [(data["keys"], data["results"]) for _, data in parts]
+
+    def discard(self, reason):
+        """Delete the restorable checkpoints and start over from the first file."""
+        print(f"⚠ Ignoring checkpoints under {self.prefix}: {reason}")
+        self.clear()
+        self.seq = 0
+        self.committed = 0
+
+    def add(self, keys, results):
+        """Record newly completed files; commit a checkpoint if enough work or time piled up."""
+        if not self.enabled:
+            return False
+        self._keys.extend(keys)
+        self._results.extend(float(x) for x in results)
+        pending = len(self._results)
+        due = (self.every > 0 and pending >= self.every) or \
+              (self.seconds > 0 and time.monotonic() - self._last >= self.seconds)
+        return self.commit() if due else False
+
+    def commit(self):
+        if not self._results:
+            return False
+        self.seq += 1
+        body = {"version": 2, "fingerprint": self.fingerprint, "keys": self._keys, "results": self._results}
+        key = f"{self.prefix}{self.seq:06d}.json"
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(body).encode("utf-8"),
+                               ContentType="application/json", IfNoneMatch="*")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "412", "ConditionalRequestConflict", "409"):
+                raise CheckpointConflict(f"{key} already exists") from e
+            raise
+        self.committed += len(self._results)
+        self._keys, self._results = [], []
+        self._last = time.monotonic()
+        return True
+
+    def clear(self):
+        """Delete all checkpoints once the final output is written."""
+        keys = self._part_keys() if self.enabled else []
+        for i in range(0, len(keys), 1000):
+            self.s3.delete_objects(Bucket=self.bucket,
+                                   Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True})
@@ -0,0 +1,243 @@
+"""Parsing and reduction of input payloads.
+
+Files are parsed straight into rows of one preallocated float64 buffer and the
+whole batch is reduced with a single vectorized call, instead of building a
+fresh array and calling np.sum per file.
+
+With more than one CPU available, parsing (the expensive part) is fanned out
+over a process pool: each worker process parses a batch into a shared-memory
+buffer and the parent reduces it in place, so parsed arrays are never pickled.
+"""
+import math
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from formats import decode_numbers
+
+
+def parse_numbers(payload: bytes):
+    """Return the "numbers" vector of one input payload (JSON or binary)."""
+    return decode_numbers(payload)
+
+
+def cpu_allotment() -> int:
+    """
+    Number of CPUs this container may use: the cgroup CPU quota if one is set
+    (cgroup v2 cpu.max, else v1 cfs quota/period), capped by the CPU affinity mask.
+    """
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+    quota = period = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            q, p = f.read().split()[:2]
+        if q != "max":
+            quota, period = int(q), int(p)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                q = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                p = int(f.read())
+            if q > 0:
+                quota, period = q, p
+        except (OSError, ValueError):
+            pass
+    if quota and period:
+        available = min(available, max(1, math.ceil(quota / period)))
+    return max(1, available)
+
+
+class BatchReducer:
+    """Row-sums batches of payloads through a reusable (rows x width) float64 buffer."""
+
+    def __init__(self, rows: int):
+        self.rows = max(1, int(rows))
+        self.buf = None  # allocated on first use, once the vector length is known
+        self.metrics = None  # optional WorkerMetrics: parse time per file, reduce time per batch
+
+    def _ensure_width(self, width: int, filled: int):
+        if self.buf is None:
+            self.buf = np.empty((self.rows, width), dtype=np.float64)
+        elif width > self.buf.shape[1]:
+            # a longer vector showed up: widen, keeping rows already parsed in this batch
+            grown = np.zeros((self.rows, width), dtype=np.float64)
+            grown[:filled, :self.buf.shape[1]] = self.buf[:filled]
+            self.buf = grown
+
+    def reduce(self, payloads, out):
+        """Parse `payloads` into the buffer and write each row's sum into `out`."""
+        n = len(payloads)
+        if n == 0:
+            return out
+        width = 0
+        for r, payload in enumerate(payloads):
+            t0 = time.perf_counter()
+            numbers = parse_numbers(payload)
+            m = len(numbers)
+            self._ensure_width(m, r)
+            self.buf[r, :m] = numbers
+            self.buf[r, m:] = 0.0  # ragged rows: zero padding leaves the sum unchanged
+            width = max(width, m)
+            if self.metrics is not None:
+                self.metrics.observe("parse_seconds", time.perf_counter() - t0)
+        # only the used columns, so uniform batches sum exactly like np.sum on each file
+        t0 = time.perf_counter()
+        np.sum(self.buf[:n, :width], axis=1, out=out)
+        if self.metrics is not None:
+            self.metrics.observe("reduce_seconds", time.perf_counter() - t0)
+        return out
+
+    # same interface as ParallelReducer: submit() returns finished batches in order
+    def submit(self, payloads):
+        if not payloads:
+            return []
+        return [self.reduce(payloads, np.empty(len(payloads), dtype=np.float64))]
+
+    def drain(self):
+        return []
+
+    def close(self):
+        pass
+
+
+# worker-process side: the shared-memory block attached for each slot
+_attached = {}
+
+
+def _attach(slot, shm_name):
+    """
+    Attach the slot's block, closing the one attached before if the parent has
+    since replaced it (widened or recreated), so old blocks don't stay mapped.
+    """
+    shm = _attached.get(slot)
+    if shm is not None and shm.name == shm_name:
+        return shm
+    if shm is not None:
+        shm.close()
+    if sys.version_info >= (3, 13):
+        shm = SharedMemory(name=shm_name, track=False)
+    else:
+        # before 3.13 attaching also registers the block with the resource
+        # tracker, which may unlink it or warn about it; the parent owns it
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            shm = SharedMemory(name=shm_name)
+        finally:
+            resource_tracker.register = register
+    _attached[slot] = shm
+    return shm
+
+
+def _parse_into_slot(slot, shm_name, rows, width, payloads):
+    """Parse payloads into rows of a shared (rows x width) buffer; return (n, widest row, parse times)."""
+    shm = _attach(slot, shm_name)
+    buf = np.ndarray((rows, width), dtype=np.float64, buffer=shm.buf)
+    need = 0
+    times = []
+    for r, payload in enumerate(payloads):
+        t0 = time.perf_counter()
+        numbers = parse_numbers(payload)
+        m = len(numbers)
+        need = max(need, m)
+        if m <= width:  # else the parent widens the slot and resubmits
+            buf[r, :m] = numbers
+            buf[r, m:] = 0.0
+        times.append(time.perf_counter() - t0)
+    return len(payloads), need, times
+
+
+class ParallelReducer:
+    """
+    Parses batches on a process pool into shared-memory slots and row-sums them
+    in the parent. Up to two batches per process are in flight; submit() and
+    drain() hand back result arrays in submission order.
+    """
+
+    def __init__(self, rows: int, processes: int):
+        self.rows = max(1, int(rows))
+        self.processes = processes
+        # spawn, not fork: the parent already runs fetcher threads
+        self.pool = ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn"))
+        n_slots = 2 * processes
+        self._shms = [None] * n_slots
+        self._widths = [0] * n_slots
+        self._free = deque(range(n_slots))
+        self._inflight = deque()    # (future, slot, payloads)
+        self._width = None          # width for newly allocated slots
+        self.metrics = None         # optional WorkerMetrics, as on BatchReducer
+
+    def _alloc_slot(self, slot, width):
+        if self._shms[slot] is not None:
+            self._shms[slot].close()
+            self._shms[slot].unlink()
+        self._shms[slot] = SharedMemory(create=True, size=self.rows * width * 8)
+        self._widths[slot] = width
+        self._width = max(self._width or 0, width)
+
+    def _run(self, slot, payloads):
+        return self.pool.submit(_parse_into_slot, slot, self._shms[slot].name, self.rows,
+                                self._widths[slot], payloads)
+
+    def _collect_head(self):
+        fut, slot, payloads = self._inflight[0]
+        n, need, times = fut.result()
+        while need > self._widths[slot]:
+            # a longer vector than this slot holds: widen the slot and parse again
+            self._alloc_slot(slot, need)
+            n, need, times = self._run(slot, payloads).result()
+        self._inflight.popleft()
+        view = np.ndarray((self.rows, self._widths[slot]), dtype=np.float64, buffer=self._shms[slot].buf)
+        t0 = time.perf_counter()
+        out = np.sum(view[:n, :need], axis=1)
+        if self.metrics is not None:
+            for t in times:
+                self.metrics.observe("parse_seconds", t)
+            self.metrics.observe("reduce_seconds", time.perf_counter() - t0)
+        self._free.append(slot)
+        return out
+
+    def submit(self, payloads):
+        if not payloads:
+            return []
+        done = []
+        if not self._free:
+            done.append(self._collect_head())
+        slot = self._free.popleft()
+        if self._shms[slot] is None:
+            if self._width is None:
+                self._width = max(1, len(parse_numbers(payloads[0])))
+            self._alloc_slot(slot, self._width)
+        # memoryview slices of archive ranges can't be pickled; workers get plain bytes
+        payloads = [p if isinstance(p, bytes) else bytes(p) for p in payloads]
+        self._inflight.append((self._run(slot, payloads), slot, payloads))
+        return done
+
+    def drain(self):
+        while self._inflight:
+            yield self._collect_head()
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        for shm in self._shms:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._shms = [None] * len(self._shms)
+
+
+def make_reducer(rows: int, processes: int):
+    """In-process reducer on one CPU, process pool + shared memory on more."""
+    if processes <= 1:
+        return BatchReducer(rows)
+    return ParallelReducer(rows, processes)
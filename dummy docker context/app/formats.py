@@ -0,0 +1,128 @@
+"""Decoding of input payloads.
+
+Two encodings of the "numbers" vector are accepted and told apart by their
+first bytes, so JSON inputs keep working next to binary ones:
+
+* JSON:   {"numbers": [...]}
+* binary: 16-byte header (magic "QENB", version, dtype code, reserved, count)
+          followed by raw little-endian float64 (written by step04, see
+          data_formats.py at the repo root)
+
+A shard's files may also arrive packed into one archive object with an offset
+index up front, so the worker can read members through byte-range GETs.
+
+Any payload may additionally be gzip- or zstd-compressed (Content-Encoding on
+the object, or per member inside an archive); decompress() undoes that.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard  # optional: only needed for zstd-encoded objects
+except ImportError:
+    zstandard = None
+
+BINARY_MAGIC = b"QENB"
+BINARY_HEADER = struct.Struct("<4sBBHQ")
+_DTYPES = {1: np.dtype("<f8")}
+
+
+def decode_numbers(payload: bytes):
+    """Return the numbers vector: a zero-copy float64 view for binary, a list for JSON."""
+    if payload[:4] == BINARY_MAGIC:
+        _, version, dtype_code, _, count = BINARY_HEADER.unpack_from(payload)
+        if version != 1 or dtype_code not in _DTYPES:
+            raise ValueError(f"unsupported binary payload (version={version}, dtype={dtype_code})")
+        return np.frombuffer(payload, dtype=_DTYPES[dtype_code], count=count,
+                             offset=BINARY_HEADER.size)
+    return json.loads(bytes(payload))["numbers"]
+
+
+# --- compression ---
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ENCODINGS = ("identity", "gzip", "zstd")
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError("zstd-encoded data needs the 'zstandard' package (pip install zstandard)")
+    return zstandard
+
+
+def decompress(payload, encoding=None):
+    """
+    Undo gzip/zstd compression. `encoding` is the object's Content-Encoding;
+    without one the payload's magic bytes decide, so uncompressed data passes through.
+    """
+    if encoding in (None, "", "identity"):
+        if payload[:2] == GZIP_MAGIC:
+            encoding = "gzip"
+        elif payload[:4] == ZSTD_MAGIC:
+            encoding = "zstd"
+        else:
+            return payload
+    if encoding == "gzip":
+        return zlib.decompress(payload, wbits=47)   # 32 + 15: gzip or zlib header
+    if encoding == "zstd":
+        # streamed frames carry no content size, so decompress through a stream object
+        return _require_zstd().ZstdDecompressor().decompressobj().decompress(bytes(payload))
+    raise ValueError(f"unsupported Content-Encoding {encoding!r}")
+
+
+def compressor(encoding):
+    """Streaming compressor with compress(bytes) / flush(), or None for "identity"."""
+    if encoding in (None, "", "identity"):
+        return None
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if encoding == "zstd":
+        return _require_zstd().ZstdCompressor(level=3).compressobj()
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+
+# --- packed shard archives ---
+# header(16 bytes) | index (JSON, utf-8) | member data, concatenated
+#   header: magic "QEPK" | version(u8) | flags(u8) | reserved(u16) | index length(u64)
+#   index:  {"members": [[name, offset, length], ...]}, offsets relative to the data section
+PACK_MAGIC = b"QEPK"
+PACK_HEADER = struct.Struct("<4sBBHQ")
+PACK_SUFFIX = ".pack"
+
+
+def parse_pack_header(head: bytes) -> int:
+    """Return the index length of an archive given (at least) its first 16 bytes."""
+    magic, version, _, _, index_len = PACK_HEADER.unpack_from(head)
+    if magic != PACK_MAGIC or version != 1:
+        raise ValueError(f"not a v1 shard archive (magic={magic!r}, version={version})")
+    return index_len
+
+
+def parse_pack_index(head: bytes):
+    """Return (data_start, [(name, offset, length), ...]) from the archive's leading bytes."""
+    index_len = parse_pack_header(head)
+    data_start = PACK_HEADER.size + index_len
+    index = json.loads(bytes(head[PACK_HEADER.size:data_start]))
+    return data_start, [tuple(m) for m in index["members"]]
+
+
+def coalesce_ranges(members, max_bytes):
+    """
+    Group members (sorted by offset) into runs that can be fetched with one
+    byte-range GET of at most max_bytes (a single larger member gets its own run).
+    """
+    groups, current, start = [], [], 0
+    for m in sorted(members, key=lambda m: m[1]):
+        _, off, length = m
+        if current and off + length - start > max_bytes:
+            groups.append(current)
+            current = []
+        if not current:
+            start = off
+        current.append(m)
+    if current:
+        groups.append(current)
+    return groups
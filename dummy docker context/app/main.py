@@ -1,37 +1,77 @@
+import hashlib
 import os
+import socket
+import time
+from collections import deque
+from itertools import chain, islice
 import numpy as np
 import boto3 # https://pypi.org/project/boto3/  Boto3 is the Amazon Web Services (AWS) Software Development Kit (SDK) for Python
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import json
 
+from checkpoint import CheckpointConflict, Checkpointer
+from compute import cpu_allotment, make_reducer
+from metrics import WorkerMetrics
+from formats import PACK_HEADER, PACK_SUFFIX, coalesce_ranges, decompress, parse_pack_header, parse_pack_index
+from prefetch import prefetch_ordered
+from sink import SUCCESS_MARKER, MultipartTextSink, write_success_marker
+from workqueue import LeaseLost, S3LeaseQueue
+
 # headless plotting
 os.environ.setdefault("MPLBACKEND","Agg")
 
 bucket_name  = os.getenv("BUCKET")
-input_base   = os.getenv("INPUT_BASE")  
+input_base   = os.getenv("INPUT_BASE")
 output_base  = os.getenv("OUTPUT_BASE")
 shard        = int(os.getenv("JOB_COMPLETION_INDEX"))
-process_cap = int(os.getenv("PROCESS_CAP", "-1"))
+process_cap = int(os.getenv("PROCESS_CAP", "-1"))   # files per shard (per task in queue mode); -1 = all
+fetch_workers  = int(os.getenv("FETCH_WORKERS", "16"))   # concurrent S3 GETs
+prefetch_depth = int(os.getenv("PREFETCH_DEPTH", "64"))  # max objects fetched ahead of compute
+batch_size     = int(os.getenv("BATCH_SIZE", "64"))      # files parsed into one buffer and reduced together
+range_bytes    = int(os.getenv("RANGE_BYTES", str(8 * 1024 * 1024)))  # max size of one coalesced archive GET
+worker_processes = int(os.getenv("WORKER_PROCESSES", "0"))  # parse/reduce processes; 0 = one per CPU in the cgroup quota
+checkpoint_every   = int(os.getenv("CHECKPOINT_EVERY", "500"))       # files between progress checkpoints (0 = off)
+checkpoint_seconds = float(os.getenv("CHECKPOINT_SECONDS", "60"))    # ... or seconds between them (0 = off)
+output_part_bytes  = int(os.getenv("OUTPUT_PART_BYTES", str(8 * 1024 * 1024)))  # multipart part size for outputs
+work_mode     = os.getenv("WORK_MODE", "static")       # "static": own input/<shard>/; "queue": claim tasks until drained
+queue_prefix  = os.getenv("QUEUE_PREFIX", "queue/")    # where the launcher wrote tasks.json (queue mode)
+lease_seconds = float(os.getenv("LEASE_SECONDS", "300"))  # a task is re-claimable this long after its worker goes quiet
+progress_seconds = float(os.getenv("PROGRESS_SECONDS", "10"))  # seconds between JSON progress lines (0 = off)
+output_encoding  = os.getenv("OUTPUT_ENCODING", "identity")  # identity | gzip | zstd for output.txt / keys.txt
+run_id           = os.getenv("RUN_ID", "")     # launcher's run id, recorded in the _SUCCESS marker
 
 input_prefix  = f"{input_base}{shard+1}/"   # e.g. "input/1/"
 output_prefix = f"{output_base}{shard+1}/"   # e.g. "output/1/"
 
 # --- S3 helpers ---
-_region = os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION") 
-s3 = boto3.client("s3", region_name=_region)
+_region = os.getenv("AWS_REGION") or os.getenv("AWS_DEFAULT_REGION")
+# S3_ENDPOINT_URL lets you point the worker at a local S3 stand-in (MinIO, moto, ...)
+s3 = boto3.client("s3", region_name=_region,
+                  endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+                  config=Config(max_pool_connections=max(10, fetch_workers)))
 
-def s3_list_keys(prefix, suffix=None):
-    """List object keys under prefix (optionally filter by suffix)."""
-    keys = []
+def s3_iter_keys(prefix, suffix=None):
+    """Yield object keys under prefix page by page, as the listing comes in."""
     paginator = s3.get_paginator("list_objects_v2")
     for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
         for obj in page.get("Contents", []):
             k = obj["Key"]
             if not suffix or k.endswith(suffix):
-                keys.append(k)
-    return keys
+                yield k
+
+def s3_list_keys(prefix, suffix=None):
+    """List object keys under prefix (optionally filter by suffix)."""
+    return list(s3_iter_keys(prefix, suffix))
 
 def s3_download_bytes(key) -> bytes:
-    return s3.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    """Download an object, undoing any gzip/zstd Content-Encoding it was stored with."""
+    resp = s3.get_object(Bucket=bucket_name, Key=key)
+    return decompress(resp["Body"].read(), resp.get("ContentEncoding"))
+
+def s3_download_range(key, start, end) -> bytes:
+    """Download bytes start..end (inclusive) of an object."""
+    return s3.get_object(Bucket=bucket_name, Key=key, Range=f"bytes={start}-{end}")["Body"].read()
 
 def s3_put_text(key, text: str, content_type="text/plain"):
     s3.put_object(Bucket=bucket_name, Key=key, Body=text.encode("utf-8"),
@@ -40,28 +80,256 @@ def s3_put_text(key, text: str, content_type="text/plain"):
 def s3_put_json(key, data):
     s3.put_object(Bucket=bucket_name, Key=key, Body=json.dumps(data).encode("utf-8"),
                   ContentType="application/json")
-    
-# Discover inputs for this shard
-json_keys = s3_list_keys(input_prefix, suffix="")
-
-def run_one_case(s3_key: str):
-    # tmp_path = download_json_to_tmp(bucket_name, s3_key)
-    data = s3_download_bytes(s3_key)
-    data = json.loads(data.decode("utf-8"))
-    numbers = data["numbers"]
-    return np.sum(np.array(numbers))
-
-sums = []
-for i, k in enumerate(json_keys):
-    if process_cap>0 and i>process_cap:
-        break
-    if i % 10 == 0:
-        print(f"Completed {i} of {len(json_keys)}")
-    sums.append(run_one_case(k))
-            
-s3_put_text(
-    f"{output_prefix}output.txt",
-    "\n".join(str(x) for x in sums) + "\n"
-)
-
-print("All done")
\ No newline at end of file
+
+# --- fetch units ---
+# A unit is one GET: (key, None) for a plain object, or (key, (start, end, members))
+# for a coalesced byte range of a packed archive, members being (name, offset, length).
+ARCHIVE_HEAD_READ = 64 * 1024   # first read of an archive; normally covers the whole index
+
+def read_archive_index(key):
+    """Return (data_start, members) of a packed archive, reading only its head."""
+    head = s3_download_range(key, 0, ARCHIVE_HEAD_READ - 1)
+    need = PACK_HEADER.size + parse_pack_header(head)
+    if len(head) < need:
+        head += s3_download_range(key, len(head), need - 1)
+    return parse_pack_index(head)
+
+def plan_units(keys, limit=None, skip=0):
+    """
+    Lazily expand archives into coalesced range reads; stop once `limit` files are
+    planned. The first `skip` files (already done by an earlier attempt) still count
+    towards `limit` but are not fetched.
+    """
+    planned = 0
+    for k in keys:
+        if limit is not None and planned >= limit:
+            return
+        if not k.endswith(PACK_SUFFIX):
+            if planned >= skip:
+                yield (k, None)
+            planned += 1
+            continue
+        # members keep their original names, e.g. "input/1/12.json"
+        base = k[:k.rfind("/") + 1]
+        data_start, members = read_archive_index(k)
+        if limit is not None:
+            members = members[:limit - planned]
+        first = planned
+        planned += len(members)
+        members = members[max(0, skip - first):]
+        for group in coalesce_ranges(members, range_bytes):
+            start = data_start + group[0][1]
+            end = data_start + group[-1][1] + group[-1][2] - 1
+            yield (k, (start, end, [(base + n, data_start + o, ln) for n, o, ln in group]))
+
+def leading_names(keys, n):
+    """Names of the first n files planned from `keys` (archive members one by one, as in plan_units)."""
+    names = []
+    for k in keys:
+        if len(names) >= n:
+            break
+        if k.endswith(PACK_SUFFIX):
+            base = k[:k.rfind("/") + 1]
+            names.extend(base + name for name, _, _ in read_archive_index(k)[1])
+        else:
+            names.append(k)
+    return names[:n]
+
+def fetch_unit(unit):
+    """Download one unit and return its files as [(name, payload), ...]."""
+    key, span = unit
+    if span is None:
+        return [(key, s3_download_bytes(key))]
+    start, end, members = span
+    blob = memoryview(s3_download_range(key, start, end))
+    # archive members are compressed one by one (if at all), so ranges stay valid
+    return [(name, decompress(blob[off - start:off - start + ln])) for name, off, ln in members]
+
+# --- input discovery ---
+MANIFEST_NAME = "_manifest.json"   # written by step04 next to the shard's inputs
+
+def load_manifest(prefix):
+    """Return the shard manifest ({"objects": [{"key", "size", "etag"}, ...]}) or None."""
+    try:
+        return json.loads(s3_download_bytes(prefix + MANIFEST_NAME))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+
+def input_fingerprint(*parts):
+    """Short hash identifying a set of inputs; stored with each checkpoint."""
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()[:16]
+
+def discover_inputs():
+    """
+    Return (keys, count, fingerprint). With a manifest this is a single GET and
+    the fingerprint covers every key's ETag; without one the keys stream in page
+    by page so processing starts before the listing ends (count and fingerprint
+    are then None).
+    """
+    manifest = load_manifest(input_prefix)
+    if manifest is not None:
+        keys = [o["key"] for o in manifest["objects"]]
+        print(f"Manifest lists {len(keys)} objects")
+        return keys, len(keys), input_fingerprint([(o["key"], o.get("etag")) for o in manifest["objects"]])
+    print("No manifest found; listing and processing page by page")
+    return (k for k in s3_iter_keys(input_prefix) if not k.endswith("/" + MANIFEST_NAME)), None, None
+
+def process_keys(input_keys, n_keys, output_prefix, reducer, limit=None, fingerprint=None, lease=None, task=None):
+    """
+    Run the fetch/parse/reduce pipeline over `input_keys` and write the results
+    under `output_prefix`. Returns the number of files processed. `fingerprint`
+    identifies the inputs, so checkpoints of other inputs are not resumed. In
+    queue mode `lease` (the S3LeaseQueue) keeps `task` claimed while it runs.
+    """
+    # A stale completion marker from an earlier run must not outlive this attempt
+    s3.delete_object(Bucket=bucket_name, Key=output_prefix + SUCCESS_MARKER)
+
+    # Results stream to S3 as they are produced (bounded memory). keys.txt is
+    # line-aligned with output.txt: line i names the input file behind result i.
+    out_sink = MultipartTextSink(s3, bucket_name, f"{output_prefix}output.txt", part_size=output_part_bytes,
+                                 encoding=output_encoding)
+    keys_sink = MultipartTextSink(s3, bucket_name, f"{output_prefix}keys.txt", part_size=output_part_bytes,
+                                  encoding=output_encoding)
+    done = 0
+
+    def emit(keys, results):
+        nonlocal done
+        out_sink.write("".join(f"{x}\n" for x in results))
+        keys_sink.write("".join(f"{k}\n" for k in keys))
+        done += len(keys)
+
+    # Resume from the checkpoints of an earlier attempt at these keys, if any
+    ckpt = Checkpointer(s3, bucket_name, output_prefix, every=checkpoint_every, seconds=checkpoint_seconds,
+                        fingerprint=fingerprint)
+    restored = ckpt.restore()
+    resumed = [k for keys, _ in restored for k in keys]
+    if resumed:
+        # the checkpoints must cover exactly the leading files of the current inputs
+        if isinstance(input_keys, list):
+            head = input_keys[:len(resumed)]
+        else:
+            head = list(islice(input_keys, len(resumed)))
+            input_keys = chain(head, input_keys)
+        if leading_names(head, len(resumed)) != resumed:
+            ckpt.discard("they cover different input files")
+            restored = []
+    for keys, results in restored:
+        emit(keys, results)
+    if done:
+        print(f"Resuming after {done} files completed by an earlier attempt")
+
+    units = plan_units(input_keys, limit=limit, skip=done)
+    total = None
+    if n_keys is not None and not any(k.endswith(PACK_SUFFIX) for k in input_keys):
+        total = n_keys if limit is None else min(n_keys, limit)
+
+    metrics = WorkerMetrics(total=total, progress_seconds=progress_seconds, resumed=done)
+    reducer.metrics = metrics
+
+    def fetch(unit):
+        t0 = time.perf_counter()
+        files = fetch_unit(unit)
+        metrics.observe_download(time.perf_counter() - t0, sum(len(p) for _, p in files))
+        return files
+
+    # Downloads run ahead on the fetcher pool; compute consumes them in listing order
+    # and reduces them BATCH_SIZE files at a time (spread over the CPUs we are given)
+    awaiting = deque()      # names of files fetched but not reduced yet, in order
+    batch = []
+
+    def collect(results):
+        for r in results:
+            keys = [awaiting.popleft() for _ in range(len(r))]
+            emit(keys, r)
+            ckpt.add(keys, r)
+
+    try:
+        fetched = iter(prefetch_ordered(units, fetch, workers=fetch_workers, depth=prefetch_depth))
+        while True:
+            t0 = time.perf_counter()
+            item = next(fetched, None)
+            waited = time.perf_counter() - t0   # compute idle, waiting on the network
+            if item is None:
+                break
+            unit, files = item
+            for name, payload in files:
+                metrics.file_done(len(payload), waited)
+                waited = 0.0
+                awaiting.append(name)
+                batch.append(payload)
+                if len(batch) == reducer.rows:
+                    collect(reducer.submit(batch))
+                    batch = []
+            if lease is not None and not lease.heartbeat(task):
+                raise LeaseLost(f"task {task.id} was taken over by another worker")
+        collect(reducer.submit(batch))
+        collect(reducer.drain())
+        if done == 0:
+            out_sink.write("\n")   # same as the old "\n".join(...) + "\n" on an empty shard
+            keys_sink.write("\n")
+        if lease is not None:
+            lease.fence(task)   # publish only while the lease is still ours
+        outputs = [out_sink.close(), keys_sink.close()]
+    except BaseException:
+        out_sink.abort()
+        keys_sink.abort()
+        raise
+
+    report = metrics.to_dict()
+    s3_put_json(f"{output_prefix}metrics.json", report)
+    metrics.print_progress()
+    print(f"Bound by: {report['bound_by']}")
+    write_success_marker(s3, bucket_name, output_prefix, outputs, files=done, run_id=run_id)
+    ckpt.clear()
+    return done
+
+def file_limit():
+    """PROCESS_CAP as a limit on the files of one shard, or of one task in queue mode."""
+    return process_cap + 1 if process_cap > 0 else None
+
+def run_queue(reducer):
+    """Claim tasks from the shared queue until it is drained."""
+    worker_id = f"{socket.gethostname()}-{shard}"
+    queue = S3LeaseQueue(s3, bucket_name, queue_prefix, worker_id, lease_seconds=lease_seconds)
+    completed = 0
+    if file_limit() is not None:
+        print(f"ℹ PROCESS_CAP={process_cap}: each task stops after {file_limit()} files")
+    while True:
+        task = queue.claim()
+        if task is None:
+            break
+        print(f"Claimed task {task.id} ({len(task.keys)} keys)")
+        try:
+            files = process_keys(task.keys, len(task.keys), f"{output_base}tasks/{task.id}/", reducer,
+                                 limit=file_limit(),
+                                 fingerprint=input_fingerprint(queue_prefix, task.id, task.keys),
+                                 lease=queue, task=task)
+        except (LeaseLost, CheckpointConflict) as e:
+            print(f"⚠ Giving up task {task.id}: {e}")
+            for _ in reducer.drain():   # results of the abandoned task still in flight
+                pass
+            continue
+        queue.complete(task, files)
+        completed += 1
+    print(f"Queue drained; this worker completed {completed} task(s)")
+
+def main():
+    processes = worker_processes or cpu_allotment()
+    print(f"Using {processes} compute process(es)")
+    reducer = make_reducer(batch_size, processes)
+    try:
+        if work_mode == "queue":
+            run_queue(reducer)
+        else:
+            # Discover inputs for this shard
+            input_keys, n_keys, fingerprint = discover_inputs()
+            process_keys(input_keys, n_keys, output_prefix, reducer, limit=file_limit(), fingerprint=fingerprint)
+    finally:
+        reducer.close()
+
+    print("All done")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Low-overhead worker telemetry.
+
+Timings and sizes go into log2-bucketed histograms (one dict increment per
+observation), so recording every key costs next to nothing. At the end the
+worker stores them as metrics.json next to output.txt; while it runs it prints
+one JSON progress line every few seconds.
+"""
+import json
+import math
+import threading
+import time
+
+
+class Histogram:
+    """Counts values in power-of-two buckets: bucket e holds values in [2**(e-1), 2**e)."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = {}
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        e = math.frexp(value)[1] if value > 0 else -1074
+        self.buckets[e] = self.buckets.get(e, 0) + 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (at most 2x off)."""
+        if not self.count:
+            return None
+        seen, rank = 0, q * self.count
+        for e in sorted(self.buckets):
+            seen += self.buckets[e]
+            if seen >= rank:
+                return min(2.0 ** e, self.max)
+        return self.max
+
+    def to_dict(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+                "mean": self.sum / self.count,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99),
+                "buckets": [{"le": 2.0 ** e, "count": c} for e, c in sorted(self.buckets.items())]}
+
+
+class WorkerMetrics:
+    """
+    Histograms of one run of the pipeline:
+
+      download_seconds / download_bytes   per GET (one file, or one coalesced archive range)
+      file_bytes                          per key
+      parse_seconds                       per key (decode into the batch buffer)
+      reduce_seconds                      per batch (one vectorized row-sum)
+      fetch_wait_seconds                  per key: time compute sat waiting for a download
+    """
+    NAMES = ("download_seconds", "download_bytes", "file_bytes", "parse_seconds",
+             "reduce_seconds", "fetch_wait_seconds")
+
+    def __init__(self, total=None, progress_seconds=10.0, resumed=0):
+        self.hist = {name: Histogram() for name in self.NAMES}
+        self.total = total
+        self.progress_seconds = progress_seconds
+        self.resumed = resumed      # files restored from checkpoints, not processed by this attempt
+        self.files = resumed
+        self.started = time.monotonic()
+        self._last_progress = self.started
+        self._lock = threading.Lock()   # fetcher threads record downloads concurrently
+
+    def observe(self, name, value):
+        self.hist[name].observe(value)
+
+    def observe_download(self, seconds, nbytes):
+        with self._lock:
+            self.hist["download_seconds"].observe(seconds)
+            self.hist["download_bytes"].observe(nbytes)
+
+    def file_done(self, nbytes, waited):
+        self.files += 1
+        self.hist["file_bytes"].observe(nbytes)
+        self.hist["fetch_wait_seconds"].observe(waited)
+        if self.progress_seconds > 0 and time.monotonic() - self._last_progress >= self.progress_seconds:
+            self.print_progress()
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started
+        nbytes = self.hist["file_bytes"].sum
+        return {"files": self.files, "total": self.total, "resumed": self.resumed,
+                "elapsed_s": round(elapsed, 3),
+                "files_per_s": round((self.files - self.resumed) / elapsed, 2) if elapsed else None,
+                "mib_per_s": round(nbytes / elapsed / 2**20, 3) if elapsed else None}
+
+    def print_progress(self):
+        self._last_progress = time.monotonic()
+        print(json.dumps({"progress": self.snapshot()}), flush=True)
+
+    def bound_by(self):
+        """Rough verdict: where did the wall time go?"""
+        spent = {"network": self.hist["fetch_wait_seconds"].sum,
+                 "parse": self.hist["parse_seconds"].sum,
+                 "compute": self.hist["reduce_seconds"].sum}
+        return max(spent, key=spent.get) if any(spent.values()) else None
+
+    def to_dict(self):
+        with self._lock:
+            return {"version": 1, **self.snapshot(), "bound_by": self.bound_by(),
+                    "histograms": {name: h.to_dict() for name, h in self.hist.items()}}
@@ -0,0 +1,37 @@
+"""Bounded prefetch pipeline for the worker.
+
+A small pool of fetcher threads pulls objects ahead of the compute loop and
+hands them back in input order, so the output stays aligned with the key list.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetch_ordered(items, fetch, workers=16, depth=64):
+    """
+    Yield (item, fetch(item)) in the same order as `items`.
+
+    At most `depth` fetches are queued or running at any time, so memory stays
+    bounded no matter how far the fetchers get ahead of the consumer.
+    `items` may be any iterable (it is consumed lazily).
+    """
+    workers = max(1, int(workers))
+    depth = max(workers, int(depth))
+    it = iter(items)
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+    try:
+        for item in it:
+            pending.append((item, pool.submit(fetch, item)))
+            if len(pending) >= depth:
+                break
+        while pending:
+            item, fut = pending.popleft()
+            # top the window back up before blocking on the head of the queue
+            for nxt in it:
+                pending.append((nxt, pool.submit(fetch, nxt)))
+                break
+            yield item, fut.result()
+    finally:
+        # consumer stopped early (PROCESS_CAP, error): drop whatever is still queued
+        pool.shutdown(wait=True, cancel_futures=True)
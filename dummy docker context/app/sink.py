@@ -0,0 +1,117 @@
+"""Streaming output to S3.
+
+Results are written as they are produced: text is buffered up to one part and
+shipped as a multipart-upload part on a background thread while processing
+continues, so memory stays bounded by a couple of parts whatever the shard size.
+With an encoding the text is compressed as a stream on the way and the object
+is stored with the matching Content-Encoding.
+"""
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from formats import compressor
+
+MIN_PART_BYTES = 5 * 1024 * 1024   # S3 minimum for every part but the last
+SUCCESS_MARKER = "_SUCCESS"
+
+
+class MultipartTextSink:
+    """Append-only text object on S3; small outputs fall back to a single PUT on close()."""
+
+    def __init__(self, s3, bucket, key, part_size=8 * 1024 * 1024, content_type="text/plain",
+                 max_pending=2, encoding="identity"):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(MIN_PART_BYTES, int(part_size))
+        self.content_type = content_type
+        self.max_pending = max(1, max_pending)   # parts buffered or uploading at once
+        self.bytes_written = 0      # text bytes written (before compression)
+        self.bytes_stored = 0       # bytes of the S3 object
+        self.encoding = encoding or "identity"
+        self._compressor = compressor(self.encoding)
+        # S3 only takes the header when it is a real encoding
+        self._put_args = {"ContentType": content_type}
+        if self._compressor is not None:
+            self._put_args["ContentEncoding"] = self.encoding
+        self._buf = []
+        self._buffered = 0
+        self._upload_id = None
+        self._parts = []            # (part number, future)
+        self._pool = None
+
+    def write(self, text: str):
+        data = text.encode("utf-8")
+        self.bytes_written += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._append(data)
+
+    def _append(self, data):
+        self._buf.append(data)
+        self._buffered += len(data)
+        self.bytes_stored += len(data)
+        if self._buffered >= self.part_size:
+            self._ship_part()
+
+    def _ship_part(self):
+        body = b"".join(self._buf)
+        self._buf, self._buffered = [], 0
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self._put_args)["UploadId"]
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sink")
+        # back-pressure: never hold more than max_pending parts in memory
+        pending = [f for _, f in self._parts if not f.done()]
+        while len(pending) >= self.max_pending:
+            wait(pending, return_when=FIRST_COMPLETED)
+            pending = [f for f in pending if not f.done()]
+        number = len(self._parts) + 1
+        fut = self._pool.submit(self.s3.upload_part, Bucket=self.bucket, Key=self.key,
+                                UploadId=self._upload_id, PartNumber=number, Body=body)
+        self._parts.append((number, fut))
+
+    def close(self) -> dict:
+        """Finish the object and return {"key", "etag", "bytes", "encoding"}."""
+        if self._compressor is not None:
+            self._buf.append(self._compressor.flush())
+            self.bytes_stored += len(self._buf[-1])
+            self._buffered += len(self._buf[-1])
+            self._compressor = None
+        if self._upload_id is None:
+            resp = self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=b"".join(self._buf),
+                                      **self._put_args)
+        else:
+            if self._buffered:
+                self._ship_part()   # the last part may be smaller than MIN_PART_BYTES
+            parts = [{"PartNumber": n, "ETag": f.result()["ETag"]} for n, f in self._parts]
+            resp = self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                     UploadId=self._upload_id,
+                                                     MultipartUpload={"Parts": parts})
+            self._pool.shutdown()
+        self._buf = []
+        return {"key": self.key, "etag": resp.get("ETag"), "bytes": self.bytes_stored,
+                "encoding": self.encoding}
+
+    def abort(self):
+        """Drop an unfinished upload so no orphaned parts are left behind."""
+        if self._upload_id is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+        self._buf = []
+
+
+def write_success_marker(s3, bucket, output_prefix, objects, files, run_id=""):
+    """
+    Mark a shard's output final. Written last, after every output object is
+    complete, so its presence alone tells downstream steps the shard is done;
+    `run_id` (set by the launcher) tells them which run it belongs to.
+    """
+    body = {"version": 1, "files": files, "run_id": run_id, "finished_at": time.time(),
+            "objects": {o["key"][len(output_prefix):]: {"etag": o["etag"], "bytes": o["bytes"],
+                                                         "encoding": o.get("encoding", "identity")}
+                        for o in objects}}
+    s3.put_object(Bucket=bucket, Key=output_prefix + SUCCESS_MARKER,
+                  Body=json.dumps(body).encode("utf-8"), ContentType="application/json")
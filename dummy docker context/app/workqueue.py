@@ -0,0 +1,175 @@
+"""Dynamic work distribution (WORK_MODE=queue).
+
+Instead of owning one shard folder, every worker claims small batches of keys
+("tasks") from a shared list until none are left, so a slow or oversized shard
+no longer holds the whole job back on one straggler.
+
+The launcher writes the list once:
+
+    <queue_prefix>tasks.json        {"version": 1, "tasks": [{"id": "000001", "keys": [...]}, ...]}
+
+and workers coordinate through small objects next to it:
+
+    <queue_prefix>leases/<id>       who holds the task, until when, and its generation (conditional writes)
+    <queue_prefix>done/<id>         written once the task's output is complete
+
+A lease is taken with `If-None-Match: *` (only one worker can create it) and
+renewed or stolen after expiry with `If-Match: <etag>`, so two workers never
+both believe they own a live task. A worker that dies simply stops renewing;
+its task is picked up again once the lease runs out, with the lease generation
+bumped.
+
+Each worker walks the task list once from its own starting point, remembering
+which tasks it found done or leased, so a claim costs a couple of requests
+rather than one per task; done/ is only listed when everything left is leased.
+
+A worker whose lease ran out may still be writing when the task is stolen.
+Writes are fenced: the worker re-takes its lease (If-Match on the lease it
+holds) before publishing the task's output, and gives the task up with
+LeaseLost if that fails.
+"""
+import json
+import random
+import time
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+TASKS_NAME = "tasks.json"
+_LOST_RACE = ("PreconditionFailed", "412", "ConditionalRequestConflict", "409")
+
+
+class LeaseLost(Exception):
+    """Another worker took over the task; its output must not be published by us."""
+
+
+class Task:
+    def __init__(self, task_id, keys):
+        self.id = task_id
+        self.keys = keys
+        self.etag = None        # ETag of our lease object
+        self.expires = 0.0
+        self.generation = 0     # bumped every time the lease changes hands
+
+
+class S3LeaseQueue:
+    """Claims tasks from `<prefix>tasks.json` using lease objects in the bucket."""
+
+    def __init__(self, s3, bucket, prefix, worker, lease_seconds=300, poll_seconds=10):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._pending = None    # tasks not tried yet, in this worker's order
+        self._held = []         # (lease expiry, task) of tasks other workers are on
+        self._done = set()      # ids known to be complete
+
+    def _load(self):
+        if self._pending is None:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + TASKS_NAME)["Body"].read()
+            tasks = [Task(t["id"], t["keys"]) for t in json.loads(body)["tasks"]]
+            # start at a worker-specific point so workers don't all race for the same task
+            start = random.Random(self.worker).randrange(len(tasks)) if tasks else 0
+            self._pending = deque(tasks[start:] + tasks[:start])
+            self._done = self._done_ids()
+
+    def _done_ids(self):
+        ids = set()
+        for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix + "done/"):
+            ids.update(obj["Key"].rsplit("/", 1)[1] for obj in page.get("Contents", []))
+        return ids
+
+    def _is_done(self, task):
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=f"{self.prefix}done/{task.id}")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound"):
+                return False
+            raise
+        return True
+
+    def _put_lease(self, task, generation, **condition):
+        expires = time.time() + self.lease_seconds
+        body = json.dumps({"worker": self.worker, "expires": expires, "generation": generation}).encode("utf-8")
+        try:
+            resp = self.s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}leases/{task.id}", Body=body,
+                                      ContentType="application/json", **condition)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in _LOST_RACE:
+                return False
+            raise
+        task.etag, task.expires, task.generation = resp["ETag"], expires, generation
+        return True
+
+    def _try_lease(self, task):
+        """Take the task's lease; return None on success, else when the current lease expires."""
+        if self._put_lease(task, 1, IfNoneMatch="*"):
+            return None
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}leases/{task.id}")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return time.time()  # released in the meantime: retry right away
+            raise
+        held = json.loads(resp["Body"].read())
+        if held["expires"] > time.time():
+            return held["expires"]
+        # the holder stopped renewing; steal unless someone else got there first
+        stolen = self._put_lease(task, held.get("generation", 1) + 1, IfMatch=resp["ETag"])
+        return None if stolen else time.time()
+
+    def claim(self):
+        """Return the next Task to work on, or None once every task is done."""
+        self._load()
+        while True:
+            while self._pending:
+                task = self._pending.popleft()
+                if task.id in self._done:
+                    continue
+                expires = self._try_lease(task)
+                if expires is not None:
+                    self._held.append((expires, task))
+                elif self._is_done(task):
+                    # completed by another worker since we listed done/ (done is written before
+                    # the lease is deleted, so a free lease on a finished task shows up here)
+                    self._done.add(task.id)
+                    self.s3.delete_object(Bucket=self.bucket, Key=f"{self.prefix}leases/{task.id}")
+                else:
+                    return task
+            # everything left is leased by other workers: wait in case one of them dies
+            self._done |= self._done_ids()
+            held = [(expires, task) for expires, task in self._held if task.id not in self._done]
+            self._held = []
+            if not held:
+                return None
+            next_expiry = min(expires for expires, _ in held)
+            time.sleep(min(self.poll_seconds, max(0.0, next_expiry - time.time())))
+            self._pending.extend(task for _, task in sorted(held, key=lambda h: h[0]))
+
+    def heartbeat(self, task, force=False):
+        """
+        Renew the lease once half of it has run out (always if `force`). Returns
+        False if it was lost, i.e. another worker has taken the task over.
+        """
+        if not force and time.time() < task.expires - self.lease_seconds / 2:
+            return True
+        return self._put_lease(task, task.generation, IfMatch=task.etag)
+
+    def fence(self, task):
+        """Renew the lease before publishing the task's output; raise LeaseLost if it is gone."""
+        if not self.heartbeat(task, force=True):
+            raise LeaseLost(f"task {task.id} was taken over by another worker")
+
+    def complete(self, task, files):
+        self._done.add(task.id)
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}done/{task.id}",
+                               Body=json.dumps({"worker": self.worker, "files": files,
+                                                "generation": task.generation}).encode("utf-8"),
+                               ContentType="application/json", IfNoneMatch="*")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in _LOST_RACE:
+                raise
+        self.s3.delete_object(Bucket=self.bucket, Key=f"{self.prefix}leases/{task.id}")
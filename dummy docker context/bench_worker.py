@@ -0,0 +1,63 @@
+"""
+Benchmark the worker (app/main.py) against the in-process S3 stand-in.
+
+    python "dummy docker context/bench_worker.py" --data "dummy files" --latency 0.02 --workers 1 4 16
+
+Each run copies one shard folder into a scratch "bucket", runs the real worker
+code against it and reports wall time and files/sec.
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+directory = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(directory, "app"))
+from local_s3 import LocalS3
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="dummy files", help="folder holding shard folders 1..N")
+    parser.add_argument("--shard", type=int, default=1, help="1-based shard folder to process")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated seconds per S3 request")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16], help="FETCH_WORKERS values to try")
+    parser.add_argument("--depth", type=int, default=64, help="PREFETCH_DEPTH")
+    parser.add_argument("--processes", type=int, default=1, help="WORKER_PROCESSES (0 = cgroup CPU quota)")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench-s3-")
+    shutil.copytree(os.path.join(args.data, str(args.shard)), os.path.join(scratch, "input", str(args.shard)))
+
+    # main.py reads its configuration from the environment at import time
+    os.environ.update({
+        "BUCKET": "bench",
+        "INPUT_BASE": "input/",
+        "OUTPUT_BASE": "output/",
+        "JOB_COMPLETION_INDEX": str(args.shard - 1),
+        "AWS_DEFAULT_REGION": os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
+    })
+    import main as worker
+
+    worker.s3 = LocalS3(scratch, latency=args.latency)
+    worker.worker_processes = args.processes
+    n_files = len(os.listdir(os.path.join(scratch, "input", str(args.shard))))
+
+    try:
+        for w in args.workers:
+            worker.fetch_workers, worker.prefetch_depth = w, max(w, args.depth)
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                worker.main()
+            dt = time.perf_counter() - t0
+            print(f"workers={w:<3} depth={worker.prefetch_depth:<4} {dt:7.3f}s  {n_files / dt:9.1f} files/s")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+# guarded: compute processes are spawned and re-import the launching script
+if __name__ == "__main__":
+    main()
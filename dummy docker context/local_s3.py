@@ -0,0 +1,153 @@
+"""
+Minimal in-process stand-in for the boto3 S3 client, for benchmarking the worker
+locally without a bucket. Objects are plain files under `root` (key == relative
+path) and every request sleeps `latency` seconds to mimic a network round-trip.
+
+Only the calls the worker makes are implemented, including the conditional
+writes (IfNoneMatch / IfMatch) behind the queue's leases.
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+class LocalS3:
+    def __init__(self, root, latency=0.02):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._uploads = {}      # upload id -> {part number: bytes}
+
+    def _tick(self, op):
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def _etag(self, path):
+        with open(path, "rb") as f:
+            return '"%s"' % hashlib.md5(f.read()).hexdigest()
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._tick("GetObject")
+        if not os.path.isfile(self._path(Key)):
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject")
+        with open(self._path(Key), "rb") as f:
+            data = f.read()
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        rng = kwargs.get("Range")
+        if rng:
+            # "bytes=start-end", end inclusive and clamped to the object size like S3
+            start, end = rng.split("=", 1)[1].split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data), "ETag": etag}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._tick("HeadObject")
+        path = self._path(Key)
+        if not os.path.isfile(path):
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {"ContentLength": os.path.getsize(path), "ETag": self._etag(path)}
+
+    def put_object(self, Bucket, Key, Body=b"", IfNoneMatch=None, IfMatch=None, **kwargs):
+        self._tick("PutObject")
+        path = self._path(Key)
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        with self._lock:
+            # conditional writes, as used by the queue's lease objects
+            exists = os.path.isfile(path)
+            if (IfNoneMatch == "*" and exists) or \
+               (IfMatch is not None and (not exists or self._etag(path) != IfMatch)):
+                raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": Key}}, "PutObject")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        return {"ETag": '"%s"' % hashlib.md5(data).hexdigest()}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._tick("DeleteObject")
+        if os.path.isfile(self._path(Key)):
+            os.remove(self._path(Key))
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._tick("CreateMultipartUpload")
+        with self._lock:
+            upload_id = str(len(self._uploads) + 1)
+            self._uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._tick("UploadPart")
+        with self._lock:
+            self._uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"part-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._tick("CompleteMultipartUpload")
+        with self._lock:
+            parts = self._uploads.pop(UploadId)
+        body = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+        self.put_object(Bucket=Bucket, Key=Key, Body=body)
+        return {"ETag": f'"mpu-{len(MultipartUpload["Parts"])}"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._tick("AbortMultipartUpload")
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._tick("DeleteObjects")
+        for obj in Delete.get("Objects", []):
+            path = self._path(obj["Key"])
+            if os.path.isfile(path):
+                os.remove(path)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None, **kwargs):
+        self._tick("ListObjectsV2")
+        keys = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                rel = os.path.relpath(os.path.join(dirpath, name), self.root)
+                key = rel.replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    keys.append(key)
+        keys.sort()
+        # like S3, the token marks the last key returned, so deleting while listing is safe
+        if ContinuationToken:
+            keys = [k for k in keys if k > ContinuationToken]
+        page = keys[:MaxKeys]
+        resp = {"Contents": [{"Key": k, "Size": os.path.getsize(self._path(k)), "ETag": self._etag(self._path(k))} for k in page],
+                "KeyCount": len(page), "IsTruncated": MaxKeys < len(keys)}
+        if resp["IsTruncated"]:
+            resp["NextContinuationToken"] = page[-1]
+        return resp
+
+    def get_paginator(self, name):
+        if name != "list_objects_v2":
+            raise NotImplementedError(name)
+        return _ListPaginator(self)
+
+
+class _ListPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.client.list_objects_v2(ContinuationToken=token, **kwargs)
+            yield page
+            if not page.get("IsTruncated"):
+                return
+            token = page["NextContinuationToken"]
@@ -1,20 +1,124 @@
-import os
+"""
+Generate a synthetic corpus: folders 1..shards, each with `files` vectors of random floats.
+
+    python generate_random_data.py                                   # 10 x 100 files x 100 floats, JSON (as before)
+    python generate_random_data.py --shards 50 --files 20000 --skew 1.0 --format binary --seed 7
+
+Vector lengths follow a lognormal around --length when --skew > 0 (0 = all the
+same length). Each shard's mean length is itself drawn from the same lognormal,
+so whole shards differ in size like a real corpus rather than averaging out
+over their files. Formats:
+  json    {j}.json, {"numbers": [...]} pretty-printed like the original corpus
+  binary  {j}.bin in the worker's binary encoding (data_formats.py)
+  pack    one shard.pack per folder holding the binary members
+
+The worker reads all three as they are, so upload binary/pack corpora with
+input_format = "json" and pack_shards = false (no re-encoding in step04).
+Values are drawn with NumPy in chunks of CHUNK_FILES files, spread over a
+process pool; each chunk has its own seed, so the output depends only on
+--seed, not on --workers.
+"""
+import argparse
 import json
-import random
-
-# Create 10 folders named "1" through "10"
-for i in range(1, 11):
-    folder_name = str(i)
-    os.makedirs(folder_name, exist_ok=True)
-    
-    # Inside each folder, create 100 JSON files
-    for j in range(1, 101):
-        data = {
-            "numbers": [random.random() for _ in range(100)]  # 100 random floats in [0, 1)
-        }
-        file_path = os.path.join(folder_name, f"{j}.json")
-        
-        with open(file_path, "w") as f:
-            json.dump(data, f, indent=2)
-
-print("✅ Done! Created 10 folders, each with 100 JSON files.")
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_formats import PACK_SUFFIX, encode_numbers_binary, pack_members
+
+CHUNK_FILES = 1000
+
+
+def shard_scale(seed, shard, skew):
+    """Factor on the mean file length of one shard (mean-preserving lognormal, 1.0 without skew)."""
+    if skew <= 0:
+        return 1.0
+    return float(np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(shard,))).lognormal(-skew ** 2 / 2, skew))
+
+
+def chunk_vectors(seed, shard, chunk, n_files, length, skew):
+    """Random vectors for files chunk*CHUNK_FILES .. +n_files of one shard."""
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(shard, chunk)))
+    if skew > 0:
+        # mean-preserving lognormal: most files near the shard's mean, a long tail of big ones
+        mean = length * shard_scale(seed, shard, skew)
+        lengths = np.maximum(1, np.rint(mean * rng.lognormal(-skew ** 2 / 2, skew, n_files))).astype(np.int64)
+    else:
+        lengths = np.full(n_files, length, dtype=np.int64)
+    values = rng.random(int(lengths.sum()))
+    return np.split(values, np.cumsum(lengths)[:-1])
+
+
+def write_chunk(out, shard, chunk, n_files, length, skew, seed, fmt, indent):
+    folder = os.path.join(out, str(shard))
+    first = chunk * CHUNK_FILES + 1
+    nbytes = 0
+    for j, vec in enumerate(chunk_vectors(seed, shard, chunk, n_files, length, skew), start=first):
+        if fmt == "json":
+            path, data = os.path.join(folder, f"{j}.json"), json.dumps({"numbers": vec.tolist()}, indent=indent)
+            data = data.encode("utf-8")
+        else:
+            path, data = os.path.join(folder, f"{j}.bin"), encode_numbers_binary(vec)
+        with open(path, "wb") as f:
+            f.write(data)
+        nbytes += len(data)
+    return n_files, nbytes
+
+
+def write_packed_shard(out, shard, files, length, skew, seed):
+    members = []
+    for chunk in range((files + CHUNK_FILES - 1) // CHUNK_FILES):
+        n = min(CHUNK_FILES, files - chunk * CHUNK_FILES)
+        vecs = chunk_vectors(seed, shard, chunk, n, length, skew)
+        members.extend((f"{chunk * CHUNK_FILES + j}.bin", encode_numbers_binary(v)) for j, v in enumerate(vecs, start=1))
+    data = pack_members(members)
+    with open(os.path.join(out, str(shard), "shard" + PACK_SUFFIX), "wb") as f:
+        f.write(data)
+    return files, len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=os.path.dirname(os.path.abspath(__file__)), help="where folders 1..shards go")
+    parser.add_argument("--shards", type=int, default=10)
+    parser.add_argument("--files", type=int, default=100, help="files per shard")
+    parser.add_argument("--length", type=int, default=100, help="(mean) floats per file")
+    parser.add_argument("--skew", type=float, default=0.0, help="lognormal sigma of the file and shard lengths (0 = uniform)")
+    parser.add_argument("--format", choices=["json", "binary", "pack"], default="json")
+    parser.add_argument("--indent", type=int, default=2, help="JSON indent (-1 = compact)")
+    parser.add_argument("--seed", type=int, default=None, help="fixed seed for a reproducible corpus")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % 2**63)
+    indent = None if args.indent < 0 else args.indent
+    for i in range(1, args.shards + 1):
+        os.makedirs(os.path.join(args.out, str(i)), exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        if args.format == "pack":
+            futures = [pool.submit(write_packed_shard, args.out, i, args.files, args.length, args.skew, seed)
+                       for i in range(1, args.shards + 1)]
+        else:
+            futures = [pool.submit(write_chunk, args.out, i, c, min(CHUNK_FILES, args.files - c * CHUNK_FILES),
+                                   args.length, args.skew, seed, args.format, indent)
+                       for i in range(1, args.shards + 1)
+                       for c in range((args.files + CHUNK_FILES - 1) // CHUNK_FILES)]
+        n_files = n_bytes = 0
+        with tqdm(total=args.shards * args.files, unit="files") as bar:
+            for fut in as_completed(futures):
+                n, b = fut.result()
+                n_files, n_bytes = n_files + n, n_bytes + b
+                bar.update(n)
+
+    print(f"✅ Done! Created {args.shards} folders, {n_files} files, {n_bytes / 2**20:.1f} MiB "
+          f"({args.format}, seed {seed}).")
+
+
+# guarded: worker processes re-import this script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Run provisioning steps as a dependency graph.
+
+Each node is a function plus the names of the nodes it depends on; it is
+called with their results (in that order) as soon as all of them are done, so
+independent resources (bucket, IAM roles, log group, cluster, ...) are created
+in parallel on a thread pool. If a node fails, its dependents are skipped, the
+rest of the graph still runs, and run() raises at the end.
+
+run() prints a timing report: start/end per node relative to the start of the
+run, and the critical path, the chain of dependencies that ended last and
+therefore set the total time.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class DagError(RuntimeError):
+    pass
+
+
+class Dag:
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.nodes = {}         # name -> (fn, deps)
+        self.results = {}
+        self.timings = {}       # name -> (start, end) seconds since run() started
+        self.errors = {}        # name -> exception
+        self.skipped = []
+
+    def add(self, name, fn, deps=()):
+        if name in self.nodes:
+            raise ValueError(f"duplicate node {name!r}")
+        self.nodes[name] = (fn, tuple(deps))
+        return name
+
+    def _check(self):
+        for name, (_, deps) in self.nodes.items():
+            for d in deps:
+                if d not in self.nodes:
+                    raise ValueError(f"{name!r} depends on unknown node {d!r}")
+        seen, done = set(), set()
+
+        def visit(n, path):
+            if n in done:
+                return
+            if n in seen:
+                raise ValueError("dependency cycle: " + " -> ".join(path + [n]))
+            seen.add(n)
+            for d in self.nodes[n][1]:
+                visit(d, path + [n])
+            done.add(n)
+        for n in self.nodes:
+            visit(n, [])
+
+    def _call(self, name, t0):
+        fn, deps = self.nodes[name]
+        start = time.monotonic() - t0
+        try:
+            return fn(*(self.results[d] for d in deps))
+        finally:
+            self.timings[name] = (start, time.monotonic() - t0)
+
+    def run(self, report=True) -> dict:
+        self._check()
+        t0 = time.monotonic()
+        waiting = dict(self.nodes)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="dag") as pool:
+            while waiting or running:
+                for name, (_, deps) in list(waiting.items()):
+                    if any(d in self.errors or d in self.skipped for d in deps):
+                        self.skipped.append(name)
+                        del waiting[name]
+                    elif all(d in self.results for d in deps):
+                        running[pool.submit(self._call, name, t0)] = name
+                        del waiting[name]
+                if not running:
+                    if waiting:  # everything left depends on a skipped node
+                        continue
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    if fut.exception() is not None:
+                        self.errors[name] = fut.exception()
+                        print(f"✖ {name}: {fut.exception()}")
+                    else:
+                        self.results[name] = fut.result()
+        if report:
+            self.report()
+        if self.errors:
+            raise DagError(f"failed: {', '.join(self.errors)}"
+                           + (f"; skipped: {', '.join(self.skipped)}" if self.skipped else "")) \
+                from next(iter(self.errors.values()))
+        return self.results
+
+    def critical_path(self) -> list:
+        """Names from the first to the last node of the chain that finished last."""
+        if not self.timings:
+            return []
+        node = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [node]
+        while True:
+            deps = [d for d in self.nodes[node][1] if d in self.timings]
+            if not deps:
+                return path[::-1]
+            node = max(deps, key=lambda n: self.timings[n][1])
+            path.append(node)
+
+    def report(self):
+        if not self.timings:
+            return
+        width = max(len(n) for n in self.timings)
+        total = max(end for _, end in self.timings.values())
+        print(f"\nℹ Provisioning timeline ({total:.1f}s total)")
+        for name, (start, end) in sorted(self.timings.items(), key=lambda kv: kv[1][0]):
+            mark = "✖" if name in self.errors else "✔"
+            print(f"  {mark} {name:<{width}}  {start:7.1f}s → {end:7.1f}s  ({end - start:.1f}s)")
+        for name in self.skipped:
+            print(f"  – {name:<{width}}  skipped")
+        path = self.critical_path()
+        print("  critical path: " + " → ".join(f"{n} ({self.timings[n][1] - self.timings[n][0]:.1f}s)" for n in path))
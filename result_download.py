@@ -0,0 +1,150 @@
+"""
+Download results while the job is still running.
+
+Every shard (or queue task) writes `<prefix>_SUCCESS` last, listing its output
+objects. A background thread lists the pending shards' common prefix once per
+poll, picks out the `_SUCCESS` keys and GETs only markers it hasn't seen (by
+ETag), so a poll costs a listing page per ~1000 output objects rather than one
+request per shard. As soon as a marker shows up, that shard's files are fetched
+on a shared transfer pool. By the time the last shard finishes, the others are already local, so
+the serial `aws s3 sync` at the end goes away.
+
+Markers carry the run id the launcher passed to the workers (RUN_ID), so a
+marker left by an earlier run is told apart without comparing clocks.
+
+Files land under dest with the "output/" part of the key stripped (the same
+layout `aws s3 sync s3://bucket/output/ dest` produced) and are decompressed
+if they were written with an OUTPUT_ENCODING.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from data_formats import decompress
+
+SUCCESS_MARKER = "_SUCCESS"
+EXTRA_FILES = ("metrics.json",)   # written next to the outputs, not listed in the marker
+
+
+class ResultDownloader:
+    def __init__(self, s3, bucket, prefixes, dest, base="output/", workers=16, poll_seconds=5.0, run_id=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.dest = str(dest)
+        self.base = base
+        self.poll_seconds = poll_seconds
+        self.run_id = run_id    # ignore markers of other runs (left over from an earlier one)
+        self.pending = list(prefixes)       # shards whose marker hasn't appeared yet
+        self.total = len(self.pending)
+        self.done = []
+        self.files = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="download")
+        self._futures = []
+        self._stale = {}    # prefix -> ETag of a marker left by another run, not fetched again
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = time.monotonic()
+
+    def _listed_markers(self):
+        """{prefix: ETag} of the markers under the pending shards' common prefix, from one listing."""
+        found = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=os.path.commonprefix(self.pending)):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith("/" + SUCCESS_MARKER):
+                    found[obj["Key"][:-len(SUCCESS_MARKER)]] = obj["ETag"]
+        return found
+
+    def _marker(self, prefix):
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=prefix + SUCCESS_MARKER)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None     # deleted since the listing, e.g. the shard is being retried
+            raise
+        return json.loads(body)
+
+    def _local_path(self, key):
+        rel = key[len(self.base):] if key.startswith(self.base) else key
+        return os.path.join(self.dest, *rel.split("/"))
+
+    def _fetch(self, key, encoding=None, optional=False):
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if optional and e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return
+            raise
+        data = resp["Body"].read()
+        if (encoding or resp.get("ContentEncoding")) not in (None, "", "identity"):
+            data = decompress(data)
+        path = self._local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            self.files += 1
+            self.bytes += len(data)
+
+    def poll(self):
+        """List the markers once, GET the new ones (in parallel); queue downloads for the finished shards."""
+        if not self.pending:
+            return True
+        listed = self._listed_markers()
+        new = [p for p in self.pending if p in listed and self._stale.get(p) != listed[p]]
+        markers = dict(zip(new, self._pool.map(self._marker, new)))
+        still = []
+        for prefix in self.pending:
+            marker = markers.get(prefix)
+            if marker is not None and self.run_id is not None and marker.get("run_id") != self.run_id:
+                self._stale[prefix] = listed[prefix]
+                marker = None
+            if marker is None:
+                still.append(prefix)
+                continue
+            for rel, info in marker.get("objects", {}).items():
+                self._futures.append(self._pool.submit(self._fetch, prefix + rel, info.get("encoding")))
+            for rel in EXTRA_FILES:
+                self._futures.append(self._pool.submit(self._fetch, prefix + rel, optional=True))
+            self._futures.append(self._pool.submit(self._fetch, prefix + SUCCESS_MARKER))
+            self.done.append(prefix)
+            print(f"\n⬇ {prefix} finished; downloading ({len(self.done)}/{self.total})")
+        self.pending = still
+        return not self.pending
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.poll():
+                    return
+            except Exception as e:   # keep watching; the final pass in finish() reports for real
+                print(f"\n(i) result download: {e}")
+            self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="result-download", daemon=True)
+        self._thread.start()
+        return self
+
+    def finish(self):
+        """Stop watching, pick up shards that finished since the last check and wait for all downloads."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.pending:
+            self.poll()
+        for fut in self._futures:
+            fut.result()
+        self._pool.shutdown()
+        dt = time.monotonic() - self._started
+        print(f"✔ Downloaded {self.files} files ({self.bytes / 2**20:.1f} MiB) from {len(self.done)} shards "
+              f"to {self.dest} ({dt:.1f}s since submit)")
+        if self.pending:
+            print(f"⚠ No _SUCCESS marker (shard failed or still running): {', '.join(self.pending)}")
+        return self
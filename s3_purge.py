@@ -0,0 +1,86 @@
+"""
+Fast in-process deletion of everything under an S3 prefix.
+
+Keys are listed page by page (1000 per page) and each page is deleted with one
+DeleteObjects call on a thread pool, so deletion keeps pace with the listing
+instead of going one object at a time like `aws s3 rm --recursive`. At most
+2 x workers pages are in flight, so memory stays flat however large the prefix;
+the listing simply waits for deletes to finish.
+
+    python s3_purge.py <bucket> --prefix output/ --dry-run
+    python s3_purge.py <bucket> --prefix queue/1718000000/ --profile <profile>
+"""
+import argparse
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+from tqdm import tqdm
+
+DELETE_BATCH = 1000   # DeleteObjects maximum
+
+
+def _delete_batch(s3, bucket, keys):
+    try:
+        resp = s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True})
+    except Exception as e:
+        # the whole call failed (throttled past retries, access denied, ...): every key is left
+        return [{"Key": k, "Code": type(e).__name__, "Message": str(e)} for k in keys]
+    return resp.get("Errors", [])
+
+
+def purge_prefix(s3, bucket, prefix="", dry_run=False, workers=8, progress=True) -> dict:
+    """
+    Delete every object under `prefix` ("" = the whole bucket). With dry_run only
+    count them. Returns {"objects", "bytes", "errors", "failed"}; `failed` is the
+    number of objects that could not be deleted (0 means the prefix is empty now).
+    """
+    objects = nbytes = 0
+    errors, futures = [], set()
+    max_inflight = 2 * max(1, workers)
+    scope = f"s3://{bucket}/{prefix}"
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="purge") as pool, \
+         tqdm(unit="obj", desc=("counting " if dry_run else "deleting ") + scope, disable=not progress) as bar:
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix,
+                                                                 PaginationConfig={"PageSize": DELETE_BATCH}):
+            contents = page.get("Contents", [])
+            objects += len(contents)
+            nbytes += sum(o.get("Size", 0) for o in contents)
+            if dry_run or not contents:
+                bar.update(len(contents))
+                continue
+            if len(futures) >= max_inflight:
+                # keep at most max_inflight key lists alive: wait for a delete before listing on
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    errors.extend(fut.result())
+            fut = pool.submit(_delete_batch, s3, bucket, [o["Key"] for o in contents])
+            fut.add_done_callback(lambda f, n=len(contents): bar.update(n))
+            futures.add(fut)
+        for fut in futures:
+            errors.extend(fut.result())
+    verb = "Would delete" if dry_run else "Deleted"
+    print(f"✔ {verb} {objects - len(errors)} objects ({nbytes / 2**20:.1f} MiB) under {scope}")
+    if errors:
+        print(f"✖ {len(errors)} objects could not be deleted")
+    for e in errors[:10]:
+        print(f"  ✖ {e.get('Key')}: {e.get('Code')} {e.get('Message')}")
+    return {"objects": objects, "bytes": nbytes, "errors": errors, "failed": len(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bucket")
+    parser.add_argument("--prefix", default="", help='only keys under this prefix (default: whole bucket)')
+    parser.add_argument("--dry-run", action="store_true", help="count what would be deleted")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--profile", default=None)
+    parser.add_argument("--region", default=None)
+    args = parser.parse_args()
+    s3 = boto3.Session(profile_name=args.profile, region_name=args.region).client("s3")
+    result = purge_prefix(s3, args.bucket, args.prefix, dry_run=args.dry_run, workers=args.workers)
+    sys.exit(1 if result["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
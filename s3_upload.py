@@ -0,0 +1,206 @@
+"""
+In-process parallel upload of local shard folders to S3.
+
+All shard folders are walked once and every file goes through one shared
+thread pool: small files are a single PutObject each, large ones go through
+boto3's managed multipart transfer. This replaces one `aws s3 sync` subprocess
+per shard (CLI start-up plus a full remote listing each time, shards one after
+another).
+
+UploadCache makes re-runs incremental without listing the bucket: it remembers
+size, mtime, MD5 and the returned ETag of every uploaded key, so unchanged
+files are skipped after a stat() and touched-but-identical files after a hash.
+"""
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from tqdm import tqdm
+
+from data_formats import compress
+
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+
+
+def upload_client(session, workers):
+    """S3 client whose connection pool is large enough for `workers` concurrent transfers."""
+    return session.client("s3", config=Config(max_pool_connections=max(10, workers),
+                                              retries={"max_attempts": 10, "mode": "adaptive"}))
+
+
+def walk_sources(sources):
+    """sources: [(local_dir, key_prefix)]. Returns [(path, key, size)] for every file below them."""
+    files = []
+    for local_dir, prefix in sources:
+        for dirpath, _, names in os.walk(local_dir):
+            for name in sorted(names):
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(path, local_dir).replace(os.sep, "/")
+                files.append((path, prefix + rel, os.path.getsize(path)))
+    return files
+
+
+def _upload_one(s3, bucket, path, key, size, transfer_config, encoding):
+    """Upload one file (compressed with `encoding`); return (etag, stored bytes)."""
+    if encoding == "identity" and size >= transfer_config.multipart_threshold:
+        s3.upload_file(path, bucket, key, Config=transfer_config)
+        return s3.head_object(Bucket=bucket, Key=key)["ETag"], size
+    with open(path, "rb") as f:
+        body = f.read()
+    extra = {}
+    if encoding != "identity":
+        body = compress(body, encoding)
+        extra["ContentEncoding"] = encoding
+    if len(body) >= transfer_config.multipart_threshold:
+        s3.upload_fileobj(io.BytesIO(body), bucket, key, ExtraArgs=extra, Config=transfer_config)
+        return s3.head_object(Bucket=bucket, Key=key)["ETag"], len(body)
+    return s3.put_object(Bucket=bucket, Key=key, Body=body, **extra)["ETag"], len(body)
+
+
+def upload_files(s3, bucket, files, workers=32, multipart_threshold=MULTIPART_THRESHOLD,
+                 multipart_chunksize=MULTIPART_CHUNKSIZE, progress=True, on_uploaded=None,
+                 encoding="identity") -> dict:
+    """
+    Upload [(path, key, size)] concurrently, compressed with `encoding` ("identity",
+    "gzip" or "zstd", stored as the objects' Content-Encoding). Returns
+    {"files", "bytes", "stored_bytes", "seconds", "etags": {key: etag}} and prints
+    aggregate throughput. on_uploaded(path, key, size, etag, stored) is called as
+    each upload finishes.
+    """
+    transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                     multipart_chunksize=multipart_chunksize,
+                                     max_concurrency=4)
+    etags = {}
+    stored_bytes = 0
+    total_bytes = sum(size for _, _, size in files)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="upload") as pool, \
+         tqdm(total=total_bytes, unit="B", unit_scale=True, disable=not progress) as bar:
+        futures = {pool.submit(_upload_one, s3, bucket, path, key, size, transfer_config, encoding): (path, key, size)
+                   for path, key, size in files}
+        for fut in as_completed(futures):
+            path, key, size = futures[fut]
+            etags[key], stored = fut.result()
+            stored_bytes += stored
+            if on_uploaded is not None:
+                on_uploaded(path, key, size, etags[key], stored)
+            bar.update(size)
+    dt = time.perf_counter() - t0
+    if files:
+        print(f"✔ Uploaded {len(files)} files, {total_bytes / 2**20:.1f} MiB in {dt:.1f}s "
+              f"({len(files) / dt:.1f} files/s, {total_bytes / 2**20 / dt:.2f} MiB/s)")
+        if encoding != "identity":
+            print(f"  {encoding}: {stored_bytes / 2**20:.1f} MiB sent "
+                  f"({stored_bytes / max(1, total_bytes):.1%} of the original)")
+    return {"files": len(files), "bytes": total_bytes, "stored_bytes": stored_bytes, "seconds": dt, "etags": etags}
+
+
+def file_md5(path, chunk=1024 * 1024) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class UploadCache:
+    """
+    Local record of what is already in the bucket, one JSON file per bucket:
+
+        {"version": 1, "objects": {key: {"path", "size", "mtime_ns", "md5", "encoding", "stored", "etag"}}}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.objects = {}
+        self._digests = {}      # key -> MD5 hashed by plan(), reused by record()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.objects = json.load(f).get("objects", {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": 1, "objects": self.objects}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        self.objects = {}
+
+    def plan(self, files, encoding="identity"):
+        """Split [(path, key, size)] into (to upload, unchanged) without touching the bucket."""
+        todo, unchanged = [], []
+        for path, key, size in files:
+            st = os.stat(path)
+            e = self.objects.get(key)
+            if e and e.get("encoding", "identity") != encoding:
+                e = None    # stored with another encoding: upload again
+            if e and e["path"] == path and e["size"] == size and e["mtime_ns"] == st.st_mtime_ns:
+                unchanged.append((path, key, size))
+                continue
+            digest = file_md5(path)
+            if e and e["size"] == size and e["md5"] == digest:
+                # touched (e.g. re-staged) but identical: just refresh what we know
+                e.update(path=path, mtime_ns=st.st_mtime_ns)
+                unchanged.append((path, key, size))
+                continue
+            self._digests[key] = digest
+            todo.append((path, key, size))
+        return todo, unchanged
+
+    def record(self, path, key, size, etag, stored, encoding="identity"):
+        self.objects[key] = {"path": path, "size": size, "mtime_ns": os.stat(path).st_mtime_ns,
+                             "md5": self._digests.pop(key, None) or file_md5(path),
+                             "encoding": encoding, "stored": stored, "etag": etag}
+
+    def reconcile_etags(self, known):
+        """
+        Forget entries that `known` ({key: etag}, e.g. the shards' last manifests)
+        lists with another ETag. No requests; keys `known` doesn't mention are kept.
+        """
+        stale = [k for k, etag in known.items() if k in self.objects and self.objects[k]["etag"] != etag]
+        for k in stale:
+            del self.objects[k]
+        return len(stale)
+
+    def reconcile(self, s3, bucket, prefixes):
+        """
+        Forget entries whose object is gone from the bucket or has a different ETag
+        (e.g. someone else rewrote it or deleted it). One listing per prefix; an
+        opt-in repair step, as it costs a full listing of the prefixes.
+        """
+        remote = {}
+        for prefix in prefixes:
+            for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+                remote.update((o["Key"], o["ETag"]) for o in page.get("Contents", []))
+        stale = [k for k, e in self.objects.items()
+                 if any(k.startswith(p) for p in prefixes) and remote.get(k) != e["etag"]]
+        for k in stale:
+            del self.objects[k]
+        return len(stale)
+
+
+def sync_files(s3, bucket, files, cache, workers=32, progress=True, encoding="identity") -> list:
+    """
+    Upload only the files the cache doesn't know as unchanged; return
+    [{"key", "size", "etag"}] (size as stored in S3) for every file, uploaded or skipped.
+    """
+    todo, unchanged = cache.plan(files, encoding)
+    print(f"ℹ {len(unchanged)} files unchanged since the last upload, {len(todo)} to upload")
+
+    def record(path, key, size, etag, stored):
+        cache.record(path, key, size, etag, stored, encoding)
+
+    try:
+        upload_files(s3, bucket, todo, workers=workers, progress=progress, on_uploaded=record, encoding=encoding)
+    finally:
+        cache.save()    # keep what did make it up, even if the run is interrupted
+    return [{"key": key, "size": cache.objects[key].get("stored", size), "etag": cache.objects[key]["etag"]}
+            for _, key, size in files]
@@ -0,0 +1,48 @@
+"""
+Size-aware shard planning.
+
+Instead of one shard per data folder, every file of the corpus is assigned to
+one of `shards` shards with the longest-processing-time heuristic: files
+sorted by cost (bytes by default), biggest first, each going to the currently
+lightest shard. The makespan then stays within 4/3 of the optimum and, for many
+small files, close to total work / shards.
+
+The assignment is stored as the shard manifests (input/<shard>/_manifest.json),
+which may list keys from any folder; the worker reads them unchanged.
+"""
+import heapq
+import os
+
+
+def corpus_folders(data_path):
+    """The numbered shard folders under data_path, in numeric order."""
+    return sorted((n for n in os.listdir(data_path) if n.isdigit() and os.path.isdir(os.path.join(data_path, n))),
+                  key=int)
+
+
+def plan_shards(files, shards, cost=lambda f: f[2]):
+    """
+    Assign [(path, key, size)] to `shards` shards (LPT). Returns one list per
+    shard, each in key order like an S3 listing.
+    """
+    heap = [(0, i) for i in range(shards)]
+    plan = [[] for _ in range(shards)]
+    for f in sorted(files, key=lambda f: (-cost(f), f[1])):
+        load, i = heapq.heappop(heap)
+        plan[i].append(f)
+        heapq.heappush(heap, (load + cost(f), i))
+    return [sorted(s, key=lambda f: f[1]) for s in plan]
+
+
+def skew_report(groups, title, cost=lambda f: f[2]):
+    """Print per-shard files/bytes and the predicted makespan against a perfect split."""
+    loads = [sum(cost(f) for f in g) for g in groups]
+    total = sum(loads)
+    ideal = total / len(groups) if groups else 0
+    print(f"\n{title}")
+    for i, (g, load) in enumerate(zip(groups, loads), start=1):
+        print(f"  shard {i:>3}: {len(g):>8} files  {load / 2**20:>10.2f} MiB")
+    if ideal:
+        print(f"  makespan {max(loads) / 2**20:.2f} MiB vs ideal {ideal / 2**20:.2f} MiB "
+              f"(skew {max(loads) / ideal:.3f}x)")
+    return {"loads": loads, "ideal": ideal, "skew": max(loads) / ideal if ideal else None}
@@ -1,13 +1,13 @@
 import subprocess
 import json
 
-import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+import aws_clients
 
 def create_bucket(bucket, region, profile=None):
-    # Use a Session so we can honor your profile
-    session = boto3.Session(profile_name=profile, region_name=region)
-    s3 = session.client("s3")
+    # Cached client for your profile
+    s3 = aws_clients.client("s3", profile, region)
 
     # Fast idempotency: if you can head the bucket, you're done
     try:
@@ -49,18 +49,13 @@ def create_bucket(bucket, region, profile=None):
 def ensure_sso_logged_in(AWS, PROFILE):
     """Runs aws sso login only if the SSO session is expired or missing."""
     try:
-        # Try a simple command that requires valid credentials
-        subprocess.run(
-            [AWS, "sts", "get-caller-identity", "--profile", PROFILE],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            text=True,
-        )
+        # Try a simple call that requires valid credentials (in-process, no CLI start-up)
+        aws_clients.client("sts", PROFILE).get_caller_identity()
         print(f"✅ Already logged in to AWS SSO profile: {PROFILE}")
-    except subprocess.CalledProcessError:
+    except (BotoCoreError, ClientError):
         print(f"🔄 SSO session expired or missing, logging in to {PROFILE}...")
         subprocess.run([AWS, "sso", "login", "--profile", PROFILE], check=True)
+        aws_clients.reset(PROFILE)     # drop clients holding the old credentials
         print("✅ AWS SSO login successful!")
 
 def sh(cmd, check=True, echo=True, **kwargs):
@@ -71,6 +66,7 @@ def sh(cmd, check=True, echo=True, **kwargs):
 def aws_json(AWS, args, check=False):
     """
     Call AWS CLI and parse JSON. Returns dict or None.
+    Only for commands without an API equivalent; prefer aws_clients.call_json.
     """
     r = sh([AWS, *args, "--output", "json"], check=check, capture_output=True)
     if r.returncode != 0:
@@ -0,0 +1,141 @@
+"""
+Reconcile the VPC endpoints the private Fargate tasks/pods need.
+
+One paginated describe_vpc_endpoints lists every endpoint in the VPC. It is
+diffed against the wanted set:
+- missing endpoints are created;
+- existing interface endpoints get any missing AZs (subnets) and security groups;
+- existing gateway endpoints get any missing route tables.
+All changes run concurrently. Then one describe call per poll waits until
+every endpoint is `available`, so the next step doesn't launch tasks that
+can't reach ECR/STS/S3 yet.
+
+Shared by the EKS and Batch step03 scripts.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from waiters import wait_for
+
+GONE = {"deleting", "deleted", "rejected", "failed", "expired"}
+
+
+def discover(ec2, vpc_id) -> dict:
+    """service name -> list of live endpoints in the VPC (one paginated call)."""
+    found = {}
+    for page in ec2.get_paginator("describe_vpc_endpoints").paginate(
+            Filters=[{"Name": "vpc-id", "Values": [vpc_id]}]):
+        for vpe in page.get("VpcEndpoints", []):
+            if vpe.get("State", "").lower() not in GONE:
+                found.setdefault(vpe["ServiceName"], []).append(vpe)
+    return found
+
+
+def one_subnet_per_az(subnets) -> list:
+    """
+    Interface endpoints take at most one subnet per AZ (else DuplicateSubnetsInSameZone).
+    Prefer private (internal-elb tagged) subnets, then the one with most free IPs.
+    """
+    def score(sn):
+        tags = {t["Key"]: t["Value"] for t in sn.get("Tags", [])}
+        private = tags.get("kubernetes.io/role/internal-elb") in ("1", "true")
+        return (private, sn.get("AvailableIpAddressCount", 0))
+    by_az = {}
+    for sn in subnets:
+        az = sn["AvailabilityZone"]
+        if az not in by_az or score(sn) > score(by_az[az]):
+            by_az[az] = sn
+    return [sn["SubnetId"] for sn in by_az.values()]
+
+
+def plan(existing, vpc_id, region, interface, gateway, want_subnets, az_of, sg_ids, route_table_ids) -> list:
+    """
+    Diff the wanted endpoints against discover() output. want_subnets holds one
+    subnet per AZ; az_of maps these and the existing endpoints' subnets to
+    their AZ. Returns [(service, action, kwargs)], action in create / modify / ok.
+    """
+    actions = []
+    for service in interface:
+        name = f"com.amazonaws.{region}.{service}"
+        vpes = [v for v in existing.get(name, []) if v["VpcEndpointType"] == "Interface"]
+        if not vpes:
+            actions.append((service, "create", dict(
+                VpcId=vpc_id, ServiceName=name, VpcEndpointType="Interface",
+                SubnetIds=want_subnets, SecurityGroupIds=list(sg_ids), PrivateDnsEnabled=True)))
+            continue
+        vpe = vpes[0]
+        have_azs = {az_of.get(s) for s in vpe.get("SubnetIds", [])}
+        add_subnets = [s for s in want_subnets if az_of[s] not in have_azs]
+        add_sgs = sorted(set(sg_ids) - {g["GroupId"] for g in vpe.get("Groups", [])})
+        kwargs = {"VpcEndpointId": vpe["VpcEndpointId"]}
+        if add_subnets:
+            kwargs["AddSubnetIds"] = add_subnets
+        if add_sgs:
+            kwargs["AddSecurityGroupIds"] = add_sgs
+        actions.append((service, "modify" if len(kwargs) > 1 else "ok", kwargs))
+    for service in gateway:
+        name = f"com.amazonaws.{region}.{service}"
+        vpes = [v for v in existing.get(name, []) if v["VpcEndpointType"] == "Gateway"]
+        # a route table served by any gateway endpoint for this service already has the route
+        have = {rt for v in vpes for rt in v.get("RouteTableIds", [])}
+        missing = [rt for rt in route_table_ids if rt not in have]
+        if not vpes:
+            if missing:
+                actions.append((service, "create", dict(VpcId=vpc_id, ServiceName=name, VpcEndpointType="Gateway",
+                                                        RouteTableIds=missing)))
+        elif missing:
+            actions.append((service, "modify", {"VpcEndpointId": vpes[0]["VpcEndpointId"], "AddRouteTableIds": missing}))
+        else:
+            actions.append((service, "ok", {"VpcEndpointId": vpes[0]["VpcEndpointId"]}))
+    return actions
+
+
+def _apply(ec2, service, action, kwargs):
+    if action == "create":
+        vpe_id = ec2.create_vpc_endpoint(**kwargs)["VpcEndpoint"]["VpcEndpointId"]
+        print(f"✔ Created {kwargs['VpcEndpointType'].lower()} endpoint {service}: {vpe_id}")
+        return vpe_id
+    if action == "modify":
+        ec2.modify_vpc_endpoint(**kwargs)
+        added = ", ".join(f"{k[3:]}={','.join(v)}" for k, v in kwargs.items() if k.startswith("Add"))
+        print(f"✔ Updated endpoint {service} ({added})")
+    else:
+        print(f"✔ Endpoint exists: {service} ({kwargs['VpcEndpointId']})")
+    return kwargs["VpcEndpointId"]
+
+
+def reconcile_endpoints(ec2, vpc_id, region, subnet_ids, sg_ids, route_table_ids=(),
+                        interface=("ecr.api", "ecr.dkr", "sts", "logs"), gateway=("s3",),
+                        workers=8, timeout=900) -> dict:
+    """Make the VPC's endpoints match the wanted set and wait until all are available. Returns service -> endpoint id."""
+    existing = discover(ec2, vpc_id)
+    have_subnets = {s for vpes in existing.values() for v in vpes for s in v.get("SubnetIds", [])}
+    subnets = ec2.describe_subnets(SubnetIds=sorted(set(subnet_ids) | have_subnets))["Subnets"]
+    az_of = {sn["SubnetId"]: sn["AvailabilityZone"] for sn in subnets}
+    want_subnets = one_subnet_per_az([sn for sn in subnets if sn["SubnetId"] in set(subnet_ids)])
+    print("Interface endpoint subnets (one per AZ):", ", ".join(want_subnets))
+    actions = plan(existing, vpc_id, region, interface, gateway if route_table_ids else (),
+                   want_subnets, az_of, sg_ids, route_table_ids)
+
+    ids, errors = {}, []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="vpce") as pool:
+        futures = {service: pool.submit(_apply, ec2, service, action, kwargs) for service, action, kwargs in actions}
+        for service, fut in futures.items():
+            try:
+                ids[service] = fut.result()
+            except Exception as e:
+                errors.append(f"{service}: {e}")
+                print(f"⚠️ Endpoint {service}: {e}")
+
+    if ids:
+        def states():   # e.g. (("available", 3), ("pending", 2))
+            vpes = ec2.describe_vpc_endpoints(VpcEndpointIds=sorted(set(ids.values())))["VpcEndpoints"]
+            counts = {}
+            for v in vpes:
+                counts[v.get("State", "").lower()] = counts.get(v.get("State", "").lower(), 0) + 1
+            return tuple(sorted(counts.items()))
+        wait_for(f"{len(ids)} VPC endpoints available", states, initial=2, max_interval=15, timeout=timeout,
+                 done=lambda st: all(s == "available" for s, _ in st),
+                 failed=lambda st: any(s in GONE for s, _ in st))
+    if errors:
+        raise RuntimeError("VPC endpoint reconciliation failed: " + "; ".join(errors))
+    return ids
@@ -0,0 +1,108 @@
+"""
+Polling waits for provisioning and teardown.
+
+wait_for() calls probe() until done(state) holds. The first re-check comes
+quickly, then the interval grows by `factor` up to `max_interval`, with random
+jitter so concurrent waits don't poll in lockstep. A wait gives up at its
+deadline (WaitTimeout) and stops early when failed(state) reports a terminal
+failure (WaitFailed). Each wait prints its state changes and its total time.
+wait_all() runs several waits on threads and returns when all have finished.
+
+Time comes from a clock object (monotonic() and sleep()). Pass a FakeClock to
+run waits instantly in tests.
+"""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WaitTimeout(TimeoutError):
+    pass
+
+
+class WaitFailed(RuntimeError):
+    pass
+
+
+class Clock:
+    monotonic = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+
+
+class FakeClock:
+    """sleep() advances the time instead of blocking; `slept` records every call."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class WaitResult:
+    def __init__(self, name, state, seconds, polls):
+        self.name = name
+        self.state = state
+        self.seconds = seconds
+        self.polls = polls
+
+    def __repr__(self):
+        return f"WaitResult({self.name!r}, {self.state!r}, {self.seconds:.1f}s, {self.polls} polls)"
+
+
+def wait_for(name, probe, done, failed=None, timeout=900, initial=2.0, max_interval=30.0,
+             factor=1.5, jitter=0.25, clock=None, rng=None, quiet=False) -> WaitResult:
+    """
+    Poll probe() until done(state). failed(state) may return a reason (or True)
+    to abort at once. Raises WaitTimeout once `timeout` seconds have passed.
+    """
+    clock = clock or Clock()
+    rng = rng or random
+    start = clock.monotonic()
+    deadline = start + timeout
+    interval, polls, last = initial, 0, object()
+    while True:
+        state = probe()
+        polls += 1
+        elapsed = clock.monotonic() - start
+        if state != last and not quiet:
+            print(f"[wait] {name}: {state} ({elapsed:.0f}s)")
+        last = state
+        if done(state):
+            if not quiet:
+                print(f"✔ {name}: {state} after {elapsed:.1f}s ({polls} polls)")
+            return WaitResult(name, state, elapsed, polls)
+        reason = failed(state) if failed else None
+        if reason:
+            raise WaitFailed(f"{name}: {state}" + (f" ({reason})" if isinstance(reason, str) else ""))
+        remaining = deadline - clock.monotonic()
+        if remaining <= 0:
+            raise WaitTimeout(f"{name}: still {state} after {elapsed:.0f}s")
+        clock.sleep(min(remaining, interval * (1 - jitter * rng.random())))
+        interval = min(max_interval, interval * factor)
+
+
+def wait_all(waits, quiet=False) -> list:
+    """
+    Run zero-argument callables (usually lambdas around wait_for) concurrently.
+    Returns their results in order; if any failed, raises the first error once all have ended.
+    """
+    waits = list(waits)
+    if not waits:
+        return []
+    with ThreadPoolExecutor(max_workers=len(waits), thread_name_prefix="wait") as pool:
+        futures = [pool.submit(w) for w in waits]
+        errors = [f.exception() for f in futures]
+    for err in errors:
+        if err is not None:
+            raise err
+    results = [f.result() for f in futures]
+    timed = [r for r in results if isinstance(r, WaitResult)]
+    if timed and not quiet:
+        print("ℹ Wait times: " + ", ".join(f"{r.name} {r.seconds:.1f}s" for r in timed))
+    return results
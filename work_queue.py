@@ -0,0 +1,48 @@
+"""
+Launcher side of the worker's queue mode (WORK_MODE=queue): split the uploaded
+inputs into small tasks and store them as one task list for the workers to claim.
+
+Layout (see dummy docker context/app/workqueue.py for the worker side):
+
+    <queue_prefix>tasks.json   {"version": 1, "tasks": [{"id": "000001", "keys": [...]}, ...]}
+"""
+import json
+
+from botocore.exceptions import ClientError
+
+from data_formats import MANIFEST_NAME
+
+TASKS_NAME = "tasks.json"
+
+
+def input_keys(s3, bucket, prefix):
+    """Keys under `prefix`, from its manifest if step04 wrote one, else from a listing."""
+    try:
+        body = s3.get_object(Bucket=bucket, Key=prefix + MANIFEST_NAME)["Body"].read()
+        return [o["key"] for o in json.loads(body)["objects"]]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+            raise
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(o["Key"] for o in page.get("Contents", []) if not o["Key"].endswith("/" + MANIFEST_NAME))
+    return keys
+
+
+def build_tasks(keys, batch_files) -> list:
+    """Cut `keys` into tasks of at most `batch_files` keys, keeping their order."""
+    batch_files = max(1, int(batch_files))
+    return [{"id": f"{n + 1:06d}", "keys": keys[i:i + batch_files]}
+            for n, i in enumerate(range(0, len(keys), batch_files))]
+
+
+def write_task_queue(s3, bucket, queue_prefix, input_prefixes, batch_files) -> list:
+    """Build the tasks for every input prefix and store them as `queue_prefix` + TASKS_NAME."""
+    keys = []
+    for prefix in input_prefixes:
+        keys.extend(input_keys(s3, bucket, prefix))
+    tasks = build_tasks(keys, batch_files)
+    s3.put_object(Bucket=bucket, Key=queue_prefix + TASKS_NAME,
+                  Body=json.dumps({"version": 1, "tasks": tasks}).encode("utf-8"),
+                  ContentType="application/json")
+    return tasks